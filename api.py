@@ -0,0 +1,293 @@
+"""
+HTTP API расписаний только для чтения: JSON по дню и неделе группы и календарь .ics из schedule_cache
+
+Ответы собираются один раз и отдаются из памяти с ETag, пока запись в кеш не сбросит их.
+"""
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, timezone
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from aiohttp import web
+
+import metrics
+
+# Дни недели группы: дата -> (статус, пары); None — сайт не ответил
+WeekLoader = Callable[[str, str, date], Awaitable[Optional[Dict[date, Tuple[str, List[Dict]]]]]]
+GROUP_PATH = r'/api/{faculty:\d+}/{group:\d+}'
+
+
+class Payload(NamedTuple):
+    body: bytes
+    etag: str
+    content_type: str
+
+
+class WeekEntry(NamedTuple):
+    built: float
+    week: Payload
+    days: List[Payload]
+    lessons: Dict[date, Tuple[str, List[Dict]]]
+
+
+def make_payload(body: bytes, content_type: str) -> Payload:
+    return Payload(body, '"%s"' % hashlib.sha256(body).hexdigest()[:20], content_type)
+
+
+def json_payload(data) -> Payload:
+    return make_payload(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode(), 'application/json')
+
+
+def day_data(faculty_id: str, group_id: str, day: date, status: str, lessons: List[Dict]) -> Dict:
+    return {'faculty_id': faculty_id, 'group_id': group_id, 'date': day.isoformat(),
+            'status': status, 'lessons': lessons}
+
+
+# ==================== iCalendar ====================
+def ics_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_fold(line: str) -> str:
+    """Строки длиннее 75 октетов переносятся, продолжение начинается с пробела (RFC 5545)"""
+    if len(line.encode()) <= 75:
+        return line
+    parts, current, limit = [], '', 75
+    for char in line:
+        if len((current + char).encode()) > limit:
+            parts.append(current)
+            current, limit = '', 74
+        current += char
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def lesson_moment(day: date, clock: str, tz) -> Optional[datetime]:
+    """Время пары по местному времени (tz — часовой пояс pytz) в UTC"""
+    try:
+        hours, minutes = map(int, clock.split(':'))
+        return tz.localize(datetime.combine(day, time(hours, minutes))).astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+
+def render_ics(faculty_id: str, group_id: str, title: str, days: List[Tuple[date, List[Dict]]], tz) -> bytes:
+    """Календарь группы; DTSTAMP — начало первого дня, чтобы одинаковое расписание давало тот же ETag"""
+    stamp = f"{days[0][0]:%Y%m%d}T000000Z" if days else "19700101T000000Z"
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//rsreu-schedule-bot//RU',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{ics_escape(title)}',
+        'REFRESH-INTERVAL;VALUE=DURATION:PT6H',
+        'X-PUBLISHED-TTL:PT6H',
+    ]
+    for day, lessons in days:
+        for lesson in lessons:
+            start = lesson_moment(day, lesson['start'], tz)
+            end = lesson_moment(day, lesson['end'], tz)
+            if start is None or end is None:
+                continue
+            lines += [
+                'BEGIN:VEVENT',
+                f"UID:{faculty_id}-{group_id}-{day:%Y%m%d}-{lesson['number']}@rsreu-schedule-bot",
+                f'DTSTAMP:{stamp}',
+                f'DTSTART:{start:%Y%m%dT%H%M%SZ}',
+                f'DTEND:{end:%Y%m%dT%H%M%SZ}',
+                f"SUMMARY:{ics_escape(lesson['subject'])} ({ics_escape(lesson['type'])})",
+                f"LOCATION:{ics_escape(lesson['audience'])}",
+                f"DESCRIPTION:{ics_escape(lesson['teacher'])}",
+                'END:VEVENT',
+            ]
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(ics_fold(line) for line in lines) + '\r\n').encode()
+
+
+# ==================== СЕРВЕР ====================
+class ScheduleApi:
+    """Готовые ответы по неделям групп в памяти (LRU на cache_size недель)
+
+    Неделя собирается одним вызовом load_week — из schedule_cache, а при его
+    отсутствии одним запросом к сайту — и сразу даёт ответы на неделю, на каждый
+    её день и материал для календаря. Запись дня в кеш сбрасывает неделю через
+    invalidate; не дольше max_age секунд ответ живёт и без этого (записи других
+    процессов). Одновременные запросы одной недели ждут одну сборку.
+
+    Чтобы API нельзя было использовать для обхода сайта, неизвестные группы
+    (known_group) и даты дальше days_back дней назад или days_ahead вперёд получают
+    404, а неудачная загрузка недели повторяется не раньше чем через failure_ttl секунд.
+    """
+
+    def __init__(self, load_week: WeekLoader, tz, group_title: Callable[[str, str], str],
+                 known_group: Callable[[str, str], bool], calendar_weeks: int = 2, cache_size: int = 2000,
+                 max_age: float = 3600.0, days_back: int = 14, days_ahead: int = 42, failure_ttl: float = 60.0,
+                 requests: Optional[metrics.Counter] = None):
+        self.load_week = load_week
+        self.tz = tz
+        self.group_title = group_title
+        self.known_group = known_group
+        self.calendar_weeks = calendar_weeks
+        self.cache_size = cache_size
+        self.max_age = max_age
+        self.days_back = days_back
+        self.days_ahead = days_ahead
+        self.failure_ttl = failure_ttl
+        self.requests = requests
+        self.weeks: 'OrderedDict[Tuple[str, str, date], WeekEntry]' = OrderedDict()
+        self.calendars: 'OrderedDict[Tuple[str, str, date], Tuple[float, Payload]]' = OrderedDict()
+        # Недели, которые не удалось загрузить, и когда это было
+        self.failures: 'OrderedDict[Tuple[str, str, date], float]' = OrderedDict()
+        self.loading: Dict[Tuple[str, str, date], asyncio.Future] = {}
+        self.builds = 0
+        self.runner: Optional[web.AppRunner] = None
+
+    def invalidate(self, faculty_id: str, group_id: str, day: date):
+        monday = day - timedelta(days=day.weekday())
+        self.weeks.pop((faculty_id, group_id, monday), None)
+        for weeks_back in range(self.calendar_weeks):
+            self.calendars.pop((faculty_id, group_id, monday - timedelta(weeks=weeks_back)), None)
+
+    def remember(self, cache: OrderedDict, key, value):
+        cache[key] = value
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    async def build_week(self, key: Tuple[str, str, date]) -> Optional[WeekEntry]:
+        faculty_id, group_id, monday = key
+        lessons = await self.load_week(faculty_id, group_id, monday)
+        if lessons is None:
+            self.remember(self.failures, key, monotonic())
+            return None
+        self.failures.pop(key, None)
+        self.builds += 1
+        days = [day_data(faculty_id, group_id, day, *lessons[day]) for day in sorted(lessons)]
+        entry = WeekEntry(
+            monotonic(),
+            json_payload({'faculty_id': faculty_id, 'group_id': group_id, 'week_start': monday.isoformat(),
+                          'days': days}),
+            [json_payload(data) for data in days],
+            lessons,
+        )
+        self.remember(self.weeks, key, entry)
+        return entry
+
+    async def week(self, faculty_id: str, group_id: str, monday: date) -> Optional[WeekEntry]:
+        key = (faculty_id, group_id, monday)
+        entry = self.weeks.get(key)
+        if entry and monotonic() - entry.built < self.max_age:
+            self.weeks.move_to_end(key)
+            return entry
+        failed = self.failures.get(key)
+        if failed is not None and monotonic() - failed < self.failure_ttl:
+            return None
+        task = self.loading.get(key)
+        if task is None:
+            task = self.loading[key] = asyncio.ensure_future(self.build_week(key))
+            task.add_done_callback(lambda _: self.loading.pop(key, None))
+        # Отмена одного запроса не должна отменять сборку для остальных
+        return await asyncio.shield(task)
+
+    async def calendar(self, faculty_id: str, group_id: str) -> Optional[Payload]:
+        today = datetime.now(self.tz).date()
+        monday = today - timedelta(days=today.weekday())
+        key = (faculty_id, group_id, monday)
+        cached = self.calendars.get(key)
+        if cached and monotonic() - cached[0] < self.max_age:
+            self.calendars.move_to_end(key)
+            return cached[1]
+        days = []
+        for weeks_ahead in range(self.calendar_weeks):
+            entry = await self.week(faculty_id, group_id, monday + timedelta(weeks=weeks_ahead))
+            if entry is None:
+                return None
+            days += [(day, lessons) for day, (_, lessons) in sorted(entry.lessons.items())]
+        title = f"РГРТУ, гр. {self.group_title(faculty_id, group_id)}"
+        payload = make_payload(render_ics(faculty_id, group_id, title, days, self.tz), 'text/calendar')
+        self.remember(self.calendars, key, (monotonic(), payload))
+        return payload
+
+    def respond(self, request: web.Request, endpoint: str, payload: Optional[Payload]) -> web.Response:
+        known = [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]
+        if payload is None:
+            result, response = 'unavailable', web.json_response({'error': 'schedule unavailable'}, status=503)
+        elif payload.etag in known:
+            result, response = 'not_modified', web.Response(status=304, headers={'ETag': payload.etag})
+        else:
+            result = 'ok'
+            response = web.Response(body=payload.body, content_type=payload.content_type, charset='utf-8',
+                                    headers={'ETag': payload.etag, 'Cache-Control': 'public, max-age=300'})
+        if self.requests:
+            self.requests.inc(endpoint=endpoint, result=result)
+        return response
+
+    def bad_request(self, endpoint: str, error: str) -> web.Response:
+        if self.requests:
+            self.requests.inc(endpoint=endpoint, result='bad_request')
+        return web.json_response({'error': error}, status=400)
+
+    def not_found(self, endpoint: str, error: str) -> web.Response:
+        if self.requests:
+            self.requests.inc(endpoint=endpoint, result='not_found')
+        return web.json_response({'error': error}, status=404)
+
+    def reject(self, request: web.Request, endpoint: str, day: Optional[date] = None) -> Optional[web.Response]:
+        """404 для неизвестной группы и даты вне окна; None — запрос можно обслужить"""
+        if not self.known_group(request.match_info['faculty'], request.match_info['group']):
+            return self.not_found(endpoint, 'unknown group')
+        if day is not None:
+            today = datetime.now(self.tz).date()
+            if not today - timedelta(days=self.days_back) <= day <= today + timedelta(days=self.days_ahead):
+                return self.not_found(endpoint, 'date out of range')
+        return None
+
+    async def handle_day(self, request: web.Request) -> web.Response:
+        try:
+            day = date.fromisoformat(request.match_info['date'])
+        except ValueError:
+            return self.bad_request('day', 'date must be YYYY-MM-DD')
+        rejected = self.reject(request, 'day', day)
+        if rejected:
+            return rejected
+        entry = await self.week(request.match_info['faculty'], request.match_info['group'],
+                                day - timedelta(days=day.weekday()))
+        return self.respond(request, 'day', entry.days[day.weekday()] if entry else None)
+
+    async def handle_week(self, request: web.Request) -> web.Response:
+        try:
+            day = date.fromisoformat(request.match_info['date']) if 'date' in request.match_info \
+                else datetime.now(self.tz).date()
+        except ValueError:
+            return self.bad_request('week', 'date must be YYYY-MM-DD')
+        rejected = self.reject(request, 'week', day)
+        if rejected:
+            return rejected
+        entry = await self.week(request.match_info['faculty'], request.match_info['group'],
+                                day - timedelta(days=day.weekday()))
+        return self.respond(request, 'week', entry.week if entry else None)
+
+    async def handle_calendar(self, request: web.Request) -> web.Response:
+        rejected = self.reject(request, 'ics')
+        if rejected:
+            return rejected
+        payload = await self.calendar(request.match_info['faculty'], request.match_info['group'])
+        return self.respond(request, 'ics', payload)
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get(GROUP_PATH + '/day/{date}', self.handle_day)
+        app.router.add_get(GROUP_PATH + '/week', self.handle_week)
+        app.router.add_get(GROUP_PATH + '/week/{date}', self.handle_week)
+        app.router.add_get(GROUP_PATH + '.ics', self.handle_calendar)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
@@ -0,0 +1,1053 @@
+"""
+Бенчмарки бота расписания РГРТУ
+
+Запуск:
+python3 bench.py prefetch --groups 50
+python3 bench.py broadcast --users 1000 10000 50000 --groups 300
+python3 bench.py broadcast --users 10000 --scenarios daily --send-delay 0 --logging sync-debug queue --log-file /tmp/bench.log
+python3 bench.py fsm --ops 5000
+python3 bench.py workers --users 3000 --workers 1 2 4 --kill
+python3 bench.py retry
+python3 bench.py metrics
+python3 bench.py updates --updates 2000 --modes polling webhook --webhook-workers 8 32
+python3 bench.py updates --updates 2000 --modes polling --max-concurrent 0 8 32 --repeat 2
+python3 bench.py startup --runs 5
+python3 bench.py api --groups 300 --requests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import resource
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+import aiohttp
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMessage
+
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+
+import main
+import metrics
+import worker
+from fsm_storage import SQLiteStorage
+from job_queue import JobQueue
+
+ROOT = Path(__file__).parent
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса в мегабайтах (ru_maxrss в Linux — в килобайтах)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ==================== ПРЕДЗАГРУЗКА РАСПИСАНИЙ ====================
+async def fetch_week_buffered(url: str):
+    """Старый путь: весь ответ в строку, затем полное дерево BeautifulSoup"""
+    from bs4 import BeautifulSoup
+    html = await main.fetch_html(url)
+    if not html:
+        return None
+    soup = BeautifulSoup(html, 'html.parser')
+    return soup.find('table')
+
+
+async def run_prefetch(mode: str, groups: int, weeks: int, no_rate_limit: bool):
+    main.http_session = main.create_http_session()
+    if no_rate_limit:
+        main.MAX_REQUESTS_PER_MINUTE = 10 ** 9
+    tmp = tempfile.TemporaryDirectory()
+    main.DB_PATH = str(Path(tmp.name) / 'bench.db')
+    try:
+        await main.init_db()
+        await main.load_all_groups_background()
+        targets = list(main.all_groups_cache.values())[:groups]
+        today = datetime.now(main.LOCAL_TIMEZONE).date()
+        fetch = main.fetch_week_table if mode == 'stream' else fetch_week_buffered
+
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        pages = 0
+        for group in targets:
+            for week in range(weeks):
+                target_date = today + timedelta(weeks=week)
+                params = {
+                    'faculty': group['faculty_id'],
+                    'group': group['group_id'],
+                    'week': target_date.isocalendar()[1],
+                    'year': target_date.year,
+                }
+                if await fetch(f"{main.SCHEDULE_URL}?{urlencode(params)}") is not None:
+                    pages += 1
+        elapsed = time.perf_counter() - started
+    finally:
+        await main.http_session.close()
+        tmp.cleanup()
+
+    print(f"{mode:>8}: {pages} страниц за {elapsed:.1f} с, "
+          f"пиковый RSS {peak_rss_mb():.1f} МБ (до загрузки {rss_before:.1f} МБ)")
+
+
+def cmd_prefetch(args):
+    if args.mode:
+        asyncio.run(run_prefetch(args.mode, args.groups, args.weeks, args.no_rate_limit))
+        return
+    # ru_maxrss не сбрасывается, поэтому каждый режим меряем в отдельном процессе
+    for mode in ('buffered', 'stream'):
+        subprocess.run(
+            [sys.executable, __file__, 'prefetch', '--mode', mode,
+             '--groups', str(args.groups), '--weeks', str(args.weeks)]
+            + (['--no-rate-limit'] if args.no_rate_limit else []),
+            check=True,
+        )
+
+
+# ==================== НАГРУЗКА НА РАССЫЛКУ ====================
+LESSON_TIMES = [("08:10", "09:45"), ("09:55", "11:30"), ("11:40", "13:15"), ("13:35", "15:10")]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Порт {port} не открылся за {timeout} с")
+
+
+def synthetic_users(users: int, groups: int):
+    for i in range(users):
+        group = i % groups
+        yield (10_000_000 + i, str(group % 8 + 1), f"Факультет {group % 8 + 1}",
+               str(1000 + group), f"{400 + group}")
+
+
+def synthetic_lessons(times):
+    return [
+        {'number': number, 'start': start, 'end': end, 'type': 'лекция',
+         'subject': f'Предмет {number}', 'teacher': 'доц. Иванов И.И.', 'audience': f'{300 + number} C'}
+        for number, (start, end) in enumerate(times, 1)
+    ]
+
+
+async def populate_db(users: int, groups: int, lessons, cached: bool):
+    await main.init_db()
+    today = datetime.now(main.LOCAL_TIMEZONE).date()
+    async with main.aiosqlite.connect(main.DB_PATH) as db:
+        await db.executemany('''
+            INSERT OR REPLACE INTO users (user_id, faculty_id, faculty_name, group_id, group_name, last_activity)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', synthetic_users(users, groups))
+        if cached:
+            data = json.dumps(lessons, ensure_ascii=False)
+            await db.executemany('''
+                INSERT OR REPLACE INTO schedule_cache (group_id, faculty_id, target_date, schedule_data, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(str(1000 + g), str(g % 8 + 1), today.isoformat(), data, datetime.now()) for g in range(groups)])
+        await db.commit()
+
+
+def configure_logging(mode: str, log_file: str):
+    """sync-debug — как было: построчные записи, синхронная запись в файл из цикла событий;
+    sync — только сводки, но синхронно; queue — только сводки через QueueListener"""
+    if mode == 'queue':
+        main.setup_logging('INFO', logging.FileHandler(log_file))
+        return
+    main.log_listener.stop()
+    logging.basicConfig(level=logging.INFO, format=main.LOG_FORMAT, filename=log_file, force=True)
+    if mode == 'sync-debug':
+        # Прежний объём: построчные сообщения бота, без DEBUG библиотек
+        main.logger.setLevel(logging.DEBUG)
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_broadcast_child(args):
+    args.users = args.users[0]
+    api_url = os.environ['TELEGRAM_API_URL']
+    now = datetime.now(main.LOCAL_TIMEZONE)
+    today = now.date()
+
+    if args.scenario == 'reminders':
+        # Пара через 21+ минуту от начала следующей минуты: напоминание сработает через 1–2 минуты
+        lesson_at = (now + timedelta(minutes=22)).replace(second=0, microsecond=0)
+        if lesson_at.date() != today:
+            print(json.dumps({'scenario': args.scenario, 'users': args.users, 'error': 'около полуночи'}))
+            return
+        lessons = synthetic_lessons([(lesson_at.strftime('%H:%M'), (lesson_at + timedelta(minutes=95)).strftime('%H:%M'))])
+    else:
+        lessons = synthetic_lessons(LESSON_TIMES)
+
+    await populate_db(args.users, args.groups, lessons, cached=not args.cold_cache)
+    main.http_session = main.create_http_session()
+    async with aiohttp.ClientSession() as control:
+        await control.post(f"{api_url}/__reset")
+
+        rss_before = peak_rss_mb()
+        started = time.time()
+        if args.scenario == 'daily':
+            await main.send_daily_schedule()
+            expected = {uid: started for uid, *_ in synthetic_users(args.users, args.groups)}
+        elif args.scenario == 'broadcast':
+            users = await main.get_active_users()
+            await main.deliver_broadcast(users, "<b>Тестовая рассылка</b>")
+            expected = {uid: started for uid, *_ in users}
+        else:
+            for uid, faculty_id, _, group_id, _ in synthetic_users(args.users, args.groups):
+                await main.schedule_reminders_for_user(uid, faculty_id, group_id, today)
+            await main.reminder_dispatcher.join()
+            deadline = (lesson_at - timedelta(minutes=20)).timestamp()
+            expected = {uid: deadline for uid, *_ in synthetic_users(args.users, args.groups)}
+        finished = time.time()
+
+        async with control.get(f"{api_url}/__stats") as response:
+            stats = await response.json()
+
+    await main.http_session.close()
+    await main.bot.session.close()
+
+    deliveries = [d for d in stats['deliveries'] if d[0] in expected]
+    delays = [ts - expected[chat_id] for chat_id, _, ts, _ in deliveries]
+    window = (max(ts for _, _, ts, _ in deliveries) - min(expected.values())) if deliveries else 0
+    print(json.dumps({
+        'scenario': args.scenario,
+        'logging': args.logging[0],
+        'users': args.users,
+        'delivered': len(deliveries),
+        'errors': stats['errors'],
+        'elapsed': finished - started,
+        'throughput': len(deliveries) / window if window > 0 else 0.0,
+        'p50': percentile(delays, 0.50),
+        'p99': percentile(delays, 0.99),
+        'rss_before': rss_before,
+        'rss_peak': peak_rss_mb(),
+    }, ensure_ascii=False))
+
+
+def cmd_broadcast(args):
+    if args.child:
+        configure_logging(args.logging[0], args.log_file)
+        if args.send_delay is not None:
+            main.DAILY_SEND_DELAY = main.BROADCAST_SEND_DELAY = args.send_delay
+        asyncio.run(run_broadcast_child(args))
+        return
+
+    port = free_port()
+    fake = subprocess.Popen([
+        sys.executable, str(ROOT / 'fake_telegram.py'), '--port', str(port),
+        '--latency-ms', str(args.latency_ms), '--rate-429', str(args.rate_429), '--blocked', str(args.blocked),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        print(f"{'сценарий':>10} {'логи':>10} {'польз.':>7} {'доставл.':>8} {'ошибки':>22} {'время, с':>9} "
+              f"{'сообщ./с':>9} {'p50, с':>8} {'p99, с':>8} {'RSS, МБ':>8}")
+        for users in args.users:
+            for scenario in args.scenarios:
+                for log_mode in args.logging:
+                    with tempfile.TemporaryDirectory() as tmp:
+                        env = dict(os.environ, DB_PATH=str(Path(tmp) / 'bench.db'),
+                                   TELEGRAM_API_URL=f"http://127.0.0.1:{port}")
+                        command = [sys.executable, __file__, 'broadcast', '--child', '--scenario', scenario,
+                                   '--users', str(users), '--groups', str(args.groups),
+                                   '--logging', log_mode, '--log-file', args.log_file]
+                        if args.send_delay is not None:
+                            command += ['--send-delay', str(args.send_delay)]
+                        if args.cold_cache:
+                            command.append('--cold-cache')
+                        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+                    result = json.loads(output.strip().splitlines()[-1])
+                    if 'error' in result:
+                        print(f"{scenario:>10} {log_mode:>10} {users:>7} пропущен: {result['error']}")
+                        continue
+                    errors = ', '.join(f"{k}: {v}" for k, v in result['errors'].items()) or '—'
+                    print(f"{scenario:>10} {log_mode:>10} {users:>7} {result['delivered']:>8} {errors:>22} "
+                          f"{result['elapsed']:>9.1f} {result['throughput']:>9.1f} {result['p50']:>8.2f} "
+                          f"{result['p99']:>8.2f} {result['rss_peak']:>8.1f}")
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+# ==================== ХРАНИЛИЩЕ FSM ====================
+async def measure_storage(storage, ops: int, users: int):
+    """Задержки записи (состояние + данные) и чтения (состояние + данные) в микросекундах"""
+    keys = [StorageKey(bot_id=1, chat_id=uid, user_id=uid) for uid in range(users)]
+    writes, reads = [], []
+    for i in range(ops):
+        key = keys[i % users]
+        started = time.perf_counter()
+        await storage.set_state(key, main.Form.waiting_for_group.state)
+        await storage.set_data(key, {'broadcast_text': f"Текст рассылки {i}", 'media_type': None})
+        writes.append((time.perf_counter() - started) * 1e6)
+    for i in range(ops):
+        key = keys[i % users]
+        started = time.perf_counter()
+        await storage.get_state(key)
+        await storage.get_data(key)
+        reads.append((time.perf_counter() - started) * 1e6)
+    await storage.close()
+    return writes, reads
+
+
+async def run_fsm(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'fsm.db')
+        async with main.aiosqlite.connect(path) as db:
+            await db.execute('PRAGMA journal_mode=WAL')
+        backends = [
+            ('memory', lambda: MemoryStorage()),
+            ('sqlite', lambda: SQLiteStorage(path)),
+            ('sqlite без кеша', lambda: SQLiteStorage(path, cache_size=0)),
+        ]
+        if args.redis:
+            from aiogram.fsm.storage.redis import RedisStorage
+            backends.append(('redis', lambda: RedisStorage.from_url(args.redis)))
+
+        print(f"{'хранилище':>16} {'запись p50':>11} {'p99, мкс':>9} {'чтение p50':>11} {'p99, мкс':>9}")
+        for name, factory in backends:
+            writes, reads = await measure_storage(factory(), args.ops, args.users)
+            print(f"{name:>16} {percentile(writes, 0.5):>11.1f} {percentile(writes, 0.99):>9.1f} "
+                  f"{percentile(reads, 0.5):>11.1f} {percentile(reads, 0.99):>9.1f}")
+
+
+def cmd_fsm(args):
+    asyncio.run(run_fsm(args))
+
+
+# ==================== ВОРКЕРЫ РАЗДЕЛЬНОГО РЕЖИМА ====================
+async def enqueue_worker_jobs(db_path: str, users: int, groups: int) -> int:
+    """Ежедневная рассылка и рассылка из бета-панели в очередь, как их ставит бот с RUN_MODE=split"""
+    main.DB_PATH = db_path
+    main.job_queue = JobQueue(db_path)
+    await populate_db(users, groups, synthetic_lessons(LESSON_TIMES), cached=True)
+    await main.enqueue_daily_schedule()
+    active = await main.get_active_users()
+    await main.enqueue_broadcast(active, "<b>Тестовая рассылка</b>")
+    await main.job_queue.close()
+    return len(active)
+
+
+def unfinished_jobs(db_path: str) -> int:
+    """Невыполненные задачи, кроме напоминаний на будущие пары"""
+    with sqlite3.connect(db_path, timeout=30) as db:
+        return db.execute('''
+            SELECT COUNT(*) FROM jobs WHERE kind != 'reminder' AND status IN ('pending', 'running')
+        ''').fetchone()[0]
+
+
+def holds_batch(db_path: str, worker_id: str) -> bool:
+    with sqlite3.connect(db_path, timeout=30) as db:
+        return db.execute('''
+            SELECT 1 FROM jobs WHERE status = 'running' AND lease_owner = ? AND kind LIKE '%_batch'
+        ''', (worker_id,)).fetchone() is not None
+
+
+def run_workers(args, workers: int, port: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / 'bench.db')
+        active = asyncio.run(enqueue_worker_jobs(db_path, args.users, args.groups))
+        api_url = f"http://127.0.0.1:{port}"
+        urllib.request.urlopen(urllib.request.Request(f"{api_url}/__reset", method='POST')).close()
+
+        env = dict(os.environ, DB_PATH=db_path, TELEGRAM_API_URL=api_url,
+                   JOB_LEASE_SECONDS=str(args.lease), METRICS_PORT='0')
+        command = [sys.executable, __file__, 'workers', '--child', '--send-delay', str(args.send_delay),
+                   '--log-file', args.log_file]
+        started = time.time()
+        processes = [subprocess.Popen(command, env=env) for _ in range(workers)]
+        victim = f"bench-{processes[0].pid}"
+        killed = False
+        batch_seen = None
+        try:
+            while unfinished_jobs(db_path):
+                if args.kill and workers > 1 and not killed:
+                    if batch_seen is None and holds_batch(db_path, victim):
+                        batch_seen = time.time()
+                    elif batch_seen is not None and time.time() - batch_seen > 1:
+                        # Воркер падает посреди пакета: после истечения аренды пакет доделают другие
+                        processes[0].send_signal(signal.SIGKILL)
+                        killed = True
+                time.sleep(0.2)
+            elapsed = time.time() - started
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.send_signal(signal.SIGTERM)
+            for process in processes:
+                process.wait()
+
+        with sqlite3.connect(db_path) as db:
+            reclaimed = db.execute("SELECT COUNT(*) FROM jobs WHERE attempts > 1").fetchone()[0]
+        with urllib.request.urlopen(f"{api_url}/__stats") as response:
+            stats = json.loads(response.read())
+
+    sends = Counter((chat_id, text) for chat_id, _, _, text in stats['deliveries'])
+    duplicates = sum(count - 1 for count in sends.values() if count > 1)
+    blocked = stats['errors'].get('blocked', 0)
+    # Каждый активный пользователь ждёт ежедневное сообщение и рассылку
+    lost = 2 * active - blocked - sum(1 for chat_id, text in sends if 'Напоминание' not in text)
+    return {'workers': workers, 'killed': killed, 'reclaimed': reclaimed, 'delivered': len(stats['deliveries']),
+            'duplicates': duplicates, 'lost': lost, 'elapsed': elapsed}
+
+
+def cmd_workers(args):
+    if args.child:
+        configure_logging('queue', args.log_file)
+        main.DAILY_SEND_DELAY = main.BROADCAST_SEND_DELAY = args.send_delay
+        asyncio.run(worker.serve(f"bench-{os.getpid()}"))
+        return
+
+    configure_logging('queue', args.log_file)
+    port = free_port()
+    fake = subprocess.Popen([
+        sys.executable, str(ROOT / 'fake_telegram.py'), '--port', str(port),
+        '--latency-ms', str(args.latency_ms), '--blocked', str(args.blocked),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    failed = False
+    try:
+        wait_for_port(port)
+        print(f"{'воркеров':>8} {'упал':>5} {'перехвачено':>11} {'доставлено':>10} {'дублей':>7} "
+              f"{'потеряно':>8} {'время, с':>9} {'сообщ./с':>9}")
+        for workers in args.workers:
+            result = run_workers(args, workers, port)
+            failed = failed or result['duplicates'] > 0
+            print(f"{result['workers']:>8} {'да' if result['killed'] else 'нет':>5} {result['reclaimed']:>11} "
+                  f"{result['delivered']:>10} {result['duplicates']:>7} {result['lost']:>8} "
+                  f"{result['elapsed']:>9.1f} {result['delivered'] / result['elapsed']:>9.1f}")
+    finally:
+        fake.terminate()
+        fake.wait()
+    if failed:
+        sys.exit("❌ Найдены повторные отправки")
+
+
+# ==================== ПОВТОРЫ ЗАДАЧ ВОРКЕРОВ ====================
+class FlakySend:
+    """Отправка, которая для выбранных пользователей первый раз падает с заданной ошибкой"""
+
+    def __init__(self, failures: dict):
+        self.failures = failures
+        self.calls = Counter()
+        self.sent = []
+
+    async def __call__(self, user_id: int):
+        self.calls[user_id] += 1
+        if self.calls[user_id] == 1 and user_id in self.failures:
+            raise self.failures[user_id]
+        self.sent.append(user_id)
+
+
+async def claim_now(queue: JobQueue, worker_id: str):
+    """Захват задачи без ожидания паузы перед повтором"""
+    db = await queue.connection()
+    await db.execute("UPDATE jobs SET run_at = 0 WHERE status = 'pending'")
+    await db.commit()
+    return await queue.claim(worker_id)
+
+
+async def job_status(queue: JobQueue) -> tuple:
+    db = await queue.connection()
+    async with db.execute('SELECT status, attempts FROM jobs') as cursor:
+        return await cursor.fetchone()
+
+
+async def check_send_failure(queue: JobQueue) -> list:
+    """Сбой соединения и retry_after посреди пакета рассылки: повтор задачи дошлёт только неотправленное"""
+    retry_after = TelegramRetryAfter(method=SendMessage(chat_id=3, text=''), message='flood', retry_after=0)
+    send = FlakySend({2: ConnectionError('connection reset'), 3: retry_after})
+    main.send_broadcast_message = lambda user_id, *args: send(user_id)
+    await queue.enqueue('broadcast_batch', {'broadcast_id': 'retry', 'user_ids': [1, 2, 3, 4],
+                                            'text': 'Рассылка', 'media_file_id': None, 'media_type': None})
+    await worker.run_job(await queue.claim('w1'), 'w1')
+    first = (await job_status(queue), sorted(send.sent))
+    await worker.run_job(await claim_now(queue, 'w1'), 'w1')
+    return [
+        ("пакет со сбоем возвращается в очередь", first == (('pending', 1), [1, 3, 4])),
+        ("retry_after повторяется внутри задачи", send.calls[3] == 2),
+        ("повтор задачи досылает сообщение", await job_status(queue) == ('done', 2) and sorted(send.sent) == [1, 2, 3, 4]),
+        ("отправленные не повторяются", len(send.sent) == len(set(send.sent))),
+    ]
+
+
+async def check_lease_expiry(queue: JobQueue) -> list:
+    """Воркер упал после первой отправки пакета: после истечения аренды пакет доделывает другой"""
+    send = FlakySend({})
+    main.send_broadcast_message = lambda user_id, *args: send(user_id)
+    await queue.enqueue('broadcast_batch', {'broadcast_id': 'lease', 'user_ids': [1, 2, 3],
+                                            'text': 'Рассылка', 'media_file_id': None, 'media_type': None})
+    dead = await queue.claim('dead')
+    await queue.mark_delivered('broadcast:lease:1')
+    await send(1)
+    taken_early = await queue.claim('w2')
+    await asyncio.sleep(queue.lease + 0.1)
+    job = await queue.claim('w2')
+    await worker.run_job(job, 'w2')
+    return [
+        ("задача под арендой не выдаётся другому", taken_early is None),
+        ("после истечения аренды задачу забирает другой воркер", job is not None and job['attempts'] == 2),
+        ("упавший воркер теряет аренду", not await queue.heartbeat(dead, 'dead')),
+        ("пакет доделан без повторов", await job_status(queue) == ('done', 2) and send.sent == [1, 2, 3]),
+    ]
+
+
+async def check_reminder_failure(queue: JobQueue) -> list:
+    """Неудачное напоминание снимает отметку о доставке, и повтор задачи его отправляет"""
+    send = FlakySend({7: ConnectionError('connection reset')})
+    main.reminder_dispatcher.send = lambda reminder: send(reminder.user_id)
+    tomorrow = (datetime.now(main.LOCAL_TIMEZONE) + timedelta(days=1)).date()
+    await queue.enqueue('reminder', {'user_id': 7, 'date': tomorrow.isoformat(),
+                                     'lesson': synthetic_lessons(LESSON_TIMES)[0]})
+    await worker.run_job(await queue.claim('w1'), 'w1')
+    first = await job_status(queue)
+    await worker.run_job(await claim_now(queue, 'w1'), 'w1')
+    return [
+        ("неудачное напоминание возвращается в очередь", first == ('pending', 1)),
+        ("повтор задачи отправляет напоминание", await job_status(queue) == ('done', 2) and send.sent == [7]),
+    ]
+
+
+async def check_daily_schedule_failure(queue: JobQueue) -> list:
+    """Расписание второй группы пакета не загрузилось: получившие сообщение до сбоя остаются в sent_messages"""
+    send = FlakySend({})
+
+    async def send_message(user_id, text, **kwargs):
+        await send(user_id)
+        return SimpleNamespace(message_id=100 + user_id)
+
+    loads = Counter()
+
+    async def get_daily_schedule(faculty_id, group_id, target_date, use_cache=True):
+        loads[group_id] += 1
+        if group_id == 'g2' and loads[group_id] == 1:
+            return main.SCHEDULE_FAILED, []
+        return 'ok', synthetic_lessons(LESSON_TIMES[:1])
+
+    main.bot.send_message = send_message
+    main.get_daily_schedule = get_daily_schedule
+    today = datetime.now(main.LOCAL_TIMEZONE).date().isoformat()
+    users = [{'user_id': user_id, 'faculty_id': 'f', 'group_id': group_id, 'faculty_name': 'Факультет',
+              'group_name': group_id, 'reminder_lead': 0} for user_id, group_id in ((1, 'g1'), (2, 'g2'))]
+    await queue.enqueue('daily_batch', {'date': today, 'users': users})
+    await worker.run_job(await queue.claim('w1'), 'w1')
+    first = (await job_status(queue), list(send.sent))
+    async with main.aiosqlite.connect(main.DB_PATH) as db:
+        async with db.execute('SELECT user_id FROM sent_messages ORDER BY user_id') as cursor:
+            recorded_early = [row[0] for row in await cursor.fetchall()]
+    await worker.run_job(await claim_now(queue, 'w1'), 'w1')
+    async with main.aiosqlite.connect(main.DB_PATH) as db:
+        async with db.execute('SELECT user_id, message_id FROM sent_messages ORDER BY user_id') as cursor:
+            recorded = await cursor.fetchall()
+    return [
+        ("пакет со сбоем расписания возвращается в очередь", first == (('pending', 1), [1])),
+        ("отправленное до сбоя записано в sent_messages", recorded_early == [1]),
+        ("повтор досылает без повторов и записывает всех",
+         await job_status(queue) == ('done', 2) and send.sent == [1, 2] and recorded == [(1, 101), (2, 102)]),
+    ]
+
+
+async def run_retry_checks() -> list:
+    results = []
+    for check in (check_send_failure, check_lease_expiry, check_reminder_failure, check_daily_schedule_failure):
+        with tempfile.TemporaryDirectory() as tmp:
+            main.DB_PATH = str(Path(tmp) / 'bench.db')
+            main.job_queue = JobQueue(main.DB_PATH, lease=0.5)
+            main.BROADCAST_SEND_DELAY = 0
+            await main.init_db()
+            try:
+                results += await check(main.job_queue)
+            finally:
+                await main.job_queue.close()
+    await main.bot.session.close()
+    return results
+
+
+def cmd_retry(args):
+    configure_logging('queue', args.log_file)
+    results = asyncio.run(run_retry_checks())
+    for name, ok in results:
+        print(f"{'✅' if ok else '❌'} {name}")
+    if not all(ok for _, ok in results):
+        sys.exit("❌ Повтор задач не доставил сообщения")
+
+
+# ==================== ЭНДПОИНТ МЕТРИК ====================
+SAMPLE_LINE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*",?)*\})? (\S+)')
+
+
+def exposition_errors(text: str) -> list:
+    """Нарушения текстового формата Prometheus: у каждой метрики HELP и TYPE, значения — числа"""
+    errors = []
+    families = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            _, directive, name, rest = line.split(' ', 3)
+            families.setdefault(name, {})[directive] = rest
+            continue
+        match = SAMPLE_LINE.fullmatch(line)
+        if not match:
+            errors.append(f"не разбирается: {line!r}")
+            continue
+        name = match.group(1)
+        family = name if name in families else re.sub(r'_(bucket|sum|count)$', '', name)
+        if 'TYPE' not in families.get(family, {}):
+            errors.append(f"значение до TYPE: {line!r}")
+        try:
+            float(match.group(3))
+        except ValueError:
+            errors.append(f"значение не число: {line!r}")
+    errors += [f"нет HELP или TYPE у {name}" for name, directives in families.items() if len(directives) != 2]
+    return errors
+
+
+async def scrape(registry: metrics.Registry) -> tuple:
+    runner = await metrics.start_metrics_server('127.0.0.1', free_port(), registry)
+    try:
+        port = runner.addresses[0][1]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                return response.status, response.headers['Content-Type'], await response.text()
+    finally:
+        await runner.cleanup()
+
+
+async def run_metrics_checks() -> list:
+    registry = metrics.Registry()
+    requests = registry.counter('bench_requests_total', "Запросы", ['path'])
+    requests.inc(path='/a"b\\c\nd')
+    registry.gauge('bench_queue_depth', "Очередь").set_function(lambda: 3)
+    latency = registry.histogram('bench_latency_seconds', "Задержка", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+    status, content_type, text = await scrape(registry)
+    lines = text.splitlines()
+    _, _, bot_text = await scrape(metrics.REGISTRY)
+    return [
+        ("ответ 200 в формате 0.0.4", status == 200 and content_type.startswith('text/plain; version=0.0.4')),
+        ("HELP и TYPE перед значениями", lines[:2] == ["# HELP bench_requests_total Запросы",
+                                                       "# TYPE bench_requests_total counter"]),
+        ("метки экранируются", 'bench_requests_total{path="/a\\"b\\\\c\\nd"} 1.0' in lines),
+        ("gauge считается при сборе", "bench_queue_depth 3.0" in lines),
+        ("корзины гистограммы накопительные, есть +Inf", [line for line in lines if '_bucket' in line] == [
+            'bench_latency_seconds_bucket{le="0.1"} 1', 'bench_latency_seconds_bucket{le="1.0"} 2',
+            'bench_latency_seconds_bucket{le="+Inf"} 3']),
+        ("_sum и _count гистограммы", math.isclose(float(lines[-2].split()[1]), 5.55)
+         and lines[-1] == "bench_latency_seconds_count 3"),
+        ("формат разбирается", not exposition_errors(text)),
+        ("метрики бота разбираются", bool(bot_text.strip()) and not exposition_errors(bot_text)),
+    ]
+
+
+def cmd_metrics(args):
+    results = asyncio.run(run_metrics_checks())
+    for name, ok in results:
+        print(f"{'✅' if ok else '❌'} {name}")
+    if not all(ok for _, ok in results):
+        sys.exit("❌ Эндпоинт метрик отдаёт неверный формат")
+
+
+# ==================== ПРИЁМ ОБНОВЛЕНИЙ: POLLING И WEBHOOK ====================
+def help_update(chat_id: int) -> dict:
+    return {'message': {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+        'text': '/help',
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+    }}
+
+
+async def wait_for_bot(control: aiohttp.ClientSession, api_url: str, method: str, timeout: float = 60.0):
+    """Бот готов, когда вызвал getUpdates (polling) или setWebhook (webhook)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        async with control.get(f"{api_url}/__stats") as response:
+            if (await response.json())['calls'].get(method):
+                return
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Бот не вызвал {method} за {timeout} с")
+
+
+async def send_updates(args, mode: str, api_url: str, webhook_url: str) -> dict:
+    users = range(1_000_000, 1_000_000 + args.updates)
+    # С --repeat каждый пользователь жмёт команду несколько раз подряд
+    chat_ids = [chat_id for chat_id in users for _ in range(args.repeat)]
+    sent = {}
+    async with aiohttp.ClientSession() as control:
+        await wait_for_bot(control, api_url, 'getUpdates' if mode == 'polling' else 'setWebhook')
+        started = time.time()
+        if mode == 'polling':
+            # Без /__reset: он заменил бы событие, которого уже ждёт getUpdates бота
+            sent = dict.fromkeys(users, started)
+            await control.post(f"{api_url}/__updates", json=[help_update(chat_id) for chat_id in chat_ids])
+        else:
+            # Telegram держит к webhook не больше max_connections соединений
+            connections = asyncio.Semaphore(args.connections)
+
+            async def post(update_id: int, chat_id: int):
+                async with connections:
+                    sent.setdefault(chat_id, time.time())
+                    update = dict(help_update(chat_id), update_id=update_id)
+                    async with control.post(webhook_url, json=update) as response:
+                        response.raise_for_status()
+
+            await asyncio.gather(*(post(i, chat_id) for i, chat_id in enumerate(chat_ids, 1)))
+
+        deadline = time.monotonic() + args.timeout
+        while True:
+            async with control.get(f"{api_url}/__stats") as response:
+                stats = await response.json()
+            first = {}
+            for chat_id, _, ts, _ in stats['deliveries']:
+                if chat_id in sent:
+                    first.setdefault(chat_id, ts)
+            if len(first) >= args.updates or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.1)
+        if args.repeat > 1:
+            # Повторы одного чата обрабатываются после первого ответа: даём им дойти
+            await asyncio.sleep(1)
+            async with control.get(f"{api_url}/__stats") as response:
+                stats = await response.json()
+
+    replies = sum(1 for d in stats['deliveries'] if d[0] in sent)
+    delays = [ts - sent[chat_id] for chat_id, ts in first.items()]
+    window = max(first.values()) - started if first else 0
+    return {'handled': len(first), 'duplicates': replies - len(first),
+            'throughput': len(first) / window if window > 0 else 0.0,
+            'p50': percentile(delays, 0.50), 'p99': percentile(delays, 0.99)}
+
+
+def run_updates(args, mode: str, webhook_workers: int, limit: int) -> dict:
+    port = free_port()
+    fake = subprocess.Popen([
+        sys.executable, str(ROOT / 'fake_telegram.py'), '--port', str(port), '--latency-ms', str(args.latency_ms),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with tempfile.TemporaryDirectory() as tmp:
+        api_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, DB_PATH=str(Path(tmp) / 'bench.db'), TELEGRAM_API_URL=api_url,
+                   METRICS_PORT='0', RSREU_BASE_URL=f"http://127.0.0.1:{free_port()}", LOG_LEVEL='WARNING',
+                   MAX_CONCURRENT_UPDATES=str(limit))
+        webhook_url = ''
+        if mode == 'webhook':
+            webhook_port = free_port()
+            webhook_url = f"http://127.0.0.1:{webhook_port}/webhook"
+            env.update(WEBHOOK_URL=webhook_url, WEBHOOK_PORT=str(webhook_port),
+                       WEBHOOK_WORKERS=str(webhook_workers), WEBHOOK_QUEUE_SIZE=str(args.updates * args.repeat))
+        bot = None
+        try:
+            wait_for_port(port)
+            with open(args.log_file, 'a') as log:
+                bot = subprocess.Popen([sys.executable, str(ROOT / 'main.py')], env=env, stdout=log, stderr=log)
+                result = asyncio.run(send_updates(args, mode, api_url, webhook_url))
+        finally:
+            if bot is not None:
+                bot.send_signal(signal.SIGTERM)
+                bot.wait()
+            fake.terminate()
+            fake.wait()
+    return dict(result, mode=mode, workers=webhook_workers if mode == 'webhook' else '-', limit=limit or '-')
+
+
+def cmd_updates(args):
+    print(f"{'режим':>8} {'обработчиков':>12} {'лимит':>6} {'обработано':>10} {'повторов':>8} {'обновл./с':>10} "
+          f"{'p50, мс':>8} {'p99, мс':>8}")
+    for mode in args.modes:
+        for webhook_workers in (args.webhook_workers if mode == 'webhook' else [None]):
+            for limit in args.max_concurrent:
+                result = run_updates(args, mode, webhook_workers, limit)
+                print(f"{result['mode']:>8} {result['workers']:>12} {result['limit']:>6} {result['handled']:>10} "
+                      f"{result['duplicates']:>8} {result['throughput']:>10.1f} {result['p50'] * 1000:>8.0f} "
+                      f"{result['p99'] * 1000:>8.0f}")
+
+
+# ==================== API РАСПИСАНИЙ ====================
+def api_paths(groups: int, today) -> list:
+    monday = today - timedelta(days=today.weekday())
+    paths = []
+    for group in range(groups):
+        base = f"/api/{group % 8 + 1}/{1000 + group}"
+        paths += [f"{base}/day/{today.isoformat()}", f"{base}/week",
+                  f"{base}/week/{(monday + timedelta(weeks=1)).isoformat()}", f"{base}.ics"]
+    return paths
+
+
+async def run_api_child(args):
+    """Кеш на текущую и следующую неделю групп заполнен заранее, сайт расписания недоступен"""
+    today = datetime.now(main.LOCAL_TIMEZONE).date()
+    monday = today - timedelta(days=today.weekday())
+    await populate_db(0, args.groups, [], cached=False)
+    data = json.dumps(synthetic_lessons(LESSON_TIMES), ensure_ascii=False)
+    async with main.aiosqlite.connect(main.DB_PATH) as db:
+        await db.executemany('''
+            INSERT OR REPLACE INTO schedule_cache (group_id, faculty_id, target_date, schedule_data, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(str(1000 + g), str(g % 8 + 1), (monday + timedelta(days=d)).isoformat(), data, datetime.now())
+              for g in range(args.groups) for d in range(14)])
+        await db.commit()
+    main.http_session = main.create_http_session()
+    await main.start_schedule_api()
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    print('ready', flush=True)
+    await stop.wait()
+    await main.schedule_api.stop()
+    await main.http_session.close()
+    await main.bot.session.close()
+    fetches = sum(sum(counts) for counts in main.HTTP_FETCH_SECONDS.counts.values())
+    print(json.dumps({'builds': main.schedule_api.builds, 'fetches': fetches}), flush=True)
+
+
+async def load_api(base_url: str, paths: list, requests: int, connections: int, etags: dict,
+                   revalidate: bool) -> dict:
+    """requests запросов по кругу путей; ETag ответов запоминаются, с revalidate — отправляются в If-None-Match"""
+    latencies, statuses = [], Counter()
+    next_request = iter(range(requests))
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def client():
+            for i in next_request:
+                path = paths[i % len(paths)]
+                headers = {'If-None-Match': etags[path]} if revalidate and path in etags else {}
+                started = time.perf_counter()
+                async with session.get(base_url + path, headers=headers) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] += 1
+                if 'ETag' in response.headers:
+                    etags.setdefault(path, response.headers['ETag'])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(connections)))
+        elapsed = time.perf_counter() - started
+    return {'rps': requests / elapsed, 'p50': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99),
+            'statuses': dict(statuses)}
+
+
+def cmd_api(args):
+    if args.child:
+        main.API_PORT = args.port
+        asyncio.run(run_api_child(args))
+        return
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Сайт расписания указывает на закрытый порт: любой запрос к нему закончился бы ошибкой
+        env = dict(os.environ, DB_PATH=str(Path(tmp) / 'bench.db'), METRICS_PORT='0', LOG_LEVEL='WARNING',
+                   RSREU_BASE_URL=f"http://127.0.0.1:{free_port()}")
+        child = subprocess.Popen([sys.executable, __file__, 'api', '--child', '--port', str(port),
+                                  '--groups', str(args.groups)], env=env, stdout=subprocess.PIPE, text=True)
+        try:
+            child.stdout.readline()
+            base_url = f"http://127.0.0.1:{port}"
+            paths = api_paths(args.groups, datetime.now(main.LOCAL_TIMEZONE).date())
+            etags = {}
+            print(f"{'проход':>22} {'запросов':>9} {'запр./с':>9} {'p50, мс':>8} {'p99, мс':>8}  коды ответов")
+            for name, requests, revalidate in (('первый (сборка)', len(paths), False),
+                                               ('из памяти', args.requests, False),
+                                               ('If-None-Match', args.requests, True)):
+                result = asyncio.run(load_api(base_url, paths, requests, args.connections, etags, revalidate))
+                statuses = ', '.join(f"{code}: {count}" for code, count in sorted(result['statuses'].items()))
+                print(f"{name:>22} {requests:>9} {result['rps']:>9.0f} {result['p50'] * 1000:>8.1f} "
+                      f"{result['p99'] * 1000:>8.1f}  {statuses}")
+        finally:
+            child.send_signal(signal.SIGTERM)
+            output, _ = child.communicate()
+    summary = json.loads(output.strip().splitlines()[-1])
+    print(f"\nСобрано недель: {summary['builds']}, запросов к сайту расписания: {summary['fetches']}")
+
+
+# ==================== СТАРТ БОТА ====================
+def import_times(top: int) -> list:
+    """python -X importtime: собственное время импорта main и самые тяжёлые его прямые зависимости"""
+    env = dict(os.environ, METRICS_PORT='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        seconds = int(cumulative) / 1e6
+        # Зависимости печатаются перед импортировавшим их модулем, с отступом на уровень глубже
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), seconds))
+        elif depth == 0:
+            if name.strip() == 'main':
+                return [('main', seconds)] + sorted(children, key=lambda m: -m[1])[:top]
+            children = []
+    raise RuntimeError("main не найден в выводе -X importtime")
+
+
+async def first_update(api_url: str, chat_id: int, started: float, timeout: float) -> float:
+    async with aiohttp.ClientSession() as control:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            async with control.get(f"{api_url}/__stats") as response:
+                stats = await response.json()
+            for delivered_to, _, ts, _ in stats['deliveries']:
+                if delivered_to == chat_id:
+                    return ts - started
+            await asyncio.sleep(0.02)
+    raise RuntimeError(f"Бот не ответил за {timeout} с")
+
+
+def cmd_startup(args):
+    print("python -X importtime, с (накопительно):")
+    for name, seconds in import_times(args.top):
+        print(f"  {name:<32} {seconds:>6.3f}")
+
+    port = free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    fake = subprocess.Popen([sys.executable, str(ROOT / 'fake_telegram.py'), '--port', str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DB_PATH=str(Path(tmp) / 'bench.db'), TELEGRAM_API_URL=api_url,
+                       METRICS_PORT='0', RSREU_BASE_URL=f"http://127.0.0.1:{free_port()}", LOG_LEVEL='WARNING')
+            print("\nОт запуска процесса до ответа на /help (первый запуск — пустая база, дальше — перезапуски):")
+            for run in range(args.runs):
+                chat_id = 2_000_000 + run
+                # Обновление уже ждёт в очереди: бот получит его первым же getUpdates
+                urllib.request.urlopen(urllib.request.Request(
+                    f"{api_url}/__updates", data=json.dumps([help_update(chat_id)]).encode(),
+                    headers={'Content-Type': 'application/json'}, method='POST')).close()
+                started = time.time()
+                with open(args.log_file, 'a') as log:
+                    bot = subprocess.Popen([sys.executable, str(ROOT / 'main.py')], env=env, stdout=log, stderr=log)
+                try:
+                    elapsed = asyncio.run(first_update(api_url, chat_id, started, args.timeout))
+                finally:
+                    bot.send_signal(signal.SIGTERM)
+                    bot.wait()
+                print(f"  запуск {run + 1}: {elapsed:.2f} с")
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота расписания")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    prefetch = commands.add_parser('prefetch', help="пиковая память при массовой загрузке недель")
+    prefetch.add_argument('--groups', type=int, default=50)
+    prefetch.add_argument('--weeks', type=int, default=2)
+    prefetch.add_argument('--mode', choices=['buffered', 'stream'])
+    prefetch.add_argument('--no-rate-limit', action='store_true',
+                          help="только для stand_in_server.py или HTTP_CACHE_MODE=replay")
+    prefetch.set_defaults(func=cmd_prefetch)
+
+    broadcast = commands.add_parser('broadcast', help="рассылка через заглушку Telegram на синтетических пользователях")
+    broadcast.add_argument('--users', type=int, nargs='+', default=[1000])
+    broadcast.add_argument('--groups', type=int, default=300)
+    broadcast.add_argument('--scenarios', nargs='+', default=['daily', 'broadcast', 'reminders'],
+                           choices=['daily', 'broadcast', 'reminders'])
+    broadcast.add_argument('--latency-ms', type=float, default=30.0, help="задержка заглушки Telegram")
+    broadcast.add_argument('--rate-429', type=float, default=0.0, help="доля ответов 429")
+    broadcast.add_argument('--blocked', type=float, default=0.02, help="доля заблокировавших бота")
+    broadcast.add_argument('--send-delay', type=float,
+                           help="пауза между отправками вместо боевых DAILY_SEND_DELAY/BROADCAST_SEND_DELAY")
+    broadcast.add_argument('--cold-cache', action='store_true',
+                           help="не заполнять schedule_cache (расписания берутся с RSREU_BASE_URL)")
+    broadcast.add_argument('--logging', nargs='+', default=['queue'], choices=['sync-debug', 'sync', 'queue'],
+                           help="sync-debug — построчные логи с синхронной записью, как до QueueHandler")
+    broadcast.add_argument('--log-file', default=os.devnull)
+    broadcast.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    broadcast.add_argument('--scenario', help=argparse.SUPPRESS)
+    broadcast.set_defaults(func=cmd_broadcast)
+
+    fsm = commands.add_parser('fsm', help="задержки чтения и записи состояний FSM в разных хранилищах")
+    fsm.add_argument('--ops', type=int, default=5000)
+    fsm.add_argument('--users', type=int, default=500)
+    fsm.add_argument('--redis', metavar='URL', help="сравнить и с RedisStorage (нужен пакет redis)")
+    fsm.set_defaults(func=cmd_fsm)
+
+    workers = commands.add_parser('workers', help="несколько воркеров на одной базе: проверка отсутствия дублей")
+    workers.add_argument('--users', type=int, default=2000)
+    workers.add_argument('--groups', type=int, default=100)
+    workers.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    workers.add_argument('--latency-ms', type=float, default=30.0, help="задержка заглушки Telegram")
+    workers.add_argument('--blocked', type=float, default=0.02, help="доля заблокировавших бота")
+    workers.add_argument('--send-delay', type=float, default=0.0)
+    workers.add_argument('--lease', type=float, default=3.0, help="аренда задачи, с")
+    workers.add_argument('--kill', action='store_true', help="убить один воркер (SIGKILL) посреди пакета")
+    workers.add_argument('--log-file', default=os.devnull)
+    workers.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    workers.set_defaults(func=cmd_workers)
+
+    retry = commands.add_parser('retry', help="повторы задач воркеров: сбой отправки, истечение аренды, напоминания")
+    retry.add_argument('--log-file', default=os.devnull)
+    retry.set_defaults(func=cmd_retry)
+
+    metrics_check = commands.add_parser('metrics', help="эндпоинт /metrics: формат Prometheus на живом сервере")
+    metrics_check.set_defaults(func=cmd_metrics)
+
+    updates = commands.add_parser('updates', help="приём обновлений: long polling против webhook")
+    updates.add_argument('--updates', type=int, default=2000)
+    updates.add_argument('--modes', nargs='+', default=['polling', 'webhook'], choices=['polling', 'webhook'])
+    updates.add_argument('--webhook-workers', type=int, nargs='+', default=[8])
+    updates.add_argument('--max-concurrent', type=int, nargs='+', default=[main.MAX_CONCURRENT_UPDATES],
+                         help="MAX_CONCURRENT_UPDATES бота, 0 — без ограничения")
+    updates.add_argument('--repeat', type=int, default=1, help="сколько раз каждый пользователь шлёт команду")
+    updates.add_argument('--connections', type=int, default=40, help="одновременных запросов к webhook")
+    updates.add_argument('--latency-ms', type=float, default=30.0, help="задержка заглушки Telegram")
+    updates.add_argument('--timeout', type=float, default=120.0, help="сколько ждать обработки всех обновлений, с")
+    updates.add_argument('--log-file', default=os.devnull)
+    updates.set_defaults(func=cmd_updates)
+
+    startup = commands.add_parser('startup', help="время импорта main и время до первого обработанного обновления")
+    startup.add_argument('--runs', type=int, default=3)
+    startup.add_argument('--top', type=int, default=10, help="сколько прямых зависимостей main показать")
+    startup.add_argument('--timeout', type=float, default=60.0)
+    startup.add_argument('--log-file', default=os.devnull)
+    startup.set_defaults(func=cmd_startup)
+
+    api = commands.add_parser('api', help="API расписаний: запросы в секунду и задержки без обращений к сайту")
+    api.add_argument('--groups', type=int, default=300)
+    api.add_argument('--requests', type=int, default=20000)
+    api.add_argument('--connections', type=int, default=50)
+    api.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    api.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    api.set_defaults(func=cmd_api)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,113 @@
+"""
+Ограничение параллельной обработки обновлений: общий лимит, очередь по чатам и отсев повторных нажатий
+"""
+
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from time import perf_counter
+from typing import Dict, Optional, Set, Tuple
+
+from aiogram import types
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def duplicate_key(event: types.Update) -> Optional[str]:
+    """Команда или callback_data целиком; обычный текст (ввод в диалоге) не отсеивается"""
+    if event.message and event.message.text and event.message.text.startswith('/'):
+        return event.message.text.strip()
+    if event.callback_query and event.callback_query.data:
+        return 'callback:' + event.callback_query.data
+    return None
+
+
+class UpdateLimiter:
+    """Внешний middleware обновлений
+
+    Обновления одного чата обрабатываются строго по очереди, поэтому двойное нажатие
+    не запускает диалог дважды, а состояние FSM не пишется наперегонки. Одновременно
+    обрабатывается не больше limit обновлений (0 — без ограничения), остальные ждут
+    без захвата ресурсов. Повтор команды или кнопки, которая у того же пользователя
+    ещё обрабатывается или ждёт очереди, отбрасывается.
+    """
+
+    def __init__(self, limit: int, wait_seconds: Optional[metrics.Histogram] = None,
+                 duplicates: Optional[metrics.Counter] = None):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit) if limit else None
+        self.wait_seconds = wait_seconds
+        self.duplicates = duplicates
+        self.waiting = 0
+        self.active = 0
+        # Замок чата и число обновлений, которые его держат или ждут
+        self.chat_locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        self.in_flight: Set[Tuple[int, str]] = set()
+
+    def chat_lock(self, chat_id: int) -> asyncio.Lock:
+        lock, users = self.chat_locks.get(chat_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self.chat_locks[chat_id] = (lock, users + 1)
+        return lock
+
+    def release_chat(self, chat_id: int):
+        lock, users = self.chat_locks[chat_id]
+        if users == 1:
+            del self.chat_locks[chat_id]
+        else:
+            self.chat_locks[chat_id] = (lock, users - 1)
+
+    async def reject_duplicate(self, event: types.Update, key: Tuple[int, str]):
+        if self.duplicates:
+            self.duplicates.inc()
+        logger.debug("🔁 Повтор %s от %d отброшен", key[1], key[0])
+        if event.callback_query:
+            # Иначе кнопка так и останется с часиками
+            try:
+                await event.callback_query.answer()
+            except Exception:
+                pass
+
+    async def __call__(self, handler, event: types.Update, data):
+        chat = data.get('event_chat')
+        user = data.get('event_from_user')
+        if chat is None:
+            return await handler(event, data)
+
+        key = None
+        command = duplicate_key(event)
+        if user and command:
+            key = (user.id, command)
+            if key in self.in_flight:
+                await self.reject_duplicate(event, key)
+                return None
+            self.in_flight.add(key)
+
+        self.waiting += 1
+        started = perf_counter()
+        try:
+            async with AsyncExitStack() as stack:
+                with tracing.span('wait_for_slot'):
+                    try:
+                        # Сначала очередь чата, затем общий слот: ждущий своей очереди слот не занимает
+                        lock = self.chat_lock(chat.id)
+                        stack.callback(self.release_chat, chat.id)
+                        await stack.enter_async_context(lock)
+                        if self.semaphore:
+                            await stack.enter_async_context(self.semaphore)
+                    finally:
+                        self.waiting -= 1
+                if self.wait_seconds:
+                    self.wait_seconds.observe(perf_counter() - started)
+                self.active += 1
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.active -= 1
+        finally:
+            if key:
+                self.in_flight.discard(key)
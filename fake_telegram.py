@@ -0,0 +1,154 @@
+"""
+Заглушка Telegram Bot API для бенчмарков: бот подключается к ней через TELEGRAM_API_URL
+
+Запуск:
+python3 fake_telegram.py --port 8081 --latency-ms 30 --rate-429 0.01 --blocked 0.02
+TELEGRAM_API_URL=http://127.0.0.1:8081 python3 main.py
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+SEND_METHODS = {'sendMessage', 'sendPhoto', 'sendVideo', 'editMessageText'}
+
+
+class FakeTelegram:
+    """Имитирует задержку сети, ответы 429 с retry_after и пользователей, заблокировавших бота"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_429: float = 0.0,
+                 retry_after: int = 1, blocked: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.blocked = blocked
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.errors = Counter()
+        self.deliveries = []
+        self.message_id = 0
+        self.updates = []
+        self.update_id = 0
+        self.new_updates = asyncio.Event()
+
+    def is_blocked(self, chat_id: int) -> bool:
+        # Детерминированно, чтобы повторный прогон блокировал тех же пользователей
+        return (chat_id * 2654435761) % 10000 < self.blocked * 10000
+
+    @staticmethod
+    def error(code: int, description: str, **parameters) -> web.Response:
+        payload = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            payload['parameters'] = parameters
+        return web.json_response(payload, status=code)
+
+    def message(self, chat_id: int, data) -> dict:
+        self.message_id += 1
+        result = {
+            'message_id': int(data.get('message_id') or self.message_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if 'text' in data:
+            result['text'] = data['text']
+        return result
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = await request.post()
+        self.calls[method] += 1
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self.get_updates(data)})
+
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 123456, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}})
+
+        if method not in SEND_METHODS:
+            return web.json_response({'ok': True, 'result': True})
+
+        chat_id = int(data['chat_id'])
+        if self.is_blocked(chat_id):
+            self.errors['blocked'] += 1
+            return self.error(403, "Forbidden: bot was blocked by the user")
+        if self.rate_429 and self.random.random() < self.rate_429:
+            self.errors['429'] += 1
+            return self.error(429, f"Too Many Requests: retry after {self.retry_after}",
+                              retry_after=self.retry_after)
+
+        text = data.get('text') or data.get('caption') or ''
+        self.deliveries.append((chat_id, method, time.time(), text[:200]))
+        return web.json_response({'ok': True, 'result': self.message(chat_id, data)})
+
+    async def get_updates(self, data) -> list:
+        """Long polling: ждём новые обновления не дольше timeout"""
+        offset = int(data.get('offset') or 0)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout=float(data.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(data.get('limit') or 100)]
+
+    async def handle_push_updates(self, request: web.Request) -> web.Response:
+        """Добавить обновления в очередь getUpdates; update_id проставляется здесь"""
+        for update in await request.json():
+            self.update_id += 1
+            self.updates.append(dict(update, update_id=self.update_id))
+        self.new_updates.set()
+        return web.json_response({'ok': True, 'last_update_id': self.update_id})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'calls': self.calls,
+            'errors': self.errors,
+            'deliveries': self.deliveries,
+        })
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'ok': True})
+
+
+def create_app(fake: FakeTelegram) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_get('/__stats', fake.handle_stats)
+    app.router.add_post('/__reset', fake.handle_reset)
+    app.router.add_post('/__updates', fake.handle_push_updates)
+    app.router.add_post('/bot{token}/{method}', fake.handle)
+    return app
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=30.0)
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--blocked', type=float, default=0.0, help="доля пользователей, заблокировавших бота")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_429,
+                        args.retry_after, args.blocked)
+    web.run_app(create_app(fake), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,134 @@
+"""
+Хранилище FSM в SQLite: состояния диалогов переживают перезапуск бота
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import aiosqlite
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+# (состояние, данные, время последней записи)
+Record = Tuple[Optional[str], Dict[str, Any], float]
+
+
+class SQLiteStorage(BaseStorage):
+    """Состояния и данные FSM в таблице fsm_states с кешем чтения в памяти
+
+    Запись идёт сразу в SQLite, чтение — из LRU-кеша (включая отсутствие состояния,
+    ведь у большинства обновлений его нет). Состояния, не менявшиеся дольше ttl,
+    считаются брошенными: они не возвращаются и периодически удаляются из таблицы.
+    Кеш у каждого процесса свой, поэтому несколько процессов с одним файлом
+    должны использовать Redis.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, cache_size: int = 10000,
+                 purge_interval: float = 3600):
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.cache: 'OrderedDict[str, Record]' = OrderedDict()
+        self.db: Optional[aiosqlite.Connection] = None
+        self.open_lock = asyncio.Lock()
+        self.last_purge = 0.0
+
+    async def connection(self) -> aiosqlite.Connection:
+        if self.db is None:
+            async with self.open_lock:
+                if self.db is None:
+                    db = await aiosqlite.connect(self.path)
+                    # В WAL с synchronous=NORMAL коммит не ждёт fsync; при падении процесса данные не теряются
+                    await db.execute('PRAGMA synchronous=NORMAL')
+                    await db.execute('''
+                        CREATE TABLE IF NOT EXISTS fsm_states (
+                            key TEXT PRIMARY KEY,
+                            state TEXT,
+                            data TEXT NOT NULL DEFAULT '{}',
+                            updated_at REAL NOT NULL
+                        )
+                    ''')
+                    await db.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+                    await db.commit()
+                    self.db = db
+        return self.db
+
+    def remember(self, key: str, record: Record):
+        self.cache[key] = record
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def read(self, key: str) -> Record:
+        record = self.cache.get(key)
+        if record is None:
+            db = await self.connection()
+            async with db.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,)) as cursor:
+                row = await cursor.fetchone()
+            record = (row[0], json.loads(row[1]), row[2]) if row else (None, {}, time.time())
+            self.remember(key, record)
+        else:
+            self.cache.move_to_end(key)
+        state, data, updated_at = record
+        if state is not None or data:
+            if time.time() - updated_at > self.ttl:
+                return None, {}, updated_at
+        return record
+
+    async def write(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        now = time.time()
+        db = await self.connection()
+        if state is None and not data:
+            await db.execute('DELETE FROM fsm_states WHERE key = ?', (key,))
+        else:
+            await db.execute('''
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                    updated_at = excluded.updated_at
+            ''', (key, state, json.dumps(data, ensure_ascii=False), now))
+        await db.commit()
+        self.remember(key, (state, data, now))
+        if now - self.last_purge > self.purge_interval:
+            await self.purge_expired()
+
+    async def purge_expired(self) -> int:
+        """Удаление брошенных состояний (например, недоделанных регистраций)"""
+        now = time.time()
+        self.last_purge = now
+        db = await self.connection()
+        cursor = await db.execute('DELETE FROM fsm_states WHERE updated_at < ?', (now - self.ttl,))
+        await db.commit()
+        for key in [key for key, (_, _, updated_at) in self.cache.items() if now - updated_at > self.ttl]:
+            del self.cache[key]
+        return cursor.rowcount
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self.key_builder.build(key)
+        _, data, _ = await self.read(name)
+        await self.write(name, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self.read(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        name = self.key_builder.build(key)
+        state, _, _ = await self.read(name)
+        await self.write(name, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self.read(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
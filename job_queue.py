@@ -0,0 +1,203 @@
+"""
+Долговечная очередь задач в SQLite для раздельного режима: бот ставит задачи, процессы worker.py их выполняют
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import aiosqlite
+
+# (тип, данные, когда выполнить, ключ дедупликации)
+JobSpec = Tuple[str, Dict[str, Any], Optional[float], Optional[str]]
+
+
+class JobQueue:
+    """Задачи в таблице jobs, захват с арендой (lease) и отметки о доставке
+
+    Воркер захватывает задачу на lease секунд и продлевает аренду, пока работает.
+    Если процесс упал, аренда истекает и задачу забирает другой воркер. Повтор
+    задачи не должен повторять уже отправленные сообщения, поэтому перед каждой
+    отправкой воркер ставит отметку в job_deliveries, а если отправка не удалась —
+    снимает её. Сообщение уходит не более одного раза, а при падении процесса между
+    отметкой и отправкой теряется только оно.
+    """
+
+    def __init__(self, path: str, lease: float = 60, max_attempts: int = 5):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.db: Optional[aiosqlite.Connection] = None
+        self.open_lock = asyncio.Lock()
+
+    async def connection(self) -> aiosqlite.Connection:
+        if self.db is None:
+            async with self.open_lock:
+                if self.db is None:
+                    # Воркеры пишут в один файл одновременно: ждём блокировку, а не падаем
+                    db = await aiosqlite.connect(self.path, timeout=30)
+                    await db.execute('PRAGMA journal_mode=WAL')
+                    await db.execute('PRAGMA synchronous=NORMAL')
+                    await db.execute('''
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            kind TEXT NOT NULL,
+                            payload TEXT NOT NULL,
+                            dedup_key TEXT UNIQUE,
+                            run_at REAL NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'pending',
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            lease_owner TEXT,
+                            lease_until REAL,
+                            error TEXT,
+                            created_at REAL NOT NULL,
+                            finished_at REAL
+                        )
+                    ''')
+                    await db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at)')
+                    await db.execute('''
+                        CREATE TABLE IF NOT EXISTS job_deliveries (
+                            key TEXT PRIMARY KEY,
+                            created_at REAL NOT NULL
+                        )
+                    ''')
+                    # Запросы к сайту расписания всех процессов за последнюю минуту
+                    await db.execute('CREATE TABLE IF NOT EXISTS site_requests (at REAL NOT NULL)')
+                    await db.execute('CREATE INDEX IF NOT EXISTS idx_site_requests_at ON site_requests (at)')
+                    await db.commit()
+                    self.db = db
+        return self.db
+
+    async def enqueue_many(self, jobs: Iterable[JobSpec]) -> int:
+        """Постановка задач; задачи с уже известным dedup_key пропускаются"""
+        now = time.time()
+        rows = [(kind, json.dumps(payload, ensure_ascii=False), dedup_key, run_at or now, now)
+                for kind, payload, run_at, dedup_key in jobs]
+        db = await self.connection()
+        before = db.total_changes
+        await db.executemany('''
+            INSERT OR IGNORE INTO jobs (kind, payload, dedup_key, run_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        await db.commit()
+        return db.total_changes - before
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], run_at: Optional[float] = None,
+                      dedup_key: Optional[str] = None) -> bool:
+        return await self.enqueue_many([(kind, payload, run_at, dedup_key)]) == 1
+
+    async def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Захват ближайшей готовой задачи или задачи с истёкшей арендой"""
+        now = time.time()
+        db = await self.connection()
+        async with db.execute('''
+            UPDATE jobs SET status = 'running', lease_owner = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status = 'pending' AND run_at <= ?) OR (status = 'running' AND lease_until < ?)
+                ORDER BY run_at, id LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts
+        ''', (worker_id, now + self.lease, now, now)) as cursor:
+            row = await cursor.fetchone()
+        await db.commit()
+        if row is None:
+            return None
+        return {'id': row[0], 'kind': row[1], 'payload': json.loads(row[2]), 'attempts': row[3]}
+
+    async def heartbeat(self, job: Dict[str, Any], worker_id: str) -> bool:
+        """Продление аренды; False — задачу уже забрал другой воркер"""
+        db = await self.connection()
+        cursor = await db.execute('''
+            UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND lease_owner = ?
+        ''', (time.time() + self.lease, job['id'], worker_id))
+        await db.commit()
+        return cursor.rowcount == 1
+
+    async def complete(self, job: Dict[str, Any], worker_id: str):
+        db = await self.connection()
+        await db.execute('''
+            UPDATE jobs SET status = 'done', finished_at = ?, lease_until = NULL
+            WHERE id = ? AND lease_owner = ?
+        ''', (time.time(), job['id'], worker_id))
+        await db.commit()
+
+    async def fail(self, job: Dict[str, Any], worker_id: str, error: str):
+        """Повтор с нарастающей паузой; после max_attempts задача остаётся failed"""
+        now = time.time()
+        give_up = job['attempts'] >= self.max_attempts
+        db = await self.connection()
+        await db.execute('''
+            UPDATE jobs SET status = ?, run_at = ?, error = ?, lease_owner = NULL, lease_until = NULL,
+                finished_at = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', ('failed' if give_up else 'pending', now + 30 * job['attempts'], error[:500],
+              now if give_up else None, job['id'], worker_id))
+        await db.commit()
+
+    async def mark_delivered(self, key: str) -> bool:
+        """Отметка перед отправкой; False — это сообщение уже отправлялось"""
+        db = await self.connection()
+        cursor = await db.execute('INSERT OR IGNORE INTO job_deliveries (key, created_at) VALUES (?, ?)',
+                                  (key, time.time()))
+        await db.commit()
+        return cursor.rowcount == 1
+
+    async def unmark_delivered(self, key: str):
+        """Снятие отметки после неудачной отправки: повтор задачи отправит сообщение снова"""
+        db = await self.connection()
+        await db.execute('DELETE FROM job_deliveries WHERE key = ?', (key,))
+        await db.commit()
+
+    async def reserve_request(self, limit: int, window: float = 60) -> float:
+        """Место в общем для бота и воркеров лимите запросов к сайту
+
+        0 — запрос учтён и его можно делать, иначе — сколько секунд ждать. Проверка
+        и запись идут одной инструкцией, поэтому процессы не превышают limit вместе.
+        """
+        now = time.time()
+        db = await self.connection()
+        await db.execute('DELETE FROM site_requests WHERE at <= ?', (now - window,))
+        async with db.execute('''
+            INSERT INTO site_requests (at)
+            SELECT ? WHERE (SELECT COUNT(*) FROM site_requests WHERE at > ?) < ?
+            RETURNING at
+        ''', (now, now - window, limit)) as cursor:
+            reserved = await cursor.fetchone()
+        await db.commit()
+        if reserved:
+            return 0.0
+        async with db.execute('SELECT MIN(at) FROM site_requests WHERE at > ?', (now - window,)) as cursor:
+            oldest = (await cursor.fetchone())[0]
+        return max(0.1, oldest + window - now) if oldest else 0.1
+
+    async def next_run_at(self) -> Optional[float]:
+        db = await self.connection()
+        async with db.execute('''
+            SELECT MIN(CASE WHEN status = 'pending' THEN run_at ELSE lease_until END)
+            FROM jobs WHERE status IN ('pending', 'running')
+        ''') as cursor:
+            row = await cursor.fetchone()
+        return row[0]
+
+    async def stats(self) -> Dict[str, int]:
+        db = await self.connection()
+        async with db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status') as cursor:
+            return {status: count for status, count in await cursor.fetchall()}
+
+    async def purge_finished(self, older_than: float) -> int:
+        """Удаление выполненных задач и старых отметок о доставке"""
+        cutoff = time.time() - older_than
+        db = await self.connection()
+        cursor = await db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                  (cutoff,))
+        removed = cursor.rowcount
+        await db.execute('DELETE FROM job_deliveries WHERE created_at < ?', (cutoff,))
+        await db.commit()
+        return removed
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
@@ -6,23 +6,44 @@ Telegram Bot для расписания РГРТУ
 import asyncio
 import aiohttp
 import aiosqlite
-from bs4 import BeautifulSoup
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from datetime import datetime, time, timedelta, date
 import re
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
 import json
 import html
-from typing import Optional, Dict, List, Tuple, Any
+from typing import Optional, Awaitable, Callable, Deque, Dict, List, Set, Tuple, Any
+from collections import OrderedDict, deque
 import pytz
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
+import hashlib
+import uuid
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+from time import perf_counter
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+import metrics
+import tracing
+from fsm_storage import SQLiteStorage
+from job_queue import JobQueue
+import webhook
+from api import ScheduleApi
+from concurrency import UpdateLimiter
+from reminders import Reminder, ReminderDispatcher
+from schedule_index import ScheduleIndex, building_key
+import signal
 
 # ==================== ЗАГРУЗКА ПЕРЕМЕННЫХ ОКРУЖЕНИЯ ====================
 env_path = Path(__file__).parent / '.env'
@@ -32,6 +53,9 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 BETA_TESTER_ID = int(os.getenv('BETA_TESTER_ID', '0'))
 BROADCAST_MODE = os.getenv('BROADCAST_MODE', 'beta')
 SPECIFIC_USER_ID = int(os.getenv('SPECIFIC_USER_ID', '123456789'))
+DB_PATH = os.getenv('DB_PATH', 'users.db')
+# Свой адрес Bot API (локальный сервер или заглушка для бенчмарков)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения! Проверь файл .env")
@@ -52,7 +76,7 @@ class BroadcastStates(StatesGroup):
 
 # ==================== НАСТРОЙКИ ====================
 LOCAL_TIMEZONE = pytz.timezone('Europe/Moscow')
-BASE_URL = "https://rasp.rsreu.ru"
+BASE_URL = os.getenv('RSREU_BASE_URL', "https://rasp.rsreu.ru")
 SCHEDULE_URL = f"{BASE_URL}/schedule-frame/group"
 
 # ==================== КАСТОМНЫЕ ЭМОДЗИ ====================
@@ -87,24 +111,306 @@ def emoji(name: str) -> str:
 
 # ==================== НАСТРОЙКИ КЕШИРОВАНИЯ ====================
 CACHE_TTL_HOURS = 6
+# Дни без пар (воскресенья, праздники, сессия) тоже кешируются, чтобы не ходить за ними на сайт
+EMPTY_CACHE_TTL_HOURS = 12
+# Колонки дня нет на странице (например, неделя ещё не опубликована) — проверяем чаще
+NO_DAY_CACHE_TTL_HOURS = 1
+SCHEDULE_OK = 'ok'
+SCHEDULE_EMPTY = 'empty'
+SCHEDULE_NO_DAY = 'no_day'
+SCHEDULE_FAILED = 'failed'
+# Список групп сохраняется в БД: после перезапуска он берётся оттуда, с сайта — только если устарел
+GROUPS_CACHE_TTL_HOURS = int(os.getenv('GROUPS_CACHE_TTL_HOURS', '24'))
+# Очистка schedule_cache: прошедшие дни старше SCHEDULE_RETENTION_DAYS и записи на сегодня и будущие
+# даты, не обновлявшиеся SCHEDULE_STALE_DAYS (разовые запросы чужих групп), удаляются пачками
+SCHEDULE_RETENTION_DAYS = int(os.getenv('SCHEDULE_RETENTION_DAYS', '14'))
+SCHEDULE_STALE_DAYS = int(os.getenv('SCHEDULE_STALE_DAYS', '7'))
+CACHE_RETENTION_INTERVAL = int(os.getenv('CACHE_RETENTION_INTERVAL', '3600'))
+CACHE_RETENTION_BATCH = 500
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
 MAX_REQUESTS_PER_MINUTE = 30
 
+# ==================== НАСТРОЙКИ HTTP-КЛИЕНТА ====================
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '20'))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '6'))
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 30
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 20
+HTTP_TOTAL_TIMEOUT = 30
+HTML_CHUNK_SIZE = 16 * 1024
+
+# passthrough — обычная работа, record — ходим на сайт и сохраняем ответы,
+# replay — отвечаем только из сохранённых ответов, без сети
+HTTP_CACHE_MODE = os.getenv('HTTP_CACHE_MODE', 'passthrough')
+HTTP_CACHE_DIR = Path(os.getenv('HTTP_CACHE_DIR', Path(__file__).parent / 'http_cache'))
+
+try:
+    # aiohttp распаковывает br только при установленном пакете brotli
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Accept-Encoding': ACCEPT_ENCODING,
+}
+
+# ==================== НАСТРОЙКИ МЕТРИК ====================
+# Эндпоинт /metrics для Prometheus; METRICS_PORT=0 отключает его
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# ==================== НАСТРОЙКИ ТРАССИРОВКИ ====================
+# Обновления дольше порога пишутся в ротируемый JSONL с разбивкой по спанам
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '1000'))
+TRACE_LOG_PATH = Path(os.getenv('TRACE_LOG_PATH', 'traces/slow_traces.jsonl'))
+
+# ==================== НАСТРОЙКИ FSM ====================
+# sqlite — состояния в DB_PATH и переживают перезапуск; memory — только в памяти;
+# redis — общее хранилище для нескольких процессов (нужен пакет redis)
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+# ==================== РАЗДЕЛЬНЫЙ РЕЖИМ ====================
+# split — бот принимает обновления и ставит рассылки и напоминания в очередь jobs,
+# их выполняют процессы worker.py; single — всё в одном процессе
+RUN_MODE = os.getenv('RUN_MODE', 'single')
+# Лимит запросов к сайту общий для бота и всех воркеров и считается в DB_PATH
+SHARED_RATE_LIMIT = RUN_MODE == 'split'
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '100'))
+JOB_RETENTION_DAYS = 7
+# Как часто бот перечитывает неактивных пользователей: в раздельном режиме их отмечают воркеры
+INACTIVE_USERS_SYNC_INTERVAL = 60
+# Сколько раз воркер ждёт retry_after и повторяет отправку, прежде чем вернуть задачу в очередь
+JOB_SEND_RETRIES = 3
+
+# Сколько отрисованных недель групп держать в памяти для /week
+WEEK_VIEW_CACHE_SIZE = 500
+
+# Индекс преподавателей и аудиторий: как часто чистить прошедшие дни
+# (и в раздельном режиме — подтягивать расписания, записанные воркерами)
+LESSON_INDEX_SYNC_INTERVAL = int(os.getenv('LESSON_INDEX_SYNC_INTERVAL', '300'))
+TEACHER_MATCHES_LIMIT = 5
+
+# ==================== НАСТРОЙКИ ОТСЛЕЖИВАНИЯ ИЗМЕНЕНИЙ ====================
+# Раз в SCHEDULE_REFRESH_INTERVAL секунд перепроверяется не больше SCHEDULE_REFRESH_BUDGET
+# недель групп (один запрос к сайту на неделю); SCHEDULE_REFRESH_BUDGET=0 отключает проверку
+SCHEDULE_REFRESH_INTERVAL = int(os.getenv('SCHEDULE_REFRESH_INTERVAL', '600'))
+SCHEDULE_REFRESH_BUDGET = int(os.getenv('SCHEDULE_REFRESH_BUDGET', '10'))
+SCHEDULE_REFRESH_DAYS = 7
+
+# ==================== НАСТРОЙКИ ОБРАБОТКИ ОБНОВЛЕНИЙ ====================
+# Сколько обновлений обрабатывается одновременно (0 — без ограничения); обновления
+# одного чата всегда идут по очереди, повтор ещё не обработанной команды отбрасывается
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+
+# ==================== НАСТРОЙКИ WEBHOOK ====================
+# Пустой WEBHOOK_URL — long polling; иначе Telegram шлёт обновления на WEBHOOK_URL,
+# который проксируется на aiohttp-сервер WEBHOOK_HOST:WEBHOOK_PORT с путём WEBHOOK_PATH
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+
+# ==================== НАСТРОЙКИ INLINE-РЕЖИМА ====================
+# Сколько секунд Telegram кеширует ответ на одинаковый запрос; для неполных и неудачных — меньше.
+# Запрос группы, которой нет в памяти, ждёт INLINE_DEBOUNCE_SECONDS, пока пользователь печатает
+INLINE_CACHE_TIME = 300
+INLINE_RETRY_CACHE_TIME = 10
+INLINE_DEBOUNCE_SECONDS = float(os.getenv('INLINE_DEBOUNCE_SECONDS', '0.6'))
+INLINE_RESULTS_LIMIT = 10
+
+# ==================== НАСТРОЙКИ API ====================
+# Read-only HTTP API расписаний из кеша (JSON и .ics); API_PORT=0 отключает. API_PUBLIC_URL —
+# внешний адрес, под которым API проксируется: с ним /settings показывает ссылку на календарь
+API_HOST = os.getenv('API_HOST', '127.0.0.1')
+API_PORT = int(os.getenv('API_PORT', '0'))
+API_PUBLIC_URL = os.getenv('API_PUBLIC_URL', '').rstrip('/')
+API_CALENDAR_WEEKS = 2
+API_CACHE_SIZE = 2000
+# Окно дат API: назад — сколько хранится schedule_cache, вперёд — несколько недель
+API_DAYS_AHEAD = 42
+# Через сколько секунд повторять загрузку недели, которая не удалась
+API_FAILURE_TTL_SECONDS = 60
+
 # ==================== НАСТРОЙКИ БЕТА-ТЕСТА ====================
 BETA_MODE = True
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# ==================== НАСТРОЙКИ ЛОГИРОВАНИЯ ====================
+# Построчные сообщения (каждая пара, каждый пользователь рассылки) идут на DEBUG
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+log_listener: Optional[QueueListener] = None
+# Файл медленных трасс: подключается к слушателю, только когда трассировка включена
+trace_log_handler: Optional[logging.Handler] = None
+
+def is_regular_record(record: logging.LogRecord) -> bool:
+    return record.name != tracing.SLOW_LOGGER
+
+def setup_logging(level: str = LOG_LEVEL, *handlers: logging.Handler):
+    """Цикл событий только кладёт записи в очередь; форматирование и запись — в потоке QueueListener
+
+    Медленные трассы идут через ту же очередь, но пишутся только в файл трасс.
+    """
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+    if not handlers:
+        handlers = (logging.StreamHandler(),)
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.addFilter(is_regular_record)
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # Окончательный формат применяет обработчик в потоке слушателя
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=level, handlers=[queue_handler], force=True)
+    logging.getLogger(tracing.SLOW_LOGGER).handlers = [queue_handler]
+    if trace_log_handler is not None:
+        handlers = (*handlers, trace_log_handler)
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+
+def enable_trace_log():
+    """Запись медленных трасс в TRACE_LOG_PATH тем же потоком слушателя, что и логи"""
+    global trace_log_handler
+    if trace_log_handler is None:
+        trace_log_handler = trace_recorder.file_handler()
+        log_listener.handlers = (*log_listener.handlers, trace_log_handler)
+
+setup_logging()
+atexit.register(lambda: log_listener and log_listener.stop())
 logger = logging.getLogger(__name__)
 
 # ==================== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ====================
 http_session: Optional[aiohttp.ClientSession] = None
+metrics_runner = None
+webhook_server: Optional[webhook.WebhookServer] = None
+schedule_api: Optional[ScheduleApi] = None
 request_timestamps: List[datetime] = []
 all_groups_cache: Dict[str, Dict[str, str]] = {}
 groups_loaded = False
+inactive_users: Set[int] = set()
+last_broadcast_stats: Dict[str, Any] = {}
+last_cache_purge: Dict[str, Any] = {}
+# Идущие рассылки отдельных минут
+daily_runs: Set[asyncio.Task] = set()
+# Долгие команды администратора: идут вне обработчика, чтобы не держать его слот и очередь чата
+admin_tasks: Set[asyncio.Task] = set()
+lesson_index = ScheduleIndex()
+# Идущие загрузки страниц недель по url
+week_table_fetches: Dict[str, asyncio.Future] = {}
 
 # ==================== НАСТРОЙКИ ВРЕМЕНИ РАССЫЛКИ ====================
+# Общее время рассылки — для пользователей, не выбравших своё в /notify
 schedule_hour = 6
 schedule_minute = 0
+# Кнопки /notify; любое другое время — /notify ЧЧ:ММ
+NOTIFY_TIME_PRESETS = (6 * 60, 6 * 60 + 30, 7 * 60, 7 * 60 + 30, 8 * 60)
+REMINDER_LEAD_CHOICES = (5, 10, 15, 20, 30, 0)
+
+# Паузы между отправками, чтобы не упираться в лимиты Telegram
+DAILY_SEND_DELAY = 0.5
+BROADCAST_SEND_DELAY = 0.05
+# Напоминания начинают уходить за REMINDER_SPREAD_SECONDS до срока, не чаще REMINDER_SEND_RATE в секунду
+REMINDER_LEAD_MINUTES = 20
+REMINDER_SPREAD_SECONDS = float(os.getenv('REMINDER_SPREAD_SECONDS', '120'))
+REMINDER_SEND_RATE = float(os.getenv('REMINDER_SEND_RATE', '25'))
+REMINDER_MAX_RETRIES = 3
+USER_SNAPSHOT_CHUNK_SIZE = 500
+
+# ==================== НАСТРОЙКИ АДМИН-СПИСКОВ ====================
+ADMIN_PAGE_SIZE = 20
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# ==================== МЕТРИКИ ====================
+HTTP_FETCH_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_http_fetch_seconds', "Длительность попытки запроса к сайту расписания")
+HTTP_RESPONSES = metrics.REGISTRY.counter(
+    'rsreu_bot_http_responses_total', "Исходы запросов к сайту (код ответа, timeout, error)", ['status'])
+HTTP_RETRIES = metrics.REGISTRY.counter(
+    'rsreu_bot_http_retries_total', "Повторные попытки запросов к сайту")
+RATE_LIMIT_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_rate_limit_wait_seconds', "Ожидание в ограничителе частоты запросов",
+    buckets=(1, 5, 10, 20, 30, 45, 60))
+SCHEDULE_CACHE_LOOKUPS = metrics.REGISTRY.counter(
+    'rsreu_bot_schedule_cache_lookups_total',
+    "Обращения к schedule_cache (hit, negative — известный пустой день, miss, expired)", ['result'])
+SCHEDULE_PARSE_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_schedule_parse_seconds', "Получение и разбор расписания в parse_daily_schedule", ['source'])
+TELEGRAM_REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_telegram_request_seconds', "Длительность вызовов Bot API", ['method'])
+TELEGRAM_ERRORS = metrics.REGISTRY.counter(
+    'rsreu_bot_telegram_errors_total', "Ошибки вызовов Bot API", ['method', 'error'])
+BROADCAST_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_broadcast_seconds', "Длительность рассылок", ['kind'],
+    buckets=(1, 10, 30, 60, 300, 600, 1800, 3600, 7200))
+REMINDERS_PENDING = metrics.REGISTRY.gauge(
+    'rsreu_bot_reminders_pending', "Запланированные и ещё не отправленные напоминания")
+REMINDERS_DELIVERED = metrics.REGISTRY.counter(
+    'rsreu_bot_reminders_total', "Исходы напоминаний (sent, late — после срока, expired — пара началась, failed)",
+    ['result'])
+REMINDER_LATENESS_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_reminder_lateness_seconds', "Опоздание отправленных напоминаний относительно срока (0 — вовремя)",
+    buckets=(0, 1, 5, 15, 30, 60, 120, 300, 600))
+EVENT_LOOP_LAG = metrics.REGISTRY.gauge(
+    'rsreu_bot_event_loop_lag_seconds', "Последняя измеренная задержка цикла событий")
+WEBHOOK_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    'rsreu_bot_webhook_queue_depth', "Обновления, принятые по webhook и ещё не обработанные")
+WEBHOOK_QUEUE_DEPTH.set_function(lambda: webhook_server.pending if webhook_server else 0)
+WEEK_FETCHES_COALESCED = metrics.REGISTRY.counter(
+    'rsreu_bot_week_fetches_coalesced_total', "Загрузки недели, присоединившиеся к уже идущему запросу того же url")
+INLINE_QUERIES = metrics.REGISTRY.counter(
+    'rsreu_bot_inline_queries_total',
+    "Inline-запросы (memory, loaded, superseded, ambiguous, not_found, failed)", ['result'])
+CACHE_PURGED_ROWS = metrics.REGISTRY.counter(
+    'rsreu_bot_schedule_cache_purged_total', "Удалённые записи schedule_cache (past, stale)", ['reason'])
+API_REQUESTS = metrics.REGISTRY.counter(
+    'rsreu_bot_api_requests_total', "Запросы к API расписаний (ok, not_modified, unavailable, bad_request, not_found)",
+    ['endpoint', 'result'])
+LESSON_INDEX_SLOTS = metrics.REGISTRY.gauge(
+    'rsreu_bot_lesson_index_slots', "Пары групп в индексе преподавателей и аудиторий")
+LESSON_INDEX_SLOTS.set_function(lambda: len(lesson_index))
+SCHEDULE_REFRESH_CHECKS = metrics.REGISTRY.counter(
+    'rsreu_bot_schedule_refresh_checks_total',
+    "Перепроверенные дни (unchanged, changed, stored — без уведомления, "
+    "failed — неделя не загрузилась или день пропал со страницы)", ['result'])
+UPDATES_IN_PROGRESS = metrics.REGISTRY.gauge(
+    'rsreu_bot_updates_in_progress', "Обновления, обрабатываемые прямо сейчас")
+UPDATES_WAITING = metrics.REGISTRY.gauge(
+    'rsreu_bot_updates_waiting', "Обновления, ждущие свободного слота или своей очереди в чате")
+UPDATE_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_update_wait_seconds', "Ожидание обновления перед обработкой",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30))
+UPDATES_DEDUPLICATED = metrics.REGISTRY.counter(
+    'rsreu_bot_updates_deduplicated_total', "Повторы команд и кнопок, отброшенные до обработки")
+EVENT_LOOP_LAG_SECONDS = metrics.REGISTRY.histogram(
+    'rsreu_bot_event_loop_lag_seconds_distribution', "Распределение задержки цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки каждого вызова Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(perf_counter() - started, method=name)
 
 # ==================== ОПИСАНИЯ РЕЖИМОВ ====================
 mode_desc = {
@@ -114,12 +420,39 @@ mode_desc = {
 }
 
 # ==================== ИНИЦИАЛИЗАЦИЯ ====================
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+bot.session.middleware(TelegramMetricsMiddleware())
+def create_fsm_storage():
+    """Хранилище состояний FSM по FSM_STORAGE; брошенные диалоги истекают через FSM_STATE_TTL"""
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    if FSM_STORAGE == 'redis':
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise ValueError("FSM_STORAGE=redis требует пакет redis: pip install redis")
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+    if FSM_STORAGE == 'sqlite':
+        return SQLiteStorage(DB_PATH, ttl=FSM_STATE_TTL)
+    raise ValueError(f"Неизвестное значение FSM_STORAGE: {FSM_STORAGE}")
+
+dp = Dispatcher(storage=create_fsm_storage())
+job_queue = JobQueue(DB_PATH, lease=JOB_LEASE_SECONDS)
+trace_recorder = tracing.TraceRecorder(TRACE_LOG_PATH, TRACE_SLOW_MS / 1000)
+dp.update.outer_middleware(tracing.create_tracing_middleware(trace_recorder))
+update_limiter = UpdateLimiter(MAX_CONCURRENT_UPDATES, UPDATE_WAIT_SECONDS, UPDATES_DEDUPLICATED)
+dp.update.outer_middleware(update_limiter)
+UPDATES_IN_PROGRESS.set_function(lambda: update_limiter.active)
+UPDATES_WAITING.set_function(lambda: update_limiter.waiting)
 
 # ==================== БАЗА ДАННЫХ ====================
 async def init_db():
-    async with aiosqlite.connect('users.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
+        # Действует только на новую базу; существующую переводит очистка кеша (VACUUM)
+        await db.execute('PRAGMA auto_vacuum=INCREMENTAL')
         await db.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -130,9 +463,18 @@ async def init_db():
                 registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 is_active BOOLEAN DEFAULT 1,
                 last_activity TIMESTAMP,
-                is_beta_tester BOOLEAN DEFAULT 0
+                is_beta_tester BOOLEAN DEFAULT 0,
+                send_minute INTEGER,
+                reminder_lead INTEGER
             )
         ''')
+        # Своё время рассылки (минута суток) и за сколько минут напоминать; NULL — как у всех
+        cursor = await db.execute('PRAGMA table_info(users)')
+        columns = [row[1] for row in await cursor.fetchall()]
+        if 'send_minute' not in columns:
+            await db.execute('ALTER TABLE users ADD COLUMN send_minute INTEGER')
+        if 'reminder_lead' not in columns:
+            await db.execute('ALTER TABLE users ADD COLUMN reminder_lead INTEGER')
         
         await db.execute('''
             CREATE TABLE IF NOT EXISTS schedule_cache (
@@ -141,30 +483,103 @@ async def init_db():
                 target_date DATE NOT NULL,
                 schedule_data TEXT NOT NULL,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT NOT NULL DEFAULT 'ok',
+                content_hash TEXT,
                 PRIMARY KEY (group_id, faculty_id, target_date)
             )
         ''')
+        # Базы прошлых версий: статус записи кеша (ok, empty, no_day) и хеш для поиска изменений
+        cursor = await db.execute('PRAGMA table_info(schedule_cache)')
+        columns = [row[1] for row in await cursor.fetchall()]
+        if 'status' not in columns:
+            await db.execute("ALTER TABLE schedule_cache ADD COLUMN status TEXT NOT NULL DEFAULT 'ok'")
+        if 'content_hash' not in columns:
+            await db.execute('ALTER TABLE schedule_cache ADD COLUMN content_hash TEXT')
+        # Очистка по сроку и синхронизация индекса преподавателей идут по updated_at,
+        # очистка прошедших дней и поиск пустых групп на дату — по target_date
+        await db.execute('CREATE INDEX IF NOT EXISTS idx_schedule_cache_updated ON schedule_cache (updated_at)')
+        await db.execute('CREATE INDEX IF NOT EXISTS idx_schedule_cache_date ON schedule_cache (target_date)')
+        # Найденные изменения расписания: только разница между версиями
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS schedule_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                faculty_id TEXT NOT NULL,
+                group_id TEXT NOT NULL,
+                target_date DATE NOT NULL,
+                delta TEXT NOT NULL,
+                detected_at TIMESTAMP NOT NULL
+            )
+        ''')
+        await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_schedule_changes_group
+            ON schedule_changes (faculty_id, group_id, target_date)
+        ''')
+        # Отправленные ежедневные сообщения: при изменении расписания они правятся на месте
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS sent_messages (
+                target_date DATE NOT NULL,
+                user_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                sent_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (target_date, user_id)
+            )
+        ''')
+        # Покрывающий индекс для рассылок: user_id — это rowid, он есть в любом индексе
+        await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_active_group
+            ON users (is_active, faculty_id, group_id)
+        ''')
+        # Рассылка по минутам: пользователи одной минуты подряд по группам, без обхода остальных
+        await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_send_minute
+            ON users (send_minute, is_active, faculty_id, group_id)
+        ''')
+        # Постраничные списки в админ-командах: от новых к старым
+        await db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_registered
+            ON users (registered_at, user_id)
+        ''')
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS groups_cache (
+                group_name TEXT PRIMARY KEY,
+                faculty_id TEXT NOT NULL,
+                group_id TEXT NOT NULL,
+                faculty_name TEXT NOT NULL,
+                updated_at TIMESTAMP NOT NULL
+            )
+        ''')
+        # WAL: долгое чтение снимка при рассылке не блокирует запись в БД
+        await db.execute('PRAGMA journal_mode=WAL')
         await db.commit()
     logger.info("✅ База данных инициализирована")
 
 async def save_user_settings(user_id: int, faculty_id: str, faculty_name: str, group_id: str, group_name: str):
     is_beta = 1 if (BETA_MODE and user_id == BETA_TESTER_ID) else 0
     
-    async with aiosqlite.connect('users.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
+        # Смена группы сохраняет время рассылки и напоминаний
         await db.execute('''
-            INSERT OR REPLACE INTO users 
+            INSERT INTO users 
             (user_id, faculty_id, faculty_name, group_id, group_name, last_activity, is_beta_tester)
             VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                faculty_id = excluded.faculty_id, faculty_name = excluded.faculty_name,
+                group_id = excluded.group_id, group_name = excluded.group_name,
+                registered_at = CURRENT_TIMESTAMP, is_active = 1,
+                last_activity = excluded.last_activity, is_beta_tester = excluded.is_beta_tester
         ''', (user_id, faculty_id, faculty_name, group_id, group_name, datetime.now(), is_beta))
         await db.commit()
     
+    inactive_users.discard(user_id)
     logger.info(f"✅ Пользователь {user_id} сохранен: {faculty_name} - {group_name}")
 
+@tracing.traced()
 async def get_user_settings(user_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect('users.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
         async with db.execute('''
-            SELECT faculty_id, faculty_name, group_id, group_name, is_beta_tester 
+            SELECT faculty_id, faculty_name, group_id, group_name, is_beta_tester, send_minute, reminder_lead
             FROM users WHERE user_id = ?
         ''', (user_id,)) as cursor:
             row = await cursor.fetchone()
@@ -173,7 +588,7 @@ async def get_user_settings(user_id: int) -> Optional[Dict[str, Any]]:
 
 async def delete_user_settings(user_id: int):
     """Удаление настроек пользователя из БД"""
-    async with aiosqlite.connect('users.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
         # Проверяем, есть ли пользователь
         cursor = await db.execute('SELECT COUNT(*) FROM users WHERE user_id = ?', (user_id,))
         count = await cursor.fetchone()
@@ -185,6 +600,7 @@ async def delete_user_settings(user_id: int):
         # Удаляем
         await db.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
         await db.commit()
+        inactive_users.discard(user_id)
         
         # Проверяем результат
         cursor = await db.execute('SELECT COUNT(*) FROM users WHERE user_id = ?', (user_id,))
@@ -197,117 +613,704 @@ async def delete_user_settings(user_id: int):
     
     logger.info(f"✅ Пользователь {user_id} удален")
 
-async def get_all_users() -> List[Tuple[int, str, str]]:
-    """Получение ВСЕХ пользователей из БД БЕЗ ИСКЛЮЧЕНИЙ"""
-    async with aiosqlite.connect('users.db') as db:
+async def get_active_users() -> List[Tuple[int, str, str]]:
+    """Получение активных пользователей (тех, кто не заблокировал бота)"""
+    async with aiosqlite.connect(DB_PATH) as db:
         cursor = await db.execute('''
             SELECT user_id, faculty_id, group_id 
-            FROM users
+            FROM users WHERE is_active = 1
         ''')
         users = await cursor.fetchall()
     
-    logger.info(f"📊 ВСЕГО пользователей в БД: {len(users)}")
+    logger.info(f"📊 Активных пользователей в БД: {len(users)}")
     return users
 
+async def iter_user_snapshot(user_id: Optional[int] = None, chunk_size: int = USER_SNAPSHOT_CHUNK_SIZE,
+                             send_minute: Optional[int] = None, unsent_on: Optional[date] = None):
+    """Снимок активных пользователей для рассылки: один запрос, строки читаются курсором порциями.
+
+    Пользователи идут подряд по группам (порядок даёт индекс idx_users_active_group),
+    так что расписание группы достаточно получить один раз. С user_id снимок
+    состоит из одного пользователя, независимо от активности. С send_minute — только
+    пользователи этой минуты рассылки (по idx_users_send_minute), а с unsent_on —
+    ещё не получившие ежедневное сообщение за эту дату.
+    """
+    if user_id is not None:
+        queries = [('WHERE user_id = ?', (user_id,))]
+    elif send_minute is None:
+        queries = [('WHERE is_active = 1', ())]
+    else:
+        # Выбравшие эту минуту и, в общее время, не выбравшие никакой: два поиска по индексу вместо OR
+        minutes = [send_minute, None] if send_minute == default_send_minute() else [send_minute]
+        queries = [('WHERE send_minute IS ? AND is_active = 1', (minute,)) for minute in minutes]
+    if unsent_on is not None:
+        queries = [(where + ' AND user_id NOT IN (SELECT user_id FROM sent_messages WHERE target_date = ?)',
+                    params + (unsent_on.isoformat(),)) for where, params in queries]
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        for where, params in queries:
+            async with db.execute(f'''
+                SELECT user_id, faculty_id, faculty_name, group_id, group_name, is_active, is_beta_tester,
+                    reminder_lead
+                FROM users {where} ORDER BY faculty_id, group_id
+            ''', params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+
 async def get_user_count() -> int:
     """Получение количества ВСЕХ пользователей"""
-    async with aiosqlite.connect('users.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
         cursor = await db.execute('SELECT COUNT(*) FROM users')
         count = await cursor.fetchone()
     return count[0] if count else 0
 
+async def get_user_activity_counts() -> Tuple[int, int]:
+    """Количество всех и активных пользователей одним запросом"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('SELECT COUNT(*), COALESCE(SUM(is_active = 1), 0) FROM users')
+        total, active = await cursor.fetchone()
+    return total, active
+
+async def get_send_minute_counts(send_minute: int) -> Tuple[int, int]:
+    """Количество всех и активных пользователей минуты рассылки (с учётом общего времени)"""
+    minutes = [send_minute, None] if send_minute == default_send_minute() else [send_minute]
+    total = active = 0
+    async with aiosqlite.connect(DB_PATH) as db:
+        for minute in minutes:
+            cursor = await db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(is_active = 1), 0) FROM users WHERE send_minute IS ?', (minute,))
+            minute_total, minute_active = await cursor.fetchone()
+            total += minute_total
+            active += minute_active
+    return total, active
+
+async def set_user_send_minute(user_id: int, send_minute: Optional[int]):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute('UPDATE users SET send_minute = ? WHERE user_id = ?', (send_minute, user_id))
+        await db.commit()
+
+async def set_user_reminder_lead(user_id: int, lead: Optional[int]):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute('UPDATE users SET reminder_lead = ? WHERE user_id = ?', (lead, user_id))
+        await db.commit()
+
+async def get_users_page(key: Optional[Tuple[str, int]] = None, newer: bool = False,
+                         limit: int = ADMIN_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], bool]:
+    """Страница пользователей (от новых к старым) по ключу (registered_at, user_id).
+
+    Без key — первая страница; иначе строки старше key, а при newer=True — новее.
+    Второе значение говорит, есть ли ещё строки в направлении перехода.
+    """
+    if key is None:
+        where, order, params = '', 'DESC', ()
+    elif newer:
+        where, order, params = 'WHERE (registered_at, user_id) > (?, ?)', 'ASC', key
+    else:
+        where, order, params = 'WHERE (registered_at, user_id) < (?, ?)', 'DESC', key
+    
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(f'''
+            SELECT user_id, faculty_name, group_name, is_active, is_beta_tester, registered_at
+            FROM users {where}
+            ORDER BY registered_at {order}, user_id {order}
+            LIMIT ?
+        ''', (*params, limit + 1))
+        rows = [dict(row) for row in await cursor.fetchall()]
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, has_more
+
+async def get_users_summary() -> List[Tuple[str, str, int, int]]:
+    """Количество пользователей по факультетам и группам: (факультет, группа, всего, активных)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('''
+            SELECT faculty_name, group_name, COUNT(*), COALESCE(SUM(is_active = 1), 0)
+            FROM users
+            GROUP BY faculty_name, group_name
+            ORDER BY faculty_name, group_name
+        ''')
+        return await cursor.fetchall()
+
+async def fetch_inactive_user_ids() -> Set[int]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('SELECT user_id FROM users WHERE is_active = 0')
+        rows = await cursor.fetchall()
+    return {row[0] for row in rows}
+
+async def load_inactive_users():
+    """Загрузка неактивных пользователей, чтобы узнавать их без запросов к БД"""
+    inactive_users.clear()
+    inactive_users.update(await fetch_inactive_user_ids())
+    logger.info(f"🔇 Неактивных пользователей: {len(inactive_users)}")
+
+async def inactive_users_sync():
+    """Раздельный режим: заблокировавших бота отмечают воркеры, и бот узнаёт о них только из БД"""
+    while True:
+        await asyncio.sleep(INACTIVE_USERS_SYNC_INTERVAL)
+        try:
+            ids = await fetch_inactive_user_ids()
+            added = len(ids - inactive_users)
+            inactive_users.clear()
+            inactive_users.update(ids)
+            if added:
+                logger.debug("🔇 Воркеры деактивировали пользователей: %d", added)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления неактивных пользователей: {e}")
+
 async def deactivate_user(user_id: int):
     """Деактивация пользователя (если заблокировал бота)"""
-    async with aiosqlite.connect('users.db') as db:
+    async with aiosqlite.connect(DB_PATH) as db:
         await db.execute('UPDATE users SET is_active = 0 WHERE user_id = ?', (user_id,))
         await db.commit()
-    logger.info(f"⚠️ Пользователь {user_id} деактивирован")
+    inactive_users.add(user_id)
+    logger.debug("⚠️ Пользователь %d деактивирован", user_id)
+
+async def reactivate_user(user_id: int):
+    """Возврат пользователя в рассылку (снова написал боту)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            'UPDATE users SET is_active = 1, last_activity = ? WHERE user_id = ?',
+            (datetime.now(), user_id)
+        )
+        await db.commit()
+    inactive_users.discard(user_id)
+    logger.info("🔔 Пользователь %d снова активен", user_id)
+
+@dp.update.outer_middleware()
+async def reactivate_on_activity(handler, event: types.Update, data: Dict[str, Any]):
+    """Любое обновление от деактивированного пользователя возвращает его в рассылку"""
+    user = data.get('event_from_user')
+    if user and user.id in inactive_users:
+        await reactivate_user(user.id)
+    return await handler(event, data)
 
 # ==================== КЕШИРОВАНИЕ ====================
-async def get_cached_schedule(faculty_id: str, group_id: str, target_date: date) -> Optional[List[Dict]]:
-    async with aiosqlite.connect('users.db') as db:
+def schedule_cache_ttl(status: str) -> timedelta:
+    return timedelta(hours={
+        SCHEDULE_EMPTY: EMPTY_CACHE_TTL_HOURS,
+        SCHEDULE_NO_DAY: NO_DAY_CACHE_TTL_HOURS,
+    }.get(status, CACHE_TTL_HOURS))
+
+@tracing.traced()
+async def get_cached_schedule(faculty_id: str, group_id: str, target_date: date) -> Optional[Tuple[str, List[Dict]]]:
+    """Статус и пары из кеша; None — записи нет или она устарела"""
+    async with aiosqlite.connect(DB_PATH) as db:
         cursor = await db.execute('''
-            SELECT schedule_data, updated_at 
+            SELECT schedule_data, updated_at, status
             FROM schedule_cache 
             WHERE group_id = ? AND faculty_id = ? AND target_date = ?
         ''', (group_id, faculty_id, target_date.isoformat()))
         row = await cursor.fetchone()
     
     if row:
-        data, updated_at = row
+        data, updated_at, status = row
         updated = datetime.fromisoformat(updated_at)
-        if datetime.now() - updated < timedelta(hours=CACHE_TTL_HOURS):
-            return json.loads(data)
+        if datetime.now() - updated < schedule_cache_ttl(status):
+            SCHEDULE_CACHE_LOOKUPS.inc(result='hit' if status == SCHEDULE_OK else 'negative')
+            return status, json.loads(data)
+        SCHEDULE_CACHE_LOOKUPS.inc(result='expired')
+        return None
     
+    SCHEDULE_CACHE_LOOKUPS.inc(result='miss')
     return None
 
-async def save_schedule_to_cache(faculty_id: str, group_id: str, target_date: date, schedule: List[Dict]):
-    async with aiosqlite.connect('users.db') as db:
+def schedule_hash(status: str, schedule: List[Dict]) -> str:
+    payload = json.dumps([status, schedule], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+async def save_schedule_to_cache(faculty_id: str, group_id: str, target_date: date, schedule: List[Dict],
+                                 status: str = SCHEDULE_OK):
+    async with aiosqlite.connect(DB_PATH) as db:
         await db.execute('''
-            INSERT OR REPLACE INTO schedule_cache (group_id, faculty_id, target_date, schedule_data, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (group_id, faculty_id, target_date.isoformat(), json.dumps(schedule, ensure_ascii=False), datetime.now()))
+            INSERT OR REPLACE INTO schedule_cache
+            (group_id, faculty_id, target_date, schedule_data, updated_at, status, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (group_id, faculty_id, target_date.isoformat(), json.dumps(schedule, ensure_ascii=False),
+              datetime.now(), status, schedule_hash(status, schedule)))
+        await db.commit()
+    schedule_cached(faculty_id, group_id, target_date, schedule)
+
+def schedule_cached(faculty_id: str, group_id: str, target_date: date, schedule: List[Dict]):
+    """Новая версия дня группы в кеше: сброс производных данных в памяти"""
+    invalidate_week_view(faculty_id, group_id, target_date)
+    lesson_index.update(faculty_id, group_id, target_date, schedule)
+    if schedule_api:
+        schedule_api.invalidate(faculty_id, group_id, target_date)
+
+async def get_empty_groups(target_date: date) -> Set[Tuple[str, str]]:
+    """Группы, у которых на дату заведомо нет пар (по ещё не устаревшим записям кеша)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('''
+            SELECT faculty_id, group_id, status, updated_at FROM schedule_cache
+            WHERE target_date = ? AND status != ?
+        ''', (target_date.isoformat(), SCHEDULE_OK))
+        rows = await cursor.fetchall()
+    now = datetime.now()
+    return {
+        (faculty_id, group_id) for faculty_id, group_id, status, updated_at in rows
+        if now - datetime.fromisoformat(updated_at) < schedule_cache_ttl(status)
+    }
+
+# ==================== ОЧИСТКА КЕША РАСПИСАНИЙ ====================
+def format_bytes(size: Optional[int]) -> str:
+    if size is None:
+        return "н/д"
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'Б' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+async def schedule_cache_stats(db: aiosqlite.Connection) -> Dict[str, Optional[int]]:
+    """Строки и размер schedule_cache с индексами, размер файла и свободные страницы"""
+    cursor = await db.execute('SELECT COUNT(*) FROM schedule_cache')
+    rows = (await cursor.fetchone())[0]
+    try:
+        cursor = await db.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'schedule_cache')
+        ''')
+        table_bytes = (await cursor.fetchone())[0]
+    except aiosqlite.OperationalError:
+        # SQLite собран без dbstat
+        table_bytes = None
+    page_size = (await (await db.execute('PRAGMA page_size')).fetchone())[0]
+    pages = (await (await db.execute('PRAGMA page_count')).fetchone())[0]
+    free = (await (await db.execute('PRAGMA freelist_count')).fetchone())[0]
+    return {'rows': rows, 'table_bytes': table_bytes, 'file_bytes': pages * page_size,
+            'free_bytes': free * page_size}
+
+async def delete_in_batches(db: aiosqlite.Connection, condition: str, params: Tuple) -> int:
+    """DELETE пачками по CACHE_RETENTION_BATCH строк, каждая в своей транзакции"""
+    deleted = 0
+    while True:
+        cursor = await db.execute(f'''
+            DELETE FROM schedule_cache WHERE rowid IN (
+                SELECT rowid FROM schedule_cache WHERE {condition} LIMIT ?
+            )
+        ''', (*params, CACHE_RETENTION_BATCH))
         await db.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < CACHE_RETENTION_BATCH:
+            return deleted
+        # Между пачками бот и воркеры успевают записать своё
+        await asyncio.sleep(0.05)
+
+async def purge_schedule_cache() -> Dict[str, Any]:
+    """Удаление прошедших дней старше окна и давно не обновлявшихся записей, затем возврат места файлу"""
+    global last_cache_purge
+    started = perf_counter()
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    async with aiosqlite.connect(DB_PATH, timeout=30) as db:
+        before = await schedule_cache_stats(db)
+        past = await delete_in_batches(db, 'target_date < ?',
+                                       ((today - timedelta(days=SCHEDULE_RETENTION_DAYS)).isoformat(),))
+        # Прошедшие дни больше не обновляются, их срок задаёт только окно выше
+        stale = await delete_in_batches(db, 'updated_at < ? AND target_date >= ?',
+                                        (datetime.now() - timedelta(days=SCHEDULE_STALE_DAYS), today.isoformat()))
+        
+        auto_vacuum = (await (await db.execute('PRAGMA auto_vacuum')).fetchone())[0]
+        if auto_vacuum != SQLITE_AUTO_VACUUM_INCREMENTAL:
+            # База создана до включения auto_vacuum: режим меняется только полным VACUUM, один раз
+            vacuum_started = perf_counter()
+            await db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            await db.execute('VACUUM')
+            logger.info(f"🧹 База переведена на auto_vacuum=INCREMENTAL за {perf_counter() - vacuum_started:.1f} с")
+        else:
+            # execute() делает один шаг прагмы и освобождает одну страницу; executescript доводит её до конца
+            await db.executescript('PRAGMA incremental_vacuum;')
+        after = await schedule_cache_stats(db)
+    
+    last_cache_purge = {
+        'at': datetime.now(LOCAL_TIMEZONE), 'past': past, 'stale': stale,
+        'before': before, 'after': after, 'seconds': perf_counter() - started,
+    }
+    CACHE_PURGED_ROWS.inc(past, reason='past')
+    CACHE_PURGED_ROWS.inc(stale, reason='stale')
+    logger.info(f"🧹 Кеш расписаний: удалено {past} прошедших и {stale} устаревших записей, "
+                f"файл {format_bytes(before['file_bytes'])} → {format_bytes(after['file_bytes'])}")
+    return last_cache_purge
+
+def format_cache_purge(report: Dict[str, Any]) -> str:
+    before, after = report['before'], report['after']
+    return (
+        f"<b>Очистка кеша расписаний ({report['at']:%d.%m %H:%M}, {report['seconds']:.1f} с):</b>\n"
+        f"Удалено: прошедших дней {report['past']}, не обновлявшихся {report['stale']}\n"
+        f"Строк: {before['rows']} → {after['rows']}\n"
+        f"Таблица с индексами: {format_bytes(before['table_bytes'])} → {format_bytes(after['table_bytes'])}\n"
+        f"Файл БД: {format_bytes(before['file_bytes'])} → {format_bytes(after['file_bytes'])} "
+        f"(свободно {format_bytes(after['free_bytes'])})"
+    )
+
+async def schedule_cache_retention():
+    """Очистка кеша раз в CACHE_RETENTION_INTERVAL секунд; первая — вскоре после старта"""
+    await asyncio.sleep(60)
+    while True:
+        try:
+            await purge_schedule_cache()
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки кеша расписаний: {e}")
+        await asyncio.sleep(CACHE_RETENTION_INTERVAL)
 
 # ==================== RATE LIMITING ====================
 async def check_rate_limit() -> bool:
     global request_timestamps
+    if SHARED_RATE_LIMIT:
+        wait_time = await job_queue.reserve_request(MAX_REQUESTS_PER_MINUTE)
+        while wait_time:
+            logger.warning(f"⚠️ Достигнут общий лимит запросов. Ожидание {wait_time:.0f} секунд")
+            RATE_LIMIT_WAIT_SECONDS.observe(wait_time)
+            await asyncio.sleep(wait_time)
+            wait_time = await job_queue.reserve_request(MAX_REQUESTS_PER_MINUTE)
+        return True
     now = datetime.now()
     request_timestamps = [ts for ts in request_timestamps if now - ts < timedelta(minutes=1)]
     
     if len(request_timestamps) >= MAX_REQUESTS_PER_MINUTE:
         wait_time = 60 - (now - request_timestamps[0]).seconds
         logger.warning(f"⚠️ Достигнут лимит запросов. Ожидание {wait_time} секунд")
+        RATE_LIMIT_WAIT_SECONDS.observe(wait_time)
         await asyncio.sleep(wait_time)
         return await check_rate_limit()
     
     request_timestamps.append(now)
     return True
 
+# ==================== HTTP-КЛИЕНТ ====================
+def create_trace_config() -> aiohttp.TraceConfig:
+    """Трассировка запросов: переиспользование соединений и время до первого байта"""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.started = asyncio.get_running_loop().time()
+        ctx.reused = True
+
+    async def on_connection_create_end(session, ctx, params):
+        ctx.reused = False
+
+    async def on_request_end(session, ctx, params):
+        ttfb = asyncio.get_running_loop().time() - ctx.started
+        connection = "переиспользовано" if ctx.reused else "новое"
+        logger.debug("⚡ %s: соединение %s, TTFB %.0f мс", params.url.path_qs, connection, ttfb * 1000)
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Создание HTTP-сессии с пулом keep-alive соединений и кешем DNS"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TOTAL_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers=HTTP_HEADERS,
+        trace_configs=[create_trace_config()],
+    )
+
+# ==================== ЗАПИСЬ И ВОСПРОИЗВЕДЕНИЕ HTTP-ОТВЕТОВ ====================
+class ResponseStore:
+    """Контентно-адресуемое хранилище HTTP-ответов на диске.
+
+    Тела лежат в blobs/<sha256 тела>, а index/<sha256 адреса>.json связывает
+    путь с запросом (без хоста) с телом и кодировкой. Одинаковые страницы
+    хранятся один раз, а записи воспроизводятся с любого хоста.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index_dir = self.root / 'index'
+        self.blob_dir = self.root / 'blobs'
+
+    @staticmethod
+    def key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+    def _index_path(self, key: str) -> Path:
+        return self.index_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        path = self._index_path(self.key(url))
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding='utf-8'))
+
+    def read_blob(self, entry: Dict[str, Any]) -> bytes:
+        return (self.blob_dir / entry['blob']).read_bytes()
+
+    def save(self, url: str, body: bytes, charset: Optional[str]):
+        digest = hashlib.sha256(body).hexdigest()
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        blob_path = self.blob_dir / digest
+        if not blob_path.exists():
+            blob_path.write_bytes(body)
+        key = self.key(url)
+        entry = {'url': key, 'blob': digest, 'charset': charset, 'recorded_at': datetime.now().isoformat()}
+        self._index_path(key).write_text(json.dumps(entry, ensure_ascii=False), encoding='utf-8')
+
+    def entries(self) -> List[Dict[str, Any]]:
+        if not self.index_dir.exists():
+            return []
+        return [json.loads(p.read_text(encoding='utf-8')) for p in self.index_dir.glob('*.json')]
+
+response_store = ResponseStore(HTTP_CACHE_DIR)
+
+async def iter_bytes(body: bytes):
+    """Отдаёт тело ответа частями, как сетевой поток"""
+    view = memoryview(body)
+    for offset in range(0, len(body), HTML_CHUNK_SIZE):
+        yield bytes(view[offset:offset + HTML_CHUNK_SIZE])
+
 # ==================== ПАРСИНГ ====================
-async def fetch_html(url: str, retry: int = 3) -> Optional[str]:
-    """Получение HTML с повторными попытками"""
+async def fetch_with_retry(url: str, read_body, retry: int = 3):
+    """Запрос с повторными попытками; тело читает read_body(поток частей, кодировка)"""
     global http_session
     
+    if HTTP_CACHE_MODE == 'replay':
+        entry = await asyncio.to_thread(response_store.lookup, url)
+        if entry is None:
+            logger.warning("📼 Нет записанного ответа для %s", url)
+            return None
+        body = await asyncio.to_thread(response_store.read_blob, entry)
+        return await read_body(iter_bytes(body), entry['charset'])
+    
     for attempt in range(retry):
         await check_rate_limit()
+        if attempt:
+            HTTP_RETRIES.inc()
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Connection': 'keep-alive',
-        }
-        
+        started = perf_counter()
         try:
-            logger.info(f"📡 Попытка {attempt + 1}/{retry}: {url}")
-            async with http_session.get(url, headers=headers, timeout=30) as response:
+            logger.debug("📡 Попытка %d/%d: %s", attempt + 1, retry, url)
+            async with http_session.get(url) as response:
+                HTTP_RESPONSES.inc(status=response.status)
                 if response.status == 200:
-                    html = await response.text()
-                    logger.info(f"✅ Успешно получен HTML ({len(html)} символов)")
-                    return html
+                    if HTTP_CACHE_MODE == 'record':
+                        body = await response.read()
+                        await asyncio.to_thread(response_store.save, url, body, response.charset)
+                        return await read_body(iter_bytes(body), response.charset)
+                    return await read_body(response.content.iter_chunked(HTML_CHUNK_SIZE), response.charset)
                 else:
-                    logger.warning(f"⚠️ Статус ответа: {response.status}")
+                    logger.warning("⚠️ Статус ответа %d: %s", response.status, url)
                     
         except asyncio.TimeoutError:
-            logger.warning(f"⏰ Таймаут {attempt + 1}/{retry}")
+            HTTP_RESPONSES.inc(status='timeout')
+            logger.warning("⏰ Таймаут %d/%d: %s", attempt + 1, retry, url)
         except aiohttp.ClientConnectorError as e:
-            logger.warning(f"🔌 Ошибка подключения {attempt + 1}/{retry}: {e}")
+            HTTP_RESPONSES.inc(status='connect_error')
+            logger.warning("🔌 Ошибка подключения %d/%d: %s", attempt + 1, retry, e)
         except Exception as e:
-            logger.warning(f"❌ Ошибка {attempt + 1}/{retry}: {e}")
+            HTTP_RESPONSES.inc(status='error')
+            logger.warning("❌ Ошибка %d/%d: %s", attempt + 1, retry, e)
+        finally:
+            HTTP_FETCH_SECONDS.observe(perf_counter() - started)
         
         if attempt < retry - 1:
             wait = 5 * (attempt + 1)
-            logger.info(f"⏳ Ожидание {wait} сек перед следующей попыткой...")
+            logger.info("⏳ Ожидание %d сек перед следующей попыткой...", wait)
             await asyncio.sleep(wait)
     
-    logger.error(f"❌ Все {retry} попыток провалились для {url}")
+    logger.error("❌ Все %d попыток провалились для %s", retry, url)
     return None
 
+async def read_html(chunks, charset: Optional[str]) -> str:
+    body = b''.join([chunk async for chunk in chunks])
+    html = body.decode(charset or 'utf-8')
+    logger.debug("✅ Успешно получен HTML (%d символов)", len(html))
+    return html
+
+@tracing.traced()
+async def fetch_html(url: str, retry: int = 3) -> Optional[str]:
+    """Получение HTML с повторными попытками"""
+    return await fetch_with_retry(url, read_html, retry)
+
+class WeekTableTarget:
+    """Цель потокового парсера lxml: собирает ячейки первой таблицы страницы, не строя дерево документа.
+
+    Каждая ячейка — словарь с тегом, непустыми текстовыми узлами и вложенными div.
+    Для div запоминаются его текстовые узлы, а для первого div ячейки ещё и
+    тексты бейджа типа занятия, ссылки на преподавателя и ссылки на аудиторию.
+    """
+
+    def __init__(self):
+        self.rows: List[List[Dict]] = []
+        self.found = False
+        self.done = False
+        self._table_depth = 0
+        self._cell: Optional[Dict] = None
+        self._open_divs: List[Dict] = []
+        self._inline: List[Tuple[str, Optional[List[str]]]] = []
+        self._text: List[str] = []
+
+    def _flush(self):
+        if not self._text:
+            return
+        text = ''.join(self._text).strip()
+        self._text = []
+        if not text:
+            return
+        self._cell['strings'].append(text)
+        for div in self._open_divs:
+            div['strings'].append(text)
+        for _, captured in self._inline:
+            if captured is not None:
+                captured.append(text)
+
+    def _inline_field(self, tag: str, attrib) -> Optional[List[str]]:
+        """Поле первого div ячейки, которое заполняет текст открывающегося span/a"""
+        divs = self._cell['divs']
+        if not divs or divs[0] not in self._open_divs:
+            return None
+        lesson_info = divs[0]
+        field = None
+        if tag == 'span' and 'schedule-lesson-type-badge' in (attrib.get('class') or '').split():
+            field = 'badge'
+        elif tag == 'a' and '/schedule-frame/lecturer' in (attrib.get('href') or ''):
+            field = 'teacher'
+        elif tag == 'a' and '/schedule-frame/classroom' in (attrib.get('href') or ''):
+            field = 'audience'
+        if field is None or lesson_info[field] is not None:
+            return None
+        lesson_info[field] = []
+        return lesson_info[field]
+
+    def start(self, tag, attrib):
+        if self._cell is not None:
+            self._flush()
+        if self.done:
+            return
+        if tag == 'table':
+            self._table_depth += 1
+            self.found = True
+        elif self._table_depth == 1 and tag == 'tr':
+            self.rows.append([])
+            self._cell = None
+        elif self._table_depth == 1 and tag in ('td', 'th') and self.rows:
+            self._cell = {'tag': tag, 'strings': [], 'divs': []}
+            self._open_divs = []
+            self._inline = []
+            self.rows[-1].append(self._cell)
+        elif self._cell is not None:
+            if tag == 'div':
+                div = {'strings': [], 'badge': None, 'teacher': None, 'audience': None}
+                self._cell['divs'].append(div)
+                self._open_divs.append(div)
+            elif tag in ('span', 'a'):
+                self._inline.append((tag, self._inline_field(tag, attrib)))
+
+    def end(self, tag):
+        if self._cell is not None:
+            self._flush()
+        if self.done:
+            return
+        if tag == 'table' and self._table_depth:
+            self._table_depth -= 1
+            if self._table_depth == 0:
+                self.done = True
+                self._cell = None
+        elif self._table_depth == 1 and tag in ('td', 'th', 'tr'):
+            self._cell = None
+            self._open_divs = []
+            self._inline = []
+        elif self._cell is not None:
+            if tag == 'div' and self._open_divs:
+                self._open_divs.pop()
+            elif tag in ('span', 'a') and self._inline and self._inline[-1][0] == tag:
+                self._inline.pop()
+
+    def data(self, text):
+        if self._cell is not None and not self.done:
+            self._text.append(text)
+
+    def close(self):
+        return self
+
+async def read_week_table(chunks, charset: Optional[str]) -> List[List[Dict]]:
+    """Потоковое чтение страницы расписания: байты идут прямо в парсер lxml в объявленной кодировке"""
+    target = WeekTableTarget()
+    from lxml import etree
+    parser = etree.HTMLParser(target=target, encoding=charset or 'utf-8')
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        # Хвост после таблицы дочитывается без разбора: недочитанный ответ aiohttp
+        # не возвращает в пул, и соединение keep-alive закрылось бы
+        if not target.done:
+            parser.feed(chunk)
+    parser.close()
+    
+    logger.debug("✅ Таблица прочитана потоком (%d байт, строк: %d)", received, len(target.rows))
+    return target.rows if target.found else []
+
+@tracing.traced()
+async def fetch_week_table(url: str, retry: int = 3) -> Optional[List[List[Dict]]]:
+    """Получение таблицы недели; None — запрос не удался, [] — таблицы на странице нет
+
+    Одновременные вызовы с одним url ждут один запрос к сайту и получают одну таблицу
+    (её только читают).
+    """
+    task = week_table_fetches.get(url)
+    if task is None:
+        task = week_table_fetches[url] = asyncio.ensure_future(fetch_with_retry(url, read_week_table, retry))
+        task.add_done_callback(lambda _: week_table_fetches.pop(url, None))
+    else:
+        WEEK_FETCHES_COALESCED.inc()
+    # Отмена одного вызывающего не должна отменять загрузку для остальных
+    return await asyncio.shield(task)
+
+def cell_text(cell: Dict, separator: str = '') -> str:
+    return separator.join(cell['strings'])
+
 # ==================== ЗАГРУЗКА ГРУПП В ФОНЕ ====================
-async def load_groups_for_faculty(faculty_id: str, faculty_name: str):
-    """Загружает группы для одного факультета"""
+async def load_groups_from_db() -> Optional[datetime]:
+    """Список групп, сохранённый прошлым запуском; возвращает время его загрузки с сайта"""
     global all_groups_cache
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('SELECT group_name, faculty_id, group_id, faculty_name, updated_at FROM groups_cache')
+        rows = await cursor.fetchall()
+    if not rows:
+        return None
+    all_groups_cache = {
+        group_name: {'faculty_id': faculty_id, 'group_id': group_id, 'faculty_name': faculty_name}
+        for group_name, faculty_id, group_id, faculty_name, _ in rows
+    }
+    return min(datetime.fromisoformat(row[4]) for row in rows)
+
+async def save_groups_to_db(groups: Dict[str, Dict[str, str]]):
+    now = datetime.now()
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute('DELETE FROM groups_cache')
+        await db.executemany('''
+            INSERT INTO groups_cache (group_name, faculty_id, group_id, faculty_name, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(name, info['faculty_id'], info['group_id'], info['faculty_name'], now)
+              for name, info in groups.items()])
+        await db.commit()
+
+async def load_groups_for_faculty(faculty_id: str, faculty_name: str, groups: Dict[str, Dict[str, str]]):
+    """Загружает группы для одного факультета"""
+    # BeautifulSoup нужен только здесь, поэтому не импортируется при старте бота
+    from bs4 import BeautifulSoup
     url = f"{SCHEDULE_URL}?faculty={faculty_id}&group=&date="
     try:
         html = await fetch_html(url)
@@ -325,19 +1328,20 @@ async def load_groups_for_faculty(faculty_id: str, faculty_name: str):
                         group_name = item.get('label')
                         group_id = item.get('value')
                         if group_name and group_id and group_id != 0 and 'Не выбрана' not in group_name:
-                            all_groups_cache[group_name] = {
+                            groups[group_name] = {
                                 'faculty_id': faculty_id,
                                 'group_id': str(group_id),
                                 'faculty_name': faculty_name
                             }
-        logger.info(f"✅ Загружено групп для {faculty_name}: {len([g for g in all_groups_cache.values() if g['faculty_name'] == faculty_name])}")
+        logger.info(f"✅ Загружено групп для {faculty_name}: {len([g for g in groups.values() if g['faculty_name'] == faculty_name])}")
     except Exception as e:
         logger.error(f"Ошибка загрузки групп для {faculty_name}: {e}")
 
 async def load_all_groups_background():
-    """Загружает все группы в фоне (запускается после старта бота)"""
+    """Загружает все группы с сайта; прежний список доступен, пока идёт загрузка"""
+    from bs4 import BeautifulSoup
     global all_groups_cache, groups_loaded
-    all_groups_cache = {}
+    groups: Dict[str, Dict[str, str]] = {}
     
     try:
         html = await fetch_html(SCHEDULE_URL)
@@ -363,103 +1367,172 @@ async def load_all_groups_background():
         logger.info(f"📚 Найдено факультетов: {len(faculties)}")
         
         for faculty_id, faculty_name in faculties.items():
-            await load_groups_for_faculty(faculty_id, faculty_name)
+            await load_groups_for_faculty(faculty_id, faculty_name, groups)
             await asyncio.sleep(1)
         
         groups_loaded = True
+        if groups:
+            all_groups_cache = groups
+            await save_groups_to_db(groups)
         logger.info(f"✅ Все группы загружены в кеш (всего {len(all_groups_cache)} групп)")
         
     except Exception as e:
         logger.error(f"❌ Ошибка загрузки групп: {e}")
         groups_loaded = True
 
-async def parse_daily_schedule(faculty_id: str, group_id: str, target_date: date, use_cache: bool = True) -> List[Dict]:
-    """Парсинг расписания на конкретную дату с сохранением нумерации пар"""
+async def start_schedule_api():
+    global schedule_api
+    server = ScheduleApi(load_week_lessons, LOCAL_TIMEZONE, group_name, is_known_group,
+                         calendar_weeks=API_CALENDAR_WEEKS, cache_size=API_CACHE_SIZE,
+                         max_age=NO_DAY_CACHE_TTL_HOURS * 3600, days_back=SCHEDULE_RETENTION_DAYS,
+                         days_ahead=API_DAYS_AHEAD, failure_ttl=API_FAILURE_TTL_SECONDS,
+                         requests=API_REQUESTS)
+    try:
+        await server.start(API_HOST, API_PORT)
+    except OSError:
+        await server.stop()
+        raise
+    schedule_api = server
+    logger.info(f"🌐 API расписаний: http://{API_HOST}:{API_PORT}/api/")
+
+async def warm_up():
+    """Некритичная подготовка после старта: бот уже принимает обновления
+
+    Группы загружаются до серверов метрик и API: занятый порт не должен оставлять
+    бота без списка групп, поэтому ошибка запуска сервера только логируется.
+    """
+    global metrics_runner, groups_loaded
+    loaded_at = await load_groups_from_db()
+    if loaded_at:
+        groups_loaded = True
+        logger.info(f"✅ Группы из БД: {len(all_groups_cache)} (загружены {loaded_at:%d.%m %H:%M})")
+    
+    if METRICS_PORT:
+        try:
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+            logger.info(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.error(f"❌ Сервер метрик не запущен ({METRICS_HOST}:{METRICS_PORT}): {e}")
+    if API_PORT:
+        try:
+            await start_schedule_api()
+        except OSError as e:
+            logger.error(f"❌ API расписаний не запущен ({API_HOST}:{API_PORT}): {e}")
+    
+    if loaded_at and datetime.now() - loaded_at < timedelta(hours=GROUPS_CACHE_TTL_HOURS):
+        return
+    await load_all_groups_background()
+
+@tracing.traced('parse_daily_schedule')
+async def get_daily_schedule(faculty_id: str, group_id: str, target_date: date,
+                             use_cache: bool = True) -> Tuple[str, List[Dict]]:
+    """Пары на дату и статус: ok, empty (пар нет), no_day (дня нет на странице), failed (сайт не ответил)
+
+    Пустые дни кешируются наравне с обычными, но со своим сроком; неудачный запрос
+    не кешируется, и следующее обращение снова идёт на сайт.
+    """
+    started = perf_counter()
     if use_cache:
         cached = await get_cached_schedule(faculty_id, group_id, target_date)
         if cached is not None:
-            if cached and len(cached) > 0 and 'number' in cached[0]:
-                return cached
+            status, lessons = cached
+            if not lessons or 'number' in lessons[0]:
+                SCHEDULE_PARSE_SECONDS.observe(perf_counter() - started, source='cache')
+                return status, lessons
             else:
                 logger.info("⚠️ Кеш устарел (нет поля number), парсим заново")
     
-    week_number = target_date.isocalendar()[1]
-    year = target_date.year
+    status, lessons = await fetch_daily_lessons(faculty_id, group_id, target_date)
+    SCHEDULE_PARSE_SECONDS.observe(perf_counter() - started, source='network')
     
+    if use_cache and status != SCHEDULE_FAILED:
+        await save_schedule_to_cache(faculty_id, group_id, target_date, lessons, status)
+    
+    return status, lessons
+
+async def parse_daily_schedule(faculty_id: str, group_id: str, target_date: date, use_cache: bool = True) -> List[Dict]:
+    """Парсинг расписания на конкретную дату с сохранением нумерации пар"""
+    _, lessons = await get_daily_schedule(faculty_id, group_id, target_date, use_cache)
+    return lessons
+
+def week_url(faculty_id: str, group_id: str, target_date: date) -> str:
     params = {
         'faculty': faculty_id,
         'group': group_id,
-        'week': week_number,
-        'year': year
+        'week': target_date.isocalendar()[1],
+        'year': target_date.year
     }
-    url = f"{SCHEDULE_URL}?{urlencode(params)}"
-    
-    logger.info(f"🌐 Запрос расписания: {url}")
+    return f"{SCHEDULE_URL}?{urlencode(params)}"
+
+async def fetch_daily_lessons(faculty_id: str, group_id: str, target_date: date) -> Tuple[str, List[Dict]]:
+    """Загрузка недели с сайта и разбор пар нужного дня"""
+    url = week_url(faculty_id, group_id, target_date)
     
-    html = await fetch_html(url)
-    if not html:
-        return []
+    logger.debug("🌐 Запрос расписания: %s", url)
     
-    soup = BeautifulSoup(html, 'html.parser')
+    rows = await fetch_week_table(url)
+    if rows is None:
+        return SCHEDULE_FAILED, []
     
-    table = soup.find('table')
-    if not table:
-        logger.error("❌ Таблица не найдена")
-        return []
+    if not rows:
+        logger.error("❌ Таблица не найдена: %s", url)
+        return SCHEDULE_NO_DAY, []
     
-    header_row = table.find('tr')
-    if not header_row:
-        return []
+    status, lessons = extract_day_lessons(rows, target_date)
+    if status == SCHEDULE_NO_DAY:
+        logger.error("❌ День %s не найден: %s", target_date, url)
+    logger.debug("📊 %s/%s на %s: найдено пар %d", faculty_id, group_id, target_date, len(lessons))
+    return status, lessons
+
+def extract_day_lessons(rows: List[List[Dict]], target_date: date) -> Tuple[str, List[Dict]]:
+    """Пары одного дня из таблицы недели"""
+    if not rows:
+        return SCHEDULE_NO_DAY, []
     
-    headers = header_row.find_all('th')
+    headers = [cell for cell in rows[0] if cell['tag'] == 'th']
     
     target_date_str = target_date.strftime('%d %B').lower()
     day_index = None
     
     for i, th in enumerate(headers):
-        th_text = th.get_text(strip=True).lower()
+        th_text = cell_text(th).lower()
         if target_date_str in th_text or str(target_date.day) in th_text:
             day_index = i
-            logger.info(f"✅ Найден день {target_date_str} в колонке {i}")
+            logger.debug("✅ Найден день %s в колонке %d", target_date_str, i)
             break
     
     if day_index is None:
-        logger.error(f"❌ День {target_date_str} не найден")
-        return []
+        return SCHEDULE_NO_DAY, []
     
     lessons = []
-    rows = table.find_all('tr')[1:]
     
-    for row_idx, row in enumerate(rows, 1):
-        time_cell = row.find('td')
-        if not time_cell:
+    for row_idx, row in enumerate(rows[1:], 1):
+        cells = [cell for cell in row if cell['tag'] == 'td']
+        if not cells:
             continue
         
-        time_divs = time_cell.find_all('div')
+        time_divs = cells[0]['divs']
         if len(time_divs) < 2:
             continue
         
-        start_time = time_divs[0].get_text(strip=True)
-        end_time = time_divs[1].get_text(strip=True)
+        start_time = cell_text(time_divs[0])
+        end_time = cell_text(time_divs[1])
         
-        cells = row.find_all('td')
         if len(cells) <= day_index:
             continue
         
         lesson_cell = cells[day_index]
         
-        cell_text = lesson_cell.get_text(strip=True)
-        if not cell_text or cell_text == '':
+        if not cell_text(lesson_cell):
             continue
         
-        lesson_info = lesson_cell.find('div')
-        if not lesson_info:
+        if not lesson_cell['divs']:
             continue
+        lesson_info = lesson_cell['divs'][0]
         
-        type_badge = lesson_info.find('span', class_='schedule-lesson-type-badge')
         lesson_type = "лекция"
-        if type_badge:
-            badge_text = type_badge.get_text(strip=True)
+        if lesson_info['badge'] is not None:
+            badge_text = ''.join(lesson_info['badge'])
             if 'Лек' in badge_text:
                 lesson_type = "лекция"
             elif 'Лаб' in badge_text:
@@ -467,25 +1540,23 @@ async def parse_daily_schedule(faculty_id: str, group_id: str, target_date: date
             elif 'Упр' in badge_text or 'Пр' in badge_text:
                 lesson_type = "практика"
         
-        cell_text = lesson_info.get_text(separator=' ', strip=True)
+        lesson_text = cell_text(lesson_info, ' ')
         
-        if type_badge:
-            cell_text = cell_text.replace(type_badge.get_text(strip=True), '').strip()
+        if lesson_info['badge'] is not None:
+            lesson_text = lesson_text.replace(''.join(lesson_info['badge']), '').strip()
         
         subject = "Предмет"
         
-        teacher_link = lesson_info.find('a', href=re.compile(r'/schedule-frame/lecturer'))
         teacher = "Не указан"
-        if teacher_link:
-            teacher = teacher_link.get_text(strip=True)
-            parts = cell_text.split(teacher)[0].strip().rstrip(',')
+        if lesson_info['teacher'] is not None:
+            teacher = ''.join(lesson_info['teacher'])
+            parts = lesson_text.split(teacher)[0].strip().rstrip(',')
             if parts:
                 subject = parts
         
         audience = "Не указана"
-        aud_link = lesson_info.find('a', href=re.compile(r'/schedule-frame/classroom'))
-        if aud_link:
-            audience = aud_link.get_text(strip=True)
+        if lesson_info['audience'] is not None:
+            audience = ''.join(lesson_info['audience'])
         
         lessons.append({
             'number': row_idx,
@@ -497,19 +1568,16 @@ async def parse_daily_schedule(faculty_id: str, group_id: str, target_date: date
             'audience': audience
         })
         
-        logger.info(f"➕ Добавлена {row_idx}-я пара: {start_time}-{end_time} {subject}")
-    
-    logger.info(f"📊 Всего найдено пар: {len(lessons)}")
+        logger.debug("➕ Добавлена %d-я пара: %s-%s %s", row_idx, start_time, end_time, subject)
     
-    if use_cache and lessons:
-        await save_schedule_to_cache(faculty_id, group_id, target_date, lessons)
-    
-    return lessons
+    return (SCHEDULE_OK if lessons else SCHEDULE_EMPTY), lessons
 
 # ==================== ГЕНЕРАЦИЯ СООБЩЕНИЙ ====================
-async def generate_daily_message(user_id: int, target_date: date) -> Optional[str]:
+@tracing.traced()
+async def generate_daily_message(user_id: int, target_date: date, settings: Optional[Dict[str, Any]] = None) -> Optional[str]:
     """Генерация сообщения с расписанием с правильной нумерацией пар"""
-    settings = await get_user_settings(user_id)
+    if settings is None:
+        settings = await get_user_settings(user_id)
     if not settings:
         return None
     
@@ -520,9 +1588,10 @@ async def generate_daily_message(user_id: int, target_date: date) -> Optional[st
         use_cache=True
     )
     
-    if not lessons:
-        return None
-    
+    return render_daily_message(settings, lessons, target_date)
+
+def format_day_title(target_date: date) -> str:
+    """«Понедельник, 19 октября»"""
     month_rus = {
         1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля', 5: 'мая', 6: 'июня',
         7: 'июля', 8: 'августа', 9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
@@ -530,12 +1599,17 @@ async def generate_daily_message(user_id: int, target_date: date) -> Optional[st
     
     weekday_rus = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
     
-    day_name = weekday_rus[target_date.weekday()].capitalize()
-    month_name = month_rus[target_date.month]
+    return f"{weekday_rus[target_date.weekday()].capitalize()}, {target_date.day} {month_rus[target_date.month]}"
+
+@tracing.traced()
+def render_daily_message(settings: Dict[str, Any], lessons: List[Dict], target_date: date) -> Optional[str]:
+    """Текст сообщения с расписанием по уже полученным парам"""
+    if not lessons:
+        return None
     
     message_parts = []
     
-    message_parts.append(f"{emoji('calendar')} <b>{day_name}, {target_date.day} {month_name} | {settings['faculty_name']}, гр. {settings['group_name']}</b>")
+    message_parts.append(f"{emoji('calendar')} <b>{format_day_title(target_date)} | {settings['faculty_name']}, гр. {settings['group_name']}</b>")
     message_parts.append("")
     
     for lesson in lessons:
@@ -551,71 +1625,259 @@ async def generate_daily_message(user_id: int, target_date: date) -> Optional[st
     
     return "\n".join(message_parts).strip()
 
+# ==================== НЕДЕЛЯ ОДНИМ СООБЩЕНИЕМ ====================
+# Отрисованные дни недели группы: (faculty_id, group_id, понедельник) -> (время сборки, 7 текстов)
+week_views: 'OrderedDict[Tuple[str, str, date], Tuple[datetime, List[str]]]' = OrderedDict()
+week_view_builds: Dict[Tuple[str, str, date], asyncio.Future] = {}
+WEEKDAY_SHORT = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+def invalidate_week_view(faculty_id: str, group_id: str, target_date: date):
+    week_views.pop((faculty_id, group_id, target_date - timedelta(days=target_date.weekday())), None)
+
+def render_day_page(settings: Dict[str, Any], lessons: List[Dict], target_date: date) -> str:
+    return render_daily_message(settings, lessons, target_date) or (
+        f"{emoji('calendar')} <b>{format_day_title(target_date)} | {settings['faculty_name']}, "
+        f"гр. {settings['group_name']}</b>\n\nПар нет"
+    )
+
+async def load_week_lessons(faculty_id: str, group_id: str,
+                            monday: date) -> Optional[Dict[date, Tuple[str, List[Dict]]]]:
+    """Все дни недели из кеша или из одного запроса страницы недели; None — сайт не ответил"""
+    days = [monday + timedelta(days=i) for i in range(7)]
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('''
+            SELECT target_date, status, schedule_data, updated_at FROM schedule_cache
+            WHERE group_id = ? AND faculty_id = ? AND target_date BETWEEN ? AND ?
+        ''', (group_id, faculty_id, days[0].isoformat(), days[-1].isoformat()))
+        rows = await cursor.fetchall()
+    now = datetime.now()
+    cached = {
+        date.fromisoformat(target_date): (status, json.loads(data)) for target_date, status, data, updated_at in rows
+        if now - datetime.fromisoformat(updated_at) < schedule_cache_ttl(status)
+    }
+    
+    if len(cached) < len(days):
+        table = await fetch_week_table(week_url(faculty_id, group_id, monday))
+        if table is None:
+            return None
+        cached = {}
+        for day in days:
+            status, lessons = extract_day_lessons(table, day)
+            await save_schedule_to_cache(faculty_id, group_id, day, lessons, status)
+            cached[day] = (status, lessons)
+    
+    return cached
+
+async def build_week_view(settings: Dict[str, Any], monday: date) -> Optional[List[str]]:
+    week = await load_week_lessons(settings['faculty_id'], settings['group_id'], monday)
+    if week is None:
+        return None
+    return [render_day_page(settings, lessons, day) for day, (_, lessons) in sorted(week.items())]
+
+async def store_week_view(key: Tuple[str, str, date], settings: Dict[str, Any]) -> Optional[List[str]]:
+    pages = await build_week_view(settings, key[2])
+    if pages is not None:
+        week_views[key] = (datetime.now(), pages)
+        while len(week_views) > WEEK_VIEW_CACHE_SIZE:
+            week_views.popitem(last=False)
+    return pages
+
+async def get_week_view(settings: Dict[str, Any], monday: date) -> Optional[List[str]]:
+    """Отрисованная неделя из памяти; одновременные запросы одной недели ждут одну сборку"""
+    key = (settings['faculty_id'], settings['group_id'], monday)
+    view = week_views.get(key)
+    if view and datetime.now() - view[0] < timedelta(hours=CACHE_TTL_HOURS):
+        week_views.move_to_end(key)
+        return view[1]
+    task = week_view_builds.get(key)
+    if task is None:
+        task = week_view_builds[key] = asyncio.ensure_future(store_week_view(key, settings))
+        task.add_done_callback(lambda _: week_view_builds.pop(key, None))
+    return await asyncio.shield(task)
+
+def week_keyboard(faculty_id: str, group_id: str, monday: date, selected: int) -> types.InlineKeyboardMarkup:
+    buttons = []
+    for i, name in enumerate(WEEKDAY_SHORT):
+        day = monday + timedelta(days=i)
+        label = f"{name} {day.day}"
+        buttons.append(types.InlineKeyboardButton(
+            text=f"• {label} •" if i == selected else label,
+            callback_data=f"week:{faculty_id}:{group_id}:{monday.isoformat()}:{i}"
+        ))
+    return types.InlineKeyboardMarkup(inline_keyboard=[buttons[:4], buttons[4:]])
+
+# ==================== ИНДЕКС ПРЕПОДАВАТЕЛЕЙ И АУДИТОРИЙ ====================
+# Названия групп по (faculty_id, group_id); пересобираются, когда all_groups_cache заменяется
+group_names: Dict[Tuple[str, str], str] = {}
+group_names_lower: Dict[str, str] = {}
+group_names_source: Optional[Dict[str, Dict[str, str]]] = None
+
+def refresh_group_names():
+    global group_names, group_names_lower, group_names_source
+    if group_names_source is not all_groups_cache:
+        group_names = {(info['faculty_id'], info['group_id']): name for name, info in all_groups_cache.items()}
+        group_names_lower = {name.lower(): name for name in all_groups_cache}
+        group_names_source = all_groups_cache
+
+def group_name(faculty_id: str, group_id: str) -> str:
+    refresh_group_names()
+    return group_names.get((faculty_id, group_id), group_id)
+
+def is_known_group(faculty_id: str, group_id: str) -> bool:
+    refresh_group_names()
+    return (faculty_id, group_id) in group_names
+
+async def load_lesson_index(since: Optional[str] = None) -> Optional[str]:
+    """Пополнение индекса записями schedule_cache, изменёнными после since (с их учётом сбрасываются
+    и готовые ответы /week и API); возвращает новую отметку"""
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('''
+            SELECT faculty_id, group_id, target_date, schedule_data, updated_at FROM schedule_cache
+            WHERE target_date >= ? AND updated_at > ?
+            ORDER BY updated_at
+        ''', (today.isoformat(), since or ''))
+        rows = await cursor.fetchall()
+    for faculty_id, group_id, target_date, data, updated_at in rows:
+        schedule_cached(faculty_id, group_id, date.fromisoformat(target_date), json.loads(data))
+        since = updated_at
+    return since
+
+async def lesson_index_sync():
+    """Индекс из кеша при старте, затем удаление прошедших дней
+
+    В раздельном режиме расписания в кеш пишут воркеры, поэтому их записи
+    подтягиваются раз в LESSON_INDEX_SYNC_INTERVAL секунд.
+    """
+    since = await load_lesson_index()
+    logger.info(f"🗂 Индекс преподавателей и аудиторий: {len(lesson_index)} пар")
+    while True:
+        await asyncio.sleep(LESSON_INDEX_SYNC_INTERVAL)
+        try:
+            lesson_index.purge_before(datetime.now(LOCAL_TIMEZONE).date())
+            if RUN_MODE == 'split':
+                since = await load_lesson_index(since)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления индекса преподавателей и аудиторий: {e}")
+
+def format_teacher_day(teacher: str, now: datetime) -> str:
+    lines = [f"👤 <b>{escape_html(teacher)}</b>"]
+    current = now.strftime('%H:%M')
+    lessons = lesson_index.teacher_day(teacher, now.date())
+    upcoming = [(slot, groups) for slot, groups in lessons if current < slot.end.zfill(5)]
+    if not lessons:
+        lines.append("Сегодня пар нет")
+    elif not upcoming:
+        lines.append("Пары на сегодня закончились")
+    for slot, groups in upcoming:
+        label = "Сейчас" if current >= slot.start.zfill(5) else "Далее"
+        names = ', '.join(escape_html(group_name(slot.faculty_id, group_id)) for group_id in groups)
+        lines.append(
+            f"{label}: {slot.number}-я пара ({slot.start}–{slot.end}), ауд. {escape_html(slot.audience)}\n"
+            f"   {escape_html(slot.subject)} ({slot.type}), гр. {names}"
+        )
+    return '\n'.join(lines)
+
 # ==================== ПЛАНИРОВЩИК НАПОМИНАНИЙ ====================
-reminder_tasks: Dict[str, asyncio.Task] = {}
+def get_reminder_time(lesson: Dict, target_date: date, lead: int = REMINDER_LEAD_MINUTES) -> datetime:
+    """Срок напоминания: за lead минут до начала пары"""
+    lesson_time = datetime.strptime(lesson['start'], '%H:%M').time()
+    lesson_datetime = LOCAL_TIMEZONE.localize(datetime.combine(target_date, lesson_time))
+    return lesson_datetime - timedelta(minutes=lead)
+
+def format_reminder(lesson: Dict, minutes: int = REMINDER_LEAD_MINUTES) -> str:
+    lesson_type_short = {
+        'лекция': 'лек',
+        'практика': 'пр',
+        'лабораторная': 'лаб'
+    }.get(lesson['type'], lesson['type'])
+    
+    return (
+        f"{emoji('reminder')} <b>Напоминание!</b>\n"
+        f"Через {minutes} мин, в {lesson['start']}, начинается:\n\n"
+        f"<b>{lesson['subject']} ({lesson_type_short})</b>\n"
+        f"Ауд. {lesson['audience']} • {lesson['teacher']}"
+    )
+
+async def schedule_reminders_for_user(user_id: int, faculty_id: str, group_id: str, target_date: date,
+                                      lessons: Optional[List[Dict]] = None, lead: Optional[int] = None):
+    """Планирование напоминаний на день; прежние напоминания пользователя на эту дату заменяются
 
-async def schedule_reminders_for_user(user_id: int, faculty_id: str, group_id: str, target_date: date):
-    """Планирование напоминаний на день"""
+    lead — за сколько минут до пары (None — REMINDER_LEAD_MINUTES, 0 — напоминания выключены).
+    """
     task_key = f"{user_id}_{target_date}"
-    if task_key in reminder_tasks:
-        reminder_tasks[task_key].cancel()
+    reminder_dispatcher.cancel(task_key)
+    lead = REMINDER_LEAD_MINUTES if lead is None else lead
+    if not lead:
+        return
     
-    lessons = await parse_daily_schedule(faculty_id, group_id, target_date, use_cache=True)
+    if lessons is None:
+        lessons = await parse_daily_schedule(faculty_id, group_id, target_date, use_cache=True)
     if not lessons:
         return
     
-    now = datetime.now(LOCAL_TIMEZONE)
-    
-    for lesson in lessons:
-        lesson_time = datetime.strptime(lesson['start'], '%H:%M').time()
-        lesson_datetime = datetime.combine(target_date, lesson_time)
-        lesson_datetime = LOCAL_TIMEZONE.localize(lesson_datetime)
-        reminder_time = lesson_datetime - timedelta(minutes=20)
-        
-        if reminder_time < now:
-            continue
-        
-        async def send_reminder(uid, lsn, rem_time):
-            wait_seconds = (rem_time - datetime.now(LOCAL_TIMEZONE)).total_seconds()
-            if wait_seconds > 0:
-                await asyncio.sleep(wait_seconds)
-                try:
-                    lesson_type_short = {
-                        'лекция': 'лек',
-                        'практика': 'пр',
-                        'лабораторная': 'лаб'
-                    }.get(lsn['type'], lsn['type'])
-                    
-                    msg = (
-                        f"{emoji('reminder')} <b>Напоминание!</b>\n"
-                        f"Через 20 минут, в {lsn['start']}, начинается:\n\n"
-                        f"<b>{lsn['subject']} ({lesson_type_short})</b>\n"
-                        f"Ауд. {lsn['audience']} • {lsn['teacher']}"
-                    )
-                    await bot.send_message(uid, msg, parse_mode="HTML")
-                except Exception as e:
-                    if "bot was blocked" in str(e).lower():
-                        await deactivate_user(uid)
-        
-        task = asyncio.create_task(send_reminder(user_id, lesson, reminder_time))
-        reminder_tasks[task_key] = task
+    deadlines = [get_reminder_time(lesson, target_date, lead) for lesson in lessons]
+    reminder_dispatcher.replace(
+        task_key, user_id, lessons,
+        [deadline.timestamp() for deadline in deadlines],
+        [(deadline + timedelta(minutes=lead)).timestamp() for deadline in deadlines],
+    )
+
+async def send_reminder(reminder: Reminder):
+    # Отправка может начаться раньше срока или опоздать: минуты до пары считаются в момент отправки
+    minutes = max(1, round((reminder.expires - datetime.now(LOCAL_TIMEZONE).timestamp()) / 60))
+    try:
+        await bot.send_message(reminder.user_id, format_reminder(reminder.lesson, minutes), parse_mode="HTML")
+    except Exception as e:
+        if "bot was blocked" in str(e).lower():
+            await deactivate_user(reminder.user_id)
+        else:
+            raise
+
+def format_reminder_stats(stats: Dict[str, Any]) -> str:
+    late = stats['late']
+    text = (
+        f"<b>Напоминания:</b>\n"
+        f"✅ {stats['sent']} • ⏰ с опозданием {late} • ⌛ после начала пары {stats['expired']} • "
+        f"❌ {stats['failed']}\n"
+        f"Повторов после 429: {stats['retries']}"
+    )
+    if late:
+        text += f"\nОпоздание: в среднем {stats['late_seconds'] / late:.1f} с, максимум {stats['max_late']:.1f} с"
+    return text
+
+reminder_dispatcher = ReminderDispatcher(
+    send_reminder, spread=REMINDER_SPREAD_SECONDS, rate=REMINDER_SEND_RATE, max_retries=REMINDER_MAX_RETRIES,
+    results=REMINDERS_DELIVERED, lateness=REMINDER_LATENESS_SECONDS,
+)
+REMINDERS_PENDING.set_function(lambda: len(reminder_dispatcher))
 
 # ==================== ОСНОВНАЯ ФУНКЦИЯ РАССЫЛКИ ====================
-async def send_daily_schedule():
-    """Отдельная функция для отправки расписания"""
+async def send_daily_schedule(send_minute: Optional[int] = None):
+    """Рассылка расписания на сегодня: пользователям минуты send_minute или, без неё, всем"""
+    started = perf_counter()
     try:
         now = datetime.now(LOCAL_TIMEZONE)
         schedule_date = now.date()
         weekday = now.weekday()
         weekday_names = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
         
+        if send_minute is None:
+            total, active = await get_user_activity_counts()
+        else:
+            total, active = await get_send_minute_counts(send_minute)
+            if not active:
+                # Большинство минут суток никем не выбрано
+                return
+        avoided = total - active
+        
         logger.info("="*60)
         logger.info(f"📅 ДАТА РАССЫЛКИ: {schedule_date}, день недели: {weekday_names[weekday]}")
+        if send_minute is not None:
+            logger.info(f"⏰ Пользователи времени {format_minute(send_minute)}")
+        logger.info(f"📨 НАЧИНАЮ РАССЫЛКУ {active} ПОЛЬЗОВАТЕЛЯМ (неактивных пропускаем: {avoided})")
         
-        users = await get_all_users()
-        logger.info(f"📨 НАЧИНАЮ РАССЫЛКУ {len(users)} ПОЛЬЗОВАТЕЛЯМ")
-        
-        if not users:
+        if not active:
             logger.info("📭 НЕТ ПОЛЬЗОВАТЕЛЕЙ ДЛЯ РАССЫЛКИ")
             logger.info("="*60)
             return
@@ -623,67 +1885,340 @@ async def send_daily_schedule():
         success = 0
         skip = 0
         fail = 0
+        blocked = 0
+        group_lessons: Dict[Tuple[str, str], List[Dict]] = {}
+        # Группы без пар сегодня пропускаются целиком, без запросов к сайту и пауз между сообщениями
+        empty_groups = await get_empty_groups(schedule_date)
+        known_empty = len(empty_groups)
+        failed_groups: Set[Tuple[str, str]] = set()
+        sent_records: List[Tuple[str, int, int, str]] = []
+        await purge_sent_messages(schedule_date)
         
-        for user_id, faculty_id, group_id in users:
+        # Сменивший время пользователь не получает сообщение второй раз за день
+        snapshot = iter_user_snapshot(send_minute=send_minute,
+                                      unsent_on=schedule_date if send_minute is not None else None)
+        async for user in snapshot:
+            user_id = user['user_id']
             try:
-                logger.info(f"👤 Обрабатываю пользователя {user_id}")
-                message = await generate_daily_message(user_id, schedule_date)
+                logger.debug("👤 Обрабатываю пользователя %d", user_id)
+                group_key = (user['faculty_id'], user['group_id'])
+                if group_key in empty_groups or group_key in failed_groups:
+                    skip += 1
+                    continue
+                if group_key not in group_lessons:
+                    status, group_lessons[group_key] = await get_daily_schedule(*group_key, schedule_date)
+                    if status == SCHEDULE_FAILED:
+                        failed_groups.add(group_key)
+                        logger.warning("⚠️ Расписание %s/%s не загрузилось, группа пропущена", *group_key)
+                        skip += 1
+                        continue
+                    if status != SCHEDULE_OK:
+                        empty_groups.add(group_key)
+                        skip += 1
+                        continue
+                lessons = group_lessons[group_key]
+                message = render_daily_message(user, lessons, schedule_date)
                 
                 if message:
-                    await bot.send_message(user_id, message, parse_mode="HTML")
-                    await schedule_reminders_for_user(user_id, faculty_id, group_id, schedule_date)
+                    sent = await bot.send_message(user_id, message, parse_mode="HTML")
+                    sent_records.append((schedule_date.isoformat(), user_id, sent.message_id, message_hash(message)))
+                    if len(sent_records) >= USER_SNAPSHOT_CHUNK_SIZE:
+                        await record_sent_messages(sent_records)
+                        sent_records = []
+                    await schedule_reminders_for_user(user_id, *group_key, schedule_date, lessons=lessons,
+                                                      lead=user['reminder_lead'])
                     success += 1
-                    logger.info(f"✅ Отправлено пользователю {user_id}")
+                    logger.debug("✅ Отправлено пользователю %d", user_id)
                 else:
                     skip += 1
-                    logger.info(f"⏭️ У пользователя {user_id} нет пар на сегодня")
+                    logger.debug("⏭️ У пользователя %d нет пар на сегодня", user_id)
                 
-                await asyncio.sleep(0.5)
+                await asyncio.sleep(DAILY_SEND_DELAY)
                 
             except Exception as e:
                 fail += 1
                 if "bot was blocked" in str(e).lower():
+                    blocked += 1
                     await deactivate_user(user_id)
-                    logger.info(f"🔇 Пользователь {user_id} заблокировал бота, деактивирован")
+                    logger.debug("🔇 Пользователь %d заблокировал бота", user_id)
                 else:
-                    logger.error(f"❌ Ошибка для пользователя {user_id}: {e}")
+                    logger.error("❌ Ошибка для пользователя %d: %s", user_id, e)
         
-        logger.info(f"📊 ИТОГО: ✅ {success} отправлено, ⏭️ {skip} пропущено, ❌ {fail} ошибок")
+        await record_sent_messages(sent_records)
+        logger.info(
+            "📊 ИТОГО за %.1f с: ✅ %d отправлено, ⏭️ %d пропущено, ❌ %d ошибок (🔇 заблокировали бота: %d), "
+            "групп: %d (без пар: %d, из них известно заранее: %d; не загрузилось: %d), "
+            "%d вызовов Telegram не понадобилось (неактивные)",
+            perf_counter() - started, success, skip, fail, blocked, len(group_lessons) + known_empty,
+            len(empty_groups), known_empty, len(failed_groups), avoided
+        )
         logger.info("="*60)
+        # Итог дня складывается из рассылок всех минут
+        if last_broadcast_stats.get('date') != schedule_date:
+            last_broadcast_stats.update(date=schedule_date, success=0, skip=0, fail=0, avoided=0)
+        for key, value in (('success', success), ('skip', skip), ('fail', fail), ('avoided', avoided)):
+            last_broadcast_stats[key] += value
         
     except Exception as e:
         logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА В send_daily_schedule: {e}")
         logger.exception(e)
+    finally:
+        BROADCAST_SECONDS.observe(perf_counter() - started, kind='daily')
+
+# ==================== ОТПРАВЛЕННЫЕ СООБЩЕНИЯ РАССЫЛКИ ====================
+def message_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+async def record_sent_messages(records: List[Tuple[str, int, int, str]]):
+    """Запоминает ежедневные сообщения (дата, user_id, message_id, хеш текста), чтобы потом их править"""
+    if not records:
+        return
+    now = datetime.now()
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.executemany('''
+            INSERT OR REPLACE INTO sent_messages (target_date, user_id, message_id, content_hash, sent_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(*record, now) for record in records])
+        await db.commit()
+
+async def purge_sent_messages(before: date):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute('DELETE FROM sent_messages WHERE target_date < ?', (before.isoformat(),))
+        await db.commit()
+
+async def edit_sent_daily_messages(faculty_id: str, group_id: str, target_date: date,
+                                   lessons: List[Dict]) -> Set[int]:
+    """Правка уже отправленных ежедневных сообщений группы; возвращает, у кого сообщение актуально
+
+    edit_message_text уходит только тем, у кого новый текст отличается от отправленного.
+    Кому править не удалось (сообщение удалено, слишком старое, ошибка сети), в результат
+    не попадают и получают обычное уведомление об изменениях.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute('''
+            SELECT s.user_id, s.message_id, s.content_hash, u.faculty_name, u.group_name
+            FROM sent_messages s JOIN users u ON u.user_id = s.user_id
+            WHERE s.target_date = ? AND u.faculty_id = ? AND u.group_id = ? AND u.is_active = 1
+        ''', (target_date.isoformat(), faculty_id, group_id))
+        recipients = [dict(row) for row in await cursor.fetchall()]
+    
+    edited: List[Tuple[str, int, int, str]] = []
+    current: Set[int] = set()
+    unchanged = failed = 0
+    for recipient in recipients:
+        text = render_daily_message(recipient, lessons, target_date) or (
+            f"{emoji('calendar')} <b>{format_day_title(target_date)} | {recipient['faculty_name']}, "
+            f"гр. {recipient['group_name']}</b>\n\nПар нет — все отменены"
+        )
+        content_hash = message_hash(text)
+        if content_hash == recipient['content_hash']:
+            unchanged += 1
+            current.add(recipient['user_id'])
+            continue
+        try:
+            await bot.edit_message_text(text, chat_id=recipient['user_id'], message_id=recipient['message_id'],
+                                        parse_mode="HTML")
+            edited.append((target_date.isoformat(), recipient['user_id'], recipient['message_id'], content_hash))
+            current.add(recipient['user_id'])
+        except Exception as e:
+            failed += 1
+            if "bot was blocked" in str(e).lower():
+                await deactivate_user(recipient['user_id'])
+            else:
+                logger.debug("⚠️ Не удалось изменить сообщение пользователя %d: %s", recipient['user_id'], e)
+        await asyncio.sleep(BROADCAST_SEND_DELAY)
+    
+    await record_sent_messages(edited)
+    logger.info("✏️ Сообщения рассылки %s/%s на %s: изменено %d, текст не изменился %d, ошибок %d",
+                faculty_id, group_id, target_date, len(edited), unchanged, failed)
+    return current
+
+# ==================== ОТСЛЕЖИВАНИЕ ИЗМЕНЕНИЙ РАСПИСАНИЯ ====================
+def diff_lessons(old: List[Dict], new: List[Dict]) -> List[Dict]:
+    """Изменения по номерам пар: added, removed, changed"""
+    before = {lesson['number']: lesson for lesson in old}
+    after = {lesson['number']: lesson for lesson in new}
+    delta = []
+    for number in sorted(before.keys() | after.keys()):
+        old_lesson, new_lesson = before.get(number), after.get(number)
+        if old_lesson == new_lesson:
+            continue
+        kind = 'added' if old_lesson is None else 'removed' if new_lesson is None else 'changed'
+        delta.append({'kind': kind, 'number': number, 'before': old_lesson, 'after': new_lesson})
+    return delta
+
+def format_schedule_changes(target_date: date, delta: List[Dict]) -> str:
+    lines = [f"🔄 <b>Изменения в расписании: {format_day_title(target_date)}</b>", ""]
+    for change in delta:
+        lesson = change['after'] or change['before']
+        title = f"<b>{change['number']}-я пара</b> <code>{lesson['start']} – {lesson['end']}</code>"
+        if change['kind'] == 'removed':
+            lines.append(f"➖ {title}: {lesson['subject']} — отменена")
+            continue
+        lines.append(f"{'➕' if change['kind'] == 'added' else '✏️'} {title}: <b>{lesson['subject']}</b>")
+        if change['kind'] == 'changed':
+            for field, label in (('audience', 'Ауд.'), ('teacher', 'Преподаватель:'), ('start', 'Начало:'),
+                                 ('type', 'Тип:')):
+                if change['before'][field] != lesson[field]:
+                    lines.append(f"   {label} <s>{change['before'][field]}</s> → {lesson[field]}")
+        else:
+            lines.append(f"   Ауд. {lesson['audience']} • {lesson['teacher']}")
+    return "\n".join(lines)
+
+async def save_schedule_change(faculty_id: str, group_id: str, target_date: date, delta: List[Dict]):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute('''
+            INSERT INTO schedule_changes (faculty_id, group_id, target_date, delta, detected_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (faculty_id, group_id, target_date.isoformat(), json.dumps(delta, ensure_ascii=False), datetime.now()))
+        await db.commit()
+
+async def notify_schedule_change(faculty_id: str, group_id: str, target_date: date, delta: List[Dict],
+                                 skip: Set[int] = frozenset()) -> int:
+    """Сообщение об изменениях только активным пользователям этой группы (кроме skip)"""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('''
+            SELECT user_id FROM users WHERE is_active = 1 AND faculty_id = ? AND group_id = ?
+        ''', (faculty_id, group_id))
+        user_ids = [row[0] for row in await cursor.fetchall()]
+    
+    text = format_schedule_changes(target_date, delta)
+    sent = 0
+    for user_id in user_ids:
+        if user_id in skip:
+            continue
+        try:
+            await bot.send_message(user_id, text, parse_mode="HTML")
+            sent += 1
+        except Exception as e:
+            if "bot was blocked" in str(e).lower():
+                await deactivate_user(user_id)
+            else:
+                logger.error("❌ Ошибка уведомления %d: %s", user_id, e)
+        await asyncio.sleep(BROADCAST_SEND_DELAY)
+    return sent
+
+async def refresh_group_week(faculty_id: str, group_id: str, dates: List[date]) -> int:
+    """Перепроверка недели группы одним запросом; возвращает число дней с изменениями
+
+    Неизменившийся день стоит только сравнения хешей: ни записи в БД, ни сообщений.
+    День, пропавший со страницы (техработы, неделю временно сняли с публикации), не
+    затирает уже загруженные пары: запись остаётся, проверка считается неудачной.
+    """
+    rows = await fetch_week_table(week_url(faculty_id, group_id, dates[0]))
+    if rows is None:
+        SCHEDULE_REFRESH_CHECKS.inc(result='failed')
+        return 0
+    
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('''
+            SELECT target_date, status, schedule_data, content_hash FROM schedule_cache
+            WHERE group_id = ? AND faculty_id = ? AND target_date BETWEEN ? AND ?
+        ''', (group_id, faculty_id, dates[0].isoformat(), dates[-1].isoformat()))
+        cached = {row[0]: row[1:] for row in await cursor.fetchall()}
+    
+    changed = 0
+    missing = []
+    for target_date in dates:
+        status, lessons = extract_day_lessons(rows, target_date)
+        old = cached.get(target_date.isoformat())
+        if old is not None:
+            old_status, old_data, old_hash = old
+            if status == SCHEDULE_NO_DAY and old_status != SCHEDULE_NO_DAY:
+                SCHEDULE_REFRESH_CHECKS.inc(result='failed')
+                missing.append(target_date)
+                continue
+            if (old_hash or schedule_hash(old_status, json.loads(old_data))) == schedule_hash(status, lessons):
+                SCHEDULE_REFRESH_CHECKS.inc(result='unchanged')
+                continue
+        
+        await save_schedule_to_cache(faculty_id, group_id, target_date, lessons, status)
+        # Без прежней версии или с неопубликованной раньше неделей сравнивать не с чем
+        if old is None or SCHEDULE_NO_DAY in (old_status, status):
+            SCHEDULE_REFRESH_CHECKS.inc(result='stored')
+            continue
+        delta = diff_lessons(json.loads(old_data), lessons)
+        if not delta:
+            SCHEDULE_REFRESH_CHECKS.inc(result='stored')
+            continue
+        
+        SCHEDULE_REFRESH_CHECKS.inc(result='changed')
+        changed += 1
+        await save_schedule_change(faculty_id, group_id, target_date, delta)
+        # Получившим утреннюю рассылку правим её вместо нового сообщения
+        edited = await edit_sent_daily_messages(faculty_id, group_id, target_date, lessons)
+        notified = await notify_schedule_change(faculty_id, group_id, target_date, delta, skip=edited)
+        logger.info("🔄 Расписание %s/%s на %s изменилось (пар: %d), уведомлено: %d",
+                    faculty_id, group_id, target_date, len(delta), notified)
+    if missing:
+        logger.warning("⚠️ На странице недели %s/%s нет дней %s, сохранённое расписание оставлено",
+                       faculty_id, group_id, ", ".join(day.strftime('%d.%m') for day in missing))
+    return changed
+
+async def get_active_group_weeks() -> List[Tuple[str, str, List[date]]]:
+    """Недели активных групп, покрывающие ближайшие SCHEDULE_REFRESH_DAYS дней"""
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    weeks: Dict[Tuple[int, int], List[date]] = {}
+    for offset in range(SCHEDULE_REFRESH_DAYS):
+        day = today + timedelta(days=offset)
+        weeks.setdefault(day.isocalendar()[:2], []).append(day)
+    
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute('SELECT DISTINCT faculty_id, group_id FROM users WHERE is_active = 1')
+        groups = await cursor.fetchall()
+    return [(faculty_id, group_id, days) for faculty_id, group_id in groups for days in weeks.values()]
+
+async def schedule_change_watcher():
+    """Фоновая перепроверка расписаний: недели активных групп по кругу, не больше бюджета за проход"""
+    pending: Deque[Tuple[str, str, List[date]]] = deque()
+    logger.info("🔎 Отслеживание изменений: каждые %d с, до %d недель групп за проход",
+                SCHEDULE_REFRESH_INTERVAL, SCHEDULE_REFRESH_BUDGET)
+    while True:
+        await asyncio.sleep(SCHEDULE_REFRESH_INTERVAL)
+        try:
+            if not pending:
+                pending.extend(await get_active_group_weeks())
+            checked = changed = 0
+            while pending and checked < SCHEDULE_REFRESH_BUDGET:
+                changed += await refresh_group_week(*pending.popleft())
+                checked += 1
+            logger.debug("🔎 Проверено недель групп: %d, изменилось дней: %d, осталось в круге: %d",
+                         checked, changed, len(pending))
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки изменений расписания: {e}")
 
 # ==================== ФОНОВАЯ ЗАДАЧА РАССЫЛКИ ====================
 async def daily_schedule_sender():
-    """Ежедневная рассылка расписания в заданное время"""
-    global schedule_hour, schedule_minute
+    """Ежедневная рассылка по минутам: каждую минуту — только пользователи, чьё время наступило
+
+    Рассылка минуты идёт отдельной задачей, чтобы долгая рассылка в 6:00 не задерживала
+    тех, кто выбрал 6:30. Минуты, пропущенные из-за остановки цикла событий, догоняются.
+    """
     logger.info("🔥🔥🔥 ФОНОВАЯ ЗАДАЧА РАССЫЛКИ ЗАПУЩЕНА 🔥🔥🔥")
     
-    last_run_date = None
+    last_run: Optional[Tuple[date, int]] = None
     
     while True:
         try:
             now = datetime.now(LOCAL_TIMEZONE)
+            today = now.date()
+            current = now.hour * 60 + now.minute
             
-            # Проверяем, совпали ли часы и минуты
-            is_time_to_send = (now.hour == schedule_hour and now.minute == schedule_minute)
-            
-            if is_time_to_send:
-                # Проверяем, делали ли мы уже рассылку сегодня
-                if last_run_date != now.date():
-                    logger.info("="*60)
-                    logger.info(f"⏰⏰⏰ ПРОСНУЛСЯ! НАЧИНАЮ РАССЫЛКУ В {schedule_hour:02d}:{schedule_minute:02d}! ⏰⏰⏰")
-                    logger.info("="*60)
-                    
-                    await send_daily_schedule()
-                    
-                    last_run_date = now.date()
-                    logger.info("="*60)
+            if last_run is None or last_run[0] != today:
+                due = [current]
+            else:
+                due = list(range(last_run[1] + 1, current + 1))
+            for minute in due:
+                if minute == default_send_minute():
+                    logger.info(f"⏰⏰⏰ ОБЩЕЕ ВРЕМЯ РАССЫЛКИ {format_minute(minute)} ⏰⏰⏰")
+                task = asyncio.create_task(run_daily_minute(minute))
+                daily_runs.add(task)
+                task.add_done_callback(daily_runs.discard)
+            last_run = (today, current)
             
-            # Спим 30 секунд
-            await asyncio.sleep(30)
+            # До начала следующей минуты
+            await asyncio.sleep(60.5 - now.second - now.microsecond / 1_000_000)
                 
         except asyncio.CancelledError:
             logger.error("❌ ЗАДАЧА РАССЫЛКИ БЫЛА ОТМЕНЕНА!")
@@ -694,7 +2229,204 @@ async def daily_schedule_sender():
             logger.info("🔄 Перезапуск задачи через 60 секунд...")
             await asyncio.sleep(60)
 
+async def run_daily_minute(send_minute: int):
+    try:
+        await start_daily_schedule(send_minute)
+    except Exception as e:
+        logger.error(f"❌ Ошибка рассылки {format_minute(send_minute)}: {e}")
+        logger.exception(e)
+
+# ==================== ОЧЕРЕДЬ ЗАДАЧ (РАЗДЕЛЬНЫЙ РЕЖИМ) ====================
+async def start_daily_schedule(send_minute: Optional[int] = None):
+    """Ежедневная рассылка: сразу в этом процессе или через очередь воркеров"""
+    if RUN_MODE == 'split':
+        await enqueue_daily_schedule(send_minute)
+    else:
+        await send_daily_schedule(send_minute)
+
+async def enqueue_daily_schedule(send_minute: Optional[int] = None):
+    """Обновление расписаний групп и пакеты пользователей для воркеров"""
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    schedule_date = today.isoformat()
+    empty_groups = await get_empty_groups(today)
+    groups: Set[Tuple[str, str]] = set()
+    jobs = []
+    batch: List[Dict[str, Any]] = []
+    skipped = 0
+    # Минута в ключе: пакет пользователя, перенёсшего время, не совпадёт с его утренним пакетом
+    bucket = 'all' if send_minute is None else send_minute
+    snapshot = iter_user_snapshot(send_minute=send_minute, unsent_on=today if send_minute is not None else None)
+    
+    async for user in snapshot:
+        group_key = (user['faculty_id'], user['group_id'])
+        if group_key in empty_groups:
+            skipped += 1
+            continue
+        groups.add(group_key)
+        batch.append(user)
+        if len(batch) >= JOB_BATCH_SIZE:
+            jobs.append(('daily_batch', {'date': schedule_date, 'users': batch}, None,
+                         f"daily:{schedule_date}:{bucket}:{batch[0]['user_id']}"))
+            batch = []
+    if batch:
+        jobs.append(('daily_batch', {'date': schedule_date, 'users': batch}, None,
+                     f"daily:{schedule_date}:{bucket}:{batch[0]['user_id']}"))
+    if not groups and not skipped:
+        return
+    
+    refresh = [('refresh_schedule', {'faculty_id': f, 'group_id': g, 'date': schedule_date}, None,
+                f"refresh:{f}:{g}:{schedule_date}") for f, g in sorted(groups)]
+    queued = await job_queue.enqueue_many(refresh + jobs)
+    logger.info("📥 В очередь: %d задач (групп: %d, пакетов рассылки: %d); без пар сегодня: групп %d, пользователей %d",
+                queued, len(refresh), len(jobs), len(empty_groups), skipped)
+
+async def enqueue_broadcast(users: List[Tuple[int, str, str]], broadcast_text: str,
+                            media_file_id: Optional[str] = None, media_type: Optional[str] = None) -> int:
+    """Рассылка из бета-панели пакетами для воркеров; возвращает число пакетов"""
+    broadcast_id = uuid.uuid4().hex[:12]
+    user_ids = [user_id for user_id, _, _ in users]
+    jobs = [
+        ('broadcast_batch', {'broadcast_id': broadcast_id, 'user_ids': user_ids[i:i + JOB_BATCH_SIZE],
+                             'text': broadcast_text, 'media_file_id': media_file_id, 'media_type': media_type},
+         None, f"broadcast:{broadcast_id}:{i}")
+        for i in range(0, len(user_ids), JOB_BATCH_SIZE)
+    ]
+    await job_queue.enqueue_many(jobs)
+    return len(jobs)
+
+async def job_refresh_schedule(payload: Dict[str, Any]):
+    await parse_daily_schedule(payload['faculty_id'], payload['group_id'],
+                               date.fromisoformat(payload['date']), use_cache=True)
+
+async def deliver_once(key: str, user_id: int, send: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+    """Отправка не более одного раза по отметке в job_deliveries
+
+    Отметка ставится до отправки, чтобы два воркера не отправили одно сообщение, и
+    снимается, если отправка не удалась: повтор задачи отправит его снова. На retry_after
+    воркер ждёт и повторяет отправку. None — сообщение уже отправлялось или пользователь
+    заблокировал бота; исключение — сообщение не отправлено.
+    """
+    if not await job_queue.mark_delivered(key):
+        return None
+    for attempt in range(JOB_SEND_RETRIES + 1):
+        try:
+            return await send()
+        except TelegramRetryAfter as e:
+            if attempt == JOB_SEND_RETRIES:
+                await job_queue.unmark_delivered(key)
+                raise
+            logger.warning("⏳ Telegram просит подождать %d с (%s)", e.retry_after, key)
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            if "bot was blocked" in str(e).lower():
+                await deactivate_user(user_id)
+                return None
+            await job_queue.unmark_delivered(key)
+            raise
+
+async def job_daily_batch(payload: Dict[str, Any]):
+    schedule_date = date.fromisoformat(payload['date'])
+    group_lessons: Dict[Tuple[str, str], List[Dict]] = {}
+    sent_records: List[Tuple[str, int, int, str]] = []
+    failed = 0
+    
+    try:
+        for user in payload['users']:
+            user_id = user['user_id']
+            group_key = (user['faculty_id'], user['group_id'])
+            if group_key not in group_lessons:
+                status, group_lessons[group_key] = await get_daily_schedule(*group_key, schedule_date)
+                if status == SCHEDULE_FAILED:
+                    # Повтор пакета попробует загрузить расписание снова
+                    raise RuntimeError(f"Расписание {group_key[0]}/{group_key[1]} не загрузилось")
+            lessons = group_lessons[group_key]
+            if not lessons:
+                continue
+            message = render_daily_message(user, lessons, schedule_date)
+            if not message:
+                continue
+            try:
+                sent = await deliver_once(f"daily:{payload['date']}:{user_id}", user_id,
+                                          lambda: bot.send_message(user_id, message, parse_mode="HTML"))
+            except Exception as e:
+                failed += 1
+                logger.error("❌ Ошибка для пользователя %d: %s", user_id, e)
+                continue
+            if sent is None:
+                continue
+            sent_records.append((payload['date'], user_id, sent.message_id, message_hash(message)))
+            lead = REMINDER_LEAD_MINUTES if user.get('reminder_lead') is None else user['reminder_lead']
+            await job_queue.enqueue_many(
+                ('reminder', {'user_id': user_id, 'date': payload['date'], 'lesson': lesson, 'lead': lead},
+                 get_reminder_time(lesson, schedule_date, lead).timestamp() - REMINDER_SPREAD_SECONDS,
+                 f"reminder:{user_id}:{payload['date']}:{lesson['number']}")
+                for lesson in lessons if lead
+            )
+            await asyncio.sleep(DAILY_SEND_DELAY)
+    finally:
+        # Строки пишутся и при ошибке пакета: повтор пропустит уже получивших по отметкам,
+        # и без строк их утреннее сообщение не правилось бы и отправилось бы снова в другую минуту
+        await record_sent_messages(sent_records)
+    logger.debug("📨 Пакет рассылки: %d из %d отправлено", len(sent_records), len(payload['users']))
+    if failed:
+        # Повтор пакета пропустит получивших сообщение по отметкам о доставке
+        raise RuntimeError(f"Не отправлено {failed} сообщений пакета")
+
+async def job_reminder(payload: Dict[str, Any]):
+    lesson = payload['lesson']
+    user_id = payload['user_id']
+    lead = payload.get('lead', REMINDER_LEAD_MINUTES)
+    deadline = get_reminder_time(lesson, date.fromisoformat(payload['date']), lead)
+    lesson_start = deadline + timedelta(minutes=lead)
+    if datetime.now(LOCAL_TIMEZONE) >= lesson_start:
+        # Воркеры были недоступны до начала пары — напоминание уже бесполезно
+        return
+    key = f"reminder:{user_id}:{payload['date']}:{lesson['number']}"
+    if not await job_queue.mark_delivered(key):
+        return
+    # Задачи захватываются по run_at, то есть по сроку; повтор после 429 — внутри deliver
+    reminder = Reminder(deadline.timestamp(), 0, f"{user_id}_{payload['date']}", user_id, lesson,
+                        lesson_start.timestamp())
+    if await reminder_dispatcher.deliver(reminder) == 'failed':
+        # Без отметки повтор задачи очередью отправит напоминание, если пара ещё не началась
+        await job_queue.unmark_delivered(key)
+        raise RuntimeError(f"Напоминание пользователю {user_id} не отправлено")
+
+async def job_broadcast_batch(payload: Dict[str, Any]):
+    failed = 0
+    for user_id in payload['user_ids']:
+        try:
+            await deliver_once(
+                f"broadcast:{payload['broadcast_id']}:{user_id}", user_id,
+                lambda: send_broadcast_message(user_id, payload['text'], payload['media_file_id'],
+                                               payload['media_type']))
+        except Exception as e:
+            failed += 1
+            logger.error("Ошибка отправки пользователю %d: %s", user_id, e)
+        await asyncio.sleep(BROADCAST_SEND_DELAY)
+    if failed:
+        raise RuntimeError(f"Не отправлено {failed} сообщений пакета")
+
+JOB_HANDLERS = {
+    'refresh_schedule': job_refresh_schedule,
+    'daily_batch': job_daily_batch,
+    'reminder': job_reminder,
+    'broadcast_batch': job_broadcast_batch,
+}
+
 # ==================== ДИАГНОСТИЧЕСКИЕ КОМАНДЫ ====================
+def run_admin_task(name: str, coro: Awaitable[None]):
+    """Запуск долгой команды администратора фоновой задачей; обработчик сразу освобождается"""
+    async def run():
+        try:
+            await coro
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновой команды {name}: {e}")
+            logger.exception(e)
+    task = asyncio.create_task(run())
+    admin_tasks.add(task)
+    task.add_done_callback(admin_tasks.discard)
+
 @dp.message(Command("debug_time"))
 async def cmd_debug_time(message: types.Message):
     """Показать текущее время бота и настройки рассылки"""
@@ -702,7 +2434,7 @@ async def cmd_debug_time(message: types.Message):
         return
     
     now = datetime.now(LOCAL_TIMEZONE)
-    users = await get_all_users()
+    total, active = await get_user_activity_counts()
     
     text = (
         f"{emoji('time')} <b>Диагностика времени:</b>\n\n"
@@ -713,7 +2445,8 @@ async def cmd_debug_time(message: types.Message):
         f"Время: {schedule_hour:02d}:{schedule_minute:02d}\n"
         f"Сегодня {'выходной' if now.weekday() >= 5 else 'будний'}\n\n"
         f"👥 <b>Пользователи:</b>\n"
-        f"Всего: {len(users)}"
+        f"Всего: {total}\n"
+        f"Активных: {active}"
     )
     
     await message.answer(text, parse_mode="HTML")
@@ -743,12 +2476,15 @@ async def cmd_force_send(message: types.Message):
         parse_mode="HTML"
     )
     
-    await send_daily_schedule()
+    async def force_send():
+        await start_daily_schedule(default_send_minute())
+        done = "Рассылка поставлена в очередь воркеров!" if RUN_MODE == 'split' else "Рассылка завершена!"
+        await message.answer(
+            f"{emoji('success')} {done}",
+            parse_mode="HTML"
+        )
     
-    await message.answer(
-        f"{emoji('success')} Рассылка завершена!",
-        parse_mode="HTML"
-    )
+    run_admin_task('force_send', force_send())
 
 @dp.message(Command("check_user"))
 async def cmd_check_user(message: types.Message):
@@ -794,84 +2530,164 @@ async def cmd_check_user(message: types.Message):
     except Exception as e:
         await message.answer(f"{emoji('error')} Ошибка: {escape_html(str(e))}", parse_mode="HTML")
 
+USERS_PAGE_TITLES = {
+    'all': "ВСЕ пользователи в БД",
+    'check': "Статус пользователей",
+    'beta': "Последние пользователи",
+}
+
+def format_user_row(view: str, u: Dict[str, Any]) -> str:
+    beta = "🔬" if u['is_beta_tester'] else "👤"
+    names = f"   {escape_html(u['faculty_name'])} — {escape_html(u['group_name'])}\n"
+    if view == 'check':
+        status = "✅ АКТИВЕН" if u['is_active'] else "❌ НЕАКТИВЕН"
+        return f"{beta} ID: {u['user_id']} — {status}\n{names}"
+    status = "✅" if u['is_active'] else "❌"
+    if view == 'beta':
+        user_link = f"<a href='tg://user?id={u['user_id']}'>{u['user_id']}</a>"
+        return f"{beta} {user_link} {status}\n{names}"
+    return f"{beta} {status} ID: {u['user_id']}\n{names}"
+
+async def render_users_page(view: str, key: Optional[Tuple[str, int]] = None,
+                            newer: bool = False) -> Tuple[str, types.InlineKeyboardMarkup]:
+    """Страница админ-списка пользователей с кнопками перехода"""
+    users, has_more = await get_users_page(key, newer)
+    
+    lines = [f"{emoji('list')} <b>{USERS_PAGE_TITLES[view]}:</b>\n"]
+    lines.extend(format_user_row(view, u) for u in users)
+    if not users:
+        lines.append("Пользователей нет")
+    
+    # Новее — есть, если мы пришли со старших страниц или их нашёл запрос
+    has_newer = has_more if newer else key is not None
+    has_older = has_more if not newer else key is not None
+    
+    buttons = []
+    if users and has_newer:
+        first = users[0]
+        buttons.append(types.InlineKeyboardButton(
+            text="◀️ Новее", callback_data=f"users_page:{view}:newer:{first['registered_at']}|{first['user_id']}"))
+    if users and has_older:
+        last = users[-1]
+        buttons.append(types.InlineKeyboardButton(
+            text="Старше ▶️", callback_data=f"users_page:{view}:older:{last['registered_at']}|{last['user_id']}"))
+    
+    rows = [buttons] if buttons else []
+    rows.append([types.InlineKeyboardButton(text="📊 Сводка по группам", callback_data="users_summary")])
+    return "\n".join(lines), types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def render_users_summary() -> str:
+    """Сводка по факультетам и группам, обрезанная по лимиту сообщения Telegram"""
+    summary = await get_users_summary()
+    total = sum(row[2] for row in summary)
+    active = sum(row[3] for row in summary)
+    
+    lines = [
+        f"{emoji('stats')} <b>Сводка по группам</b>\n",
+        f"Всего: {total} (✅ {active} / ❌ {total - active})",
+    ]
+    faculty_totals: Dict[str, List[int]] = {}
+    for faculty_name, _, count, active_count in summary:
+        totals = faculty_totals.setdefault(faculty_name, [0, 0])
+        totals[0] += count
+        totals[1] += active_count
+    
+    length = sum(len(line) + 1 for line in lines)
+    current_faculty = None
+    for i, (faculty_name, group_name, count, active_count) in enumerate(summary):
+        block = []
+        if faculty_name != current_faculty:
+            current_faculty = faculty_name
+            faculty_total, faculty_active = faculty_totals[faculty_name]
+            block.append(f"\n{emoji('faculty')} <b>{escape_html(faculty_name)}</b>: {faculty_total} (✅ {faculty_active})")
+        block.append(f"   гр. {escape_html(group_name)}: {count} (✅ {active_count} / ❌ {count - active_count})")
+        
+        block_length = sum(len(line) + 1 for line in block)
+        if length + block_length > TELEGRAM_MESSAGE_LIMIT - 100:
+            lines.append(f"\n…и ещё {len(summary) - i} групп")
+            break
+        lines.extend(block)
+        length += block_length
+    
+    return "\n".join(lines)
+
 @dp.message(Command("db_all"))
 async def cmd_db_all(message: types.Message):
-    """Показать ВСЕХ пользователей из БД"""
+    """Показать ВСЕХ пользователей из БД (постранично)"""
     if message.from_user.id != BETA_TESTER_ID:
         return
     
-    async with aiosqlite.connect('users.db') as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute('''
-            SELECT user_id, faculty_name, group_name, is_active, is_beta_tester 
-            FROM users ORDER BY registered_at DESC
-        ''')
-        users = await cursor.fetchall()
-    
-    text = f"{emoji('list')} <b>ВСЕ пользователи в БД:</b>\n\n"
-    
-    for u in users:
-        status = "✅" if u['is_active'] else "❌"
-        beta = "🔬" if u['is_beta_tester'] else "👤"
-        text += f"{beta} {status} ID: {u['user_id']}\n"
-        text += f"   {u['faculty_name']} — {u['group_name']}\n\n"
-    
-    await message.answer(text, parse_mode="HTML")
+    text, keyboard = await render_users_page('all')
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 @dp.message(Command("db_check"))
 async def cmd_db_check(message: types.Message):
-    """Проверка статуса всех пользователей"""
+    """Проверка статуса всех пользователей (постранично)"""
     if message.from_user.id != BETA_TESTER_ID:
         return
     
-    async with aiosqlite.connect('users.db') as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute('''
-            SELECT user_id, faculty_name, group_name, is_active, is_beta_tester 
-            FROM users
-        ''')
-        users = await cursor.fetchall()
+    text, keyboard = await render_users_page('check')
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+@dp.message(Command("db_summary"))
+async def cmd_db_summary(message: types.Message):
+    """Сводка пользователей по факультетам и группам"""
+    if message.from_user.id != BETA_TESTER_ID:
+        return
     
-    text = f"{emoji('list')} <b>Статус пользователей:</b>\n\n"
+    await message.answer(await render_users_summary(), parse_mode="HTML")
+
+@dp.callback_query(lambda c: c.data.startswith("users_page:"))
+async def users_page(callback: types.CallbackQuery):
+    """Переход по страницам админ-списка"""
+    if callback.from_user.id != BETA_TESTER_ID:
+        await callback.answer(f"{emoji('error')} Недостаточно прав", parse_mode="HTML")
+        return
     
-    for u in users:
-        status = "✅ АКТИВЕН" if u['is_active'] else "❌ НЕАКТИВЕН"
-        beta = "🔬" if u['is_beta_tester'] else "👤"
-        text += f"{beta} ID: {u['user_id']} — {status}\n"
-        text += f"   {u['faculty_name']} — {u['group_name']}\n\n"
+    await callback.answer()
     
-    await message.answer(text, parse_mode="HTML")
+    _, view, direction, key = callback.data.split(':', 3)
+    registered_at, user_id = key.rsplit('|', 1)
+    text, keyboard = await render_users_page(view, (registered_at, int(user_id)), newer=direction == 'newer')
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+@dp.callback_query(lambda c: c.data == "users_summary")
+async def users_summary(callback: types.CallbackQuery):
+    if callback.from_user.id != BETA_TESTER_ID:
+        await callback.answer(f"{emoji('error')} Недостаточно прав", parse_mode="HTML")
+        return
+    
+    await callback.answer()
+    await callback.message.answer(await render_users_summary(), parse_mode="HTML")
 
 # ==================== БЕТА-ФУНКЦИИ ====================
 async def send_test_broadcast(user_id: int = None):
-    if user_id:
-        users = [(user_id, "", "")]
-    else:
-        users = await get_all_users()
-    
+    started = perf_counter()
     schedule_date = datetime.now(LOCAL_TIMEZONE).date()
     success_count = 0
     fail_count = 0
+    group_lessons: Dict[Tuple[str, str], List[Dict]] = {}
     
-    for uid, _, _ in users:
+    async for user in iter_user_snapshot(user_id):
+        uid = user['user_id']
         try:
-            message = await generate_daily_message(uid, schedule_date)
+            group_key = (user['faculty_id'], user['group_id'])
+            if group_key not in group_lessons:
+                group_lessons[group_key] = await parse_daily_schedule(*group_key, schedule_date, use_cache=True)
+            lessons = group_lessons[group_key]
+            message = render_daily_message(user, lessons, schedule_date)
             if message:
-                settings = await get_user_settings(uid)
                 await bot.send_message(uid, message, parse_mode="HTML")
-                
-                if settings:
-                    await schedule_reminders_for_user(
-                        uid, settings['faculty_id'], settings['group_id'], schedule_date
-                    )
-                
+                await schedule_reminders_for_user(uid, *group_key, schedule_date, lessons=lessons,
+                                                  lead=user['reminder_lead'])
                 success_count += 1
-            await asyncio.sleep(0.5)
+            await asyncio.sleep(DAILY_SEND_DELAY)
         except Exception as e:
             fail_count += 1
             if "bot was blocked" in str(e).lower():
                 await deactivate_user(uid)
     
+    BROADCAST_SECONDS.observe(perf_counter() - started, kind='test')
     return success_count, fail_count
 
 async def send_all_messages(user_id: int):
@@ -886,14 +2702,14 @@ async def send_all_messages(user_id: int):
         "❌ Группа '430' не найдена.\n\nПримеры групп:\n520, 520М, 522, 523, 524, 525",
         "ℹ️ Ввод группы отменен.\nИспользуй /start для регистрации.",
         "📚 Все доступные команды:\n\n/start — начать регистрацию\n/help — это сообщение",
-        "📚 Все доступные команды:\n\n/start — главное меню\n/group — сменить группу\n/today — расписание на сегодня\n/tomorrow — расписание на завтра\n/settings — настройки\n/reset — сбросить настройки\n/help — это сообщение",
+        "📚 Все доступные команды:\n\n/start — главное меню\n/group — сменить группу\n/today — расписание на сегодня\n/tomorrow — расписание на завтра\n/week — расписание на неделю (/week next — на следующую)\n/teacher Фамилия — где сейчас преподаватель\n/rooms С 3 — свободные аудитории корпуса на пару\n/notify — время рассылки и напоминаний\n/settings — настройки\n/reset — сбросить настройки\n/help — это сообщение",
         "⚙️ Твои настройки\n\n🎓 Факультет: ФВТ\n👥 Группа: 430\n\n/group — сменить группу\n/reset — сбросить настройки",
         "✅ Настройки сброшены.\nИспользуй /start для новой регистрации.",
         "❌ Сначала нужно зарегистрироваться!\nНапиши /start чтобы начать.",
         "❌ Неизвестная команда.\nИспользуй /help для списка команд",
         "📅 Пятница, 20 февраля | ФВТ, гр. 430\n\n1-я пара: 08:10 – 09:45 — Метрология (лек)\nАуд. 302 C • доц. Кряков В.Г.\n\n2-я пара: 09:55 – 11:30 — Схемотехника ЭС (лек)\nАуд. 333 C • доц. Копейкин Ю.А.",
         "📅 На сегодня пар нет",
-        "⏰ Напоминание!\nЧерез 20 минут, в 11:40, начинается:\n\nЭлектротехника и электроника (лек)\nАуд. 404 C • доц. Копейкин Ю.А."
+        "⏰ Напоминание!\nЧерез 20 мин, в 11:40, начинается:\n\nЭлектротехника и электроника (лек)\nАуд. 404 C • доц. Копейкин Ю.А."
     ]
     
     for i, msg in enumerate(messages, 1):
@@ -902,6 +2718,67 @@ async def send_all_messages(user_id: int):
     
     await bot.send_message(user_id, "✅ Все 16 сообщений отправлены! Проверь, как они выглядят.")
 
+# ==================== ВРЕМЯ РАССЫЛКИ И НАПОМИНАНИЙ ====================
+def default_send_minute() -> int:
+    return schedule_hour * 60 + schedule_minute
+
+def format_minute(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+def user_send_minute(settings: Dict[str, Any]) -> int:
+    return default_send_minute() if settings['send_minute'] is None else settings['send_minute']
+
+def user_reminder_lead(settings: Dict[str, Any]) -> int:
+    return REMINDER_LEAD_MINUTES if settings['reminder_lead'] is None else settings['reminder_lead']
+
+def format_lead(lead: int) -> str:
+    return f"за {lead} мин до пары" if lead else "выключены"
+
+def notify_text(settings: Dict[str, Any]) -> str:
+    own = "своё время" if settings['send_minute'] is not None else "общее время"
+    return (
+        f"{emoji('time')} <b>Рассылка и напоминания</b>\n\n"
+        f"{emoji('calendar')} Расписание на день: в {format_minute(user_send_minute(settings))} ({own})\n"
+        f"{emoji('reminder')} Напоминания: {format_lead(user_reminder_lead(settings))}\n\n"
+        f"Выбери кнопкой или напиши своё время: <code>/notify 07:15</code>"
+    )
+
+def notify_keyboard(settings: Dict[str, Any]) -> types.InlineKeyboardMarkup:
+    send_minute = settings['send_minute']
+    lead = user_reminder_lead(settings)
+    
+    def mark(text: str, selected: bool) -> str:
+        return f"✓ {text}" if selected else text
+    
+    times = [
+        types.InlineKeyboardButton(text=mark(format_minute(minute), minute == send_minute),
+                                   callback_data=f"notify:time:{minute}")
+        for minute in NOTIFY_TIME_PRESETS
+    ]
+    leads = [
+        types.InlineKeyboardButton(text=mark(f"{choice} мин" if choice else "Без напоминаний", choice == lead),
+                                   callback_data=f"notify:lead:{choice}")
+        for choice in REMINDER_LEAD_CHOICES
+    ]
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        times,
+        [types.InlineKeyboardButton(text=mark(f"Как у всех ({format_minute(default_send_minute())})",
+                                              send_minute is None),
+                                    callback_data="notify:time:default")],
+        leads[:3],
+        leads[3:],
+    ])
+
+async def apply_send_minute(user_id: int, send_minute: Optional[int]) -> str:
+    """Сохранение времени рассылки; возвращает подтверждение для пользователя"""
+    await set_user_send_minute(user_id, send_minute)
+    effective = default_send_minute() if send_minute is None else send_minute
+    now = datetime.now(LOCAL_TIMEZONE)
+    text = f"Расписание будет приходить в {format_minute(effective)}"
+    if effective <= now.hour * 60 + now.minute:
+        text += ", начиная с завтра"
+    return text
+
 # ==================== КОМАНДЫ ====================
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
@@ -941,6 +2818,10 @@ async def cmd_help(message: types.Message, state: FSMContext):
             f"<code>/group</code> — сменить группу\n"
             f"<code>/today</code> — расписание на сегодня\n"
             f"<code>/tomorrow</code> — расписание на завтра\n"
+            f"<code>/week</code> — расписание на неделю (<code>/week next</code> — на следующую)\n"
+            f"<code>/teacher Фамилия</code> — где сейчас преподаватель\n"
+            f"<code>/rooms С 3</code> — свободные аудитории корпуса на пару\n"
+            f"<code>/notify</code> — время рассылки и напоминаний\n"
             f"<code>/settings</code> — настройки\n"
             f"<code>/reset</code> — сбросить настройки\n"
             f"<code>/help</code> — это сообщение"
@@ -991,12 +2872,82 @@ async def cmd_settings(message: types.Message):
     text = (
         f"{emoji('settings')} <b>Твои настройки</b>\n\n"
         f"{emoji('faculty')} Факультет: {escape_html(settings['faculty_name'])}\n"
-        f"{emoji('group')} Группа: {escape_html(settings['group_name'])}\n\n"
+        f"{emoji('group')} Группа: {escape_html(settings['group_name'])}\n"
+        f"{emoji('time')} Рассылка: в {format_minute(user_send_minute(settings))}\n"
+        f"{emoji('reminder')} Напоминания: {format_lead(user_reminder_lead(settings))}\n\n"
+    )
+    if API_PUBLIC_URL:
+        text += (
+            f"{emoji('calendar')} Календарь группы для Google Calendar и других:\n"
+            f"<code>{API_PUBLIC_URL}/api/{settings['faculty_id']}/{settings['group_id']}.ics</code>\n\n"
+        )
+    text += (
         f"<code>/group</code> — сменить группу\n"
+        f"<code>/notify</code> — время рассылки и напоминаний\n"
         f"<code>/reset</code> — сбросить настройки"
     )
     
-    await message.answer(text, parse_mode="HTML")
+    await message.answer(text, parse_mode="HTML")
+
+@dp.message(Command("notify"))
+async def cmd_notify(message: types.Message):
+    """Своё время рассылки и за сколько минут напоминать о паре (/notify 07:15 — любое время)"""
+    settings = await get_user_settings(message.from_user.id)
+    if not settings:
+        await message.answer(
+            f"{emoji('info')} <b>Сначала нужно зарегистрироваться!</b>\n\n"
+            f"Напиши /start чтобы начать.",
+            parse_mode="HTML"
+        )
+        return
+    
+    args = message.text.split(maxsplit=1)
+    if len(args) > 1:
+        match = re.match(r'^([0-1]?[0-9]|2[0-3])[:.]([0-5][0-9])$', args[1].strip())
+        if not match:
+            await message.answer(
+                f"{emoji('error')} <b>Неверный формат!</b>\n\n"
+                f"Напиши время в формате <b>ЧЧ:ММ</b>, например: <code>/notify 07:15</code>",
+                parse_mode="HTML"
+            )
+            return
+        send_minute = int(match.group(1)) * 60 + int(match.group(2))
+        confirmation = await apply_send_minute(message.from_user.id, send_minute)
+        settings['send_minute'] = send_minute
+        await message.answer(f"{emoji('success')} {confirmation}", parse_mode="HTML")
+    
+    await message.answer(notify_text(settings), reply_markup=notify_keyboard(settings), parse_mode="HTML")
+
+@dp.callback_query(lambda c: c.data.startswith("notify:"))
+async def notify_set(callback: types.CallbackQuery):
+    """Кнопки /notify: время рассылки (notify:time:<минута|default>) и напоминания (notify:lead:<минуты>)"""
+    settings = await get_user_settings(callback.from_user.id)
+    if not settings:
+        await callback.answer("Сначала нужно зарегистрироваться: /start")
+        return
+    
+    _, field, value = callback.data.split(':')
+    if field == 'time':
+        send_minute = None if value == 'default' else int(value)
+        confirmation = await apply_send_minute(callback.from_user.id, send_minute)
+        settings['send_minute'] = send_minute
+    else:
+        lead = int(value)
+        await set_user_reminder_lead(callback.from_user.id, lead)
+        settings['reminder_lead'] = lead
+        confirmation = f"Напоминания {format_lead(lead)}"
+        if RUN_MODE != 'split':
+            # Сегодняшние напоминания переносятся сразу; в раздельном режиме они уже в очереди воркеров
+            await schedule_reminders_for_user(callback.from_user.id, settings['faculty_id'], settings['group_id'],
+                                              datetime.now(LOCAL_TIMEZONE).date(), lead=lead)
+    
+    await callback.answer(f"✅ {confirmation}")
+    try:
+        await callback.message.edit_text(notify_text(settings), reply_markup=notify_keyboard(settings),
+                                         parse_mode="HTML")
+    except TelegramBadRequest:
+        # Нажат уже выбранный вариант
+        pass
 
 @dp.message(Command("today"))
 async def cmd_today(message: types.Message):
@@ -1010,7 +2961,7 @@ async def cmd_today(message: types.Message):
         )
         return
     
-    today_msg = await generate_daily_message(message.from_user.id, datetime.now().date())
+    today_msg = await generate_daily_message(message.from_user.id, datetime.now().date(), settings)
     
     if today_msg:
         await message.answer(today_msg, parse_mode="HTML")
@@ -1033,7 +2984,7 @@ async def cmd_tomorrow(message: types.Message):
         return
     
     tomorrow = datetime.now().date() + timedelta(days=1)
-    tomorrow_msg = await generate_daily_message(message.from_user.id, tomorrow)
+    tomorrow_msg = await generate_daily_message(message.from_user.id, tomorrow, settings)
     
     if tomorrow_msg:
         await message.answer(tomorrow_msg, parse_mode="HTML")
@@ -1043,6 +2994,138 @@ async def cmd_tomorrow(message: types.Message):
             parse_mode="HTML"
         )
 
+@dp.message(Command("week"))
+async def cmd_week(message: types.Message):
+    """Расписание на неделю (/week next — на следующую) с переключением дней кнопками"""
+    settings = await get_user_settings(message.from_user.id)
+    if not settings:
+        await message.answer(
+            f"{emoji('info')} <b>Сначала нужно зарегистрироваться!</b>\n\n"
+            f"Напиши /start чтобы начать.",
+            parse_mode="HTML"
+        )
+        return
+    
+    args = message.text.split()
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    monday = today - timedelta(days=today.weekday())
+    selected = today.weekday()
+    if len(args) > 1 and args[1].lower() == 'next':
+        monday += timedelta(weeks=1)
+        selected = 0
+    
+    pages = await get_week_view(settings, monday)
+    if pages is None:
+        await message.answer(
+            f"{emoji('error')} Не удалось загрузить расписание, попробуй позже",
+            parse_mode="HTML"
+        )
+        return
+    
+    await message.answer(
+        pages[selected],
+        reply_markup=week_keyboard(settings['faculty_id'], settings['group_id'], monday, selected),
+        parse_mode="HTML"
+    )
+
+@dp.callback_query(lambda c: c.data.startswith("week:"))
+async def week_day(callback: types.CallbackQuery):
+    """Переключение дня: текст берётся из отрисованной недели в памяти"""
+    _, faculty_id, group_id, monday_str, day = callback.data.split(':')
+    monday = date.fromisoformat(monday_str)
+    selected = int(day)
+    view = week_views.get((faculty_id, group_id, monday))
+    if view:
+        pages = view[1]
+    else:
+        # Неделя вытеснена из памяти или бот перезапускался: собираем заново
+        settings = await get_user_settings(callback.from_user.id)
+        if not settings or (settings['faculty_id'], settings['group_id']) != (faculty_id, group_id):
+            await callback.answer("Расписание устарело, отправь /week ещё раз")
+            return
+        pages = await get_week_view(settings, monday)
+        if pages is None:
+            await callback.answer("Не удалось загрузить расписание, попробуй позже")
+            return
+    
+    await callback.answer()
+    try:
+        await callback.message.edit_text(
+            pages[selected],
+            reply_markup=week_keyboard(faculty_id, group_id, monday, selected),
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest:
+        # Нажат уже открытый день
+        pass
+
+@dp.message(Command("teacher"))
+async def cmd_teacher(message: types.Message):
+    """Где сейчас преподаватель: пары на сегодня из индекса расписаний групп"""
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer(
+            f"{emoji('search')} Напиши фамилию преподавателя: <code>/teacher Иванов</code>",
+            parse_mode="HTML"
+        )
+        return
+    
+    names = lesson_index.find_teachers(args[1])
+    if not names:
+        await message.answer(
+            f"{emoji('error')} Преподаватель не найден в расписаниях, загруженных ботом",
+            parse_mode="HTML"
+        )
+        return
+    if len(names) > TEACHER_MATCHES_LIMIT:
+        listed = '\n'.join(f"{emoji('dot')} {escape_html(name)}" for name in names[:TEACHER_MATCHES_LIMIT])
+        await message.answer(
+            f"{emoji('search')} Найдено преподавателей: {len(names)}, уточни запрос\n\n{listed}",
+            parse_mode="HTML"
+        )
+        return
+    
+    now = datetime.now(LOCAL_TIMEZONE)
+    await message.answer('\n\n'.join(format_teacher_day(name, now) for name in names), parse_mode="HTML")
+
+@dp.message(Command("rooms"))
+async def cmd_rooms(message: types.Message):
+    """Свободные аудитории корпуса на пару (по умолчанию — на текущую или ближайшую)"""
+    args = message.text.split()
+    buildings = ', '.join(lesson_index.buildings()) or "пока нет"
+    if len(args) < 2 or (len(args) > 2 and not args[2].isdigit()):
+        await message.answer(
+            f"{emoji('search')} Напиши корпус и номер пары: <code>/rooms С 3</code>\n"
+            f"Без номера пары — текущая или ближайшая.\n\n"
+            f"Известные корпуса: {escape_html(buildings)}",
+            parse_mode="HTML"
+        )
+        return
+    
+    now = datetime.now(LOCAL_TIMEZONE)
+    number = int(args[2]) if len(args) > 2 else lesson_index.pair_at(now.strftime('%H:%M'))
+    if number is None:
+        await message.answer(f"{emoji('calendar')} Пары на сегодня закончились", parse_mode="HTML")
+        return
+    
+    rooms = lesson_index.free_rooms(args[1], now.date(), number)
+    if rooms is None:
+        await message.answer(
+            f"{emoji('error')} Корпус {escape_html(args[1])} не найден\n\n"
+            f"Известные корпуса: {escape_html(buildings)}",
+            parse_mode="HTML"
+        )
+        return
+    
+    start, end = lesson_index.pair_times.get(number, ('', ''))
+    period = f" ({start}–{end})" if start else ""
+    await message.answer(
+        f"🚪 <b>Свободные аудитории корпуса {escape_html(building_key(args[1]))}, {number}-я пара{period}</b>\n\n"
+        f"{escape_html(', '.join(rooms)) if rooms else 'Свободных аудиторий нет'}\n\n"
+        f"<i>Учитываются аудитории из расписаний групп, загруженных ботом</i>",
+        parse_mode="HTML"
+    )
+
 @dp.message(Command("reset"))
 async def cmd_reset(message: types.Message, state: FSMContext):
     """Сброс настроек и удаление из БД"""
@@ -1068,16 +3151,8 @@ async def cmd_reset(message: types.Message, state: FSMContext):
         parse_mode="HTML"
     )
 
-@dp.message(Command("beta"))
-async def cmd_beta(message: types.Message):
-    """Панель разработчика"""
-    if message.from_user.id != BETA_TESTER_ID:
-        await message.answer(
-            f"{emoji('error')} Эта команда только для разработчика",
-            parse_mode="HTML"
-        )
-        return
-    
+async def render_beta_panel() -> Tuple[str, types.InlineKeyboardMarkup]:
+    """Главное меню бета-панели"""
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="📊 Статистика", callback_data="beta_stats")],
         [types.InlineKeyboardButton(text="📢 Сделать рассылку", callback_data="beta_broadcast")],
@@ -1085,6 +3160,8 @@ async def cmd_beta(message: types.Message):
         [types.InlineKeyboardButton(text="🧪 Тестовая рассылка мне", callback_data="beta_broadcast_me")],
         [types.InlineKeyboardButton(text="📋 Список пользователей", callback_data="beta_users")],
         [types.InlineKeyboardButton(text="📨 Все сообщения бота", callback_data="beta_all_messages")],
+        [types.InlineKeyboardButton(text="🐢 Медленные запросы", callback_data="beta_slow")],
+        [types.InlineKeyboardButton(text="🧹 Очистить кеш расписаний", callback_data="beta_cache_purge")],
         [types.InlineKeyboardButton(text="⏰ Установить время рассылки", callback_data="beta_set_time")]
     ])
     
@@ -1096,6 +3173,19 @@ async def cmd_beta(message: types.Message):
         f"⏰ Время рассылки: {schedule_hour:02d}:{schedule_minute:02d} МСК\n\n"
         f"Выбери действие:"
     )
+    return text, keyboard
+
+@dp.message(Command("beta"))
+async def cmd_beta(message: types.Message):
+    """Панель разработчика"""
+    if message.from_user.id != BETA_TESTER_ID:
+        await message.answer(
+            f"{emoji('error')} Эта команда только для разработчика",
+            parse_mode="HTML"
+        )
+        return
+    
+    text, keyboard = await render_beta_panel()
     
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
@@ -1108,14 +3198,33 @@ async def beta_stats(callback: types.CallbackQuery):
     
     await callback.answer()
     
-    users = await get_all_users()
+    total, active = await get_user_activity_counts()
     text = (
         f"{emoji('stats')} <b>Статистика</b>\n\n"
-        f"Всего пользователей: {await get_user_count()}\n"
-        f"Активных сегодня: {len(users)}\n"
+        f"Всего пользователей: {total}\n"
+        f"Активных: {active}\n"
+        f"Неактивных (рассылка их пропускает): {total - active}\n"
         f"Режим рассылки: {BROADCAST_MODE}\n"
         f"Бета-тестер ID: {BETA_TESTER_ID}"
     )
+    if last_broadcast_stats:
+        text += (
+            f"\n\n<b>Последняя рассылка ({last_broadcast_stats['date'].strftime('%d.%m.%Y')}):</b>\n"
+            f"✅ {last_broadcast_stats['success']} • ⏭️ {last_broadcast_stats['skip']} • "
+            f"❌ {last_broadcast_stats['fail']}\n"
+            f"Сэкономлено вызовов Telegram: {last_broadcast_stats['avoided']}"
+        )
+    if RUN_MODE == 'split':
+        jobs = await job_queue.stats()
+        text += (
+            f"\n\n<b>Очередь воркеров:</b>\n"
+            f"⏳ {jobs.get('pending', 0)} • ⚙️ {jobs.get('running', 0)} • "
+            f"✅ {jobs.get('done', 0)} • ❌ {jobs.get('failed', 0)}"
+        )
+    if RUN_MODE != 'split':
+        text += "\n\n" + format_reminder_stats(reminder_dispatcher.stats)
+    if last_cache_purge:
+        text += "\n\n" + format_cache_purge(last_cache_purge)
     await callback.message.edit_text(text, parse_mode="HTML")
 
 @dp.callback_query(lambda c: c.data == "beta_broadcast_all")
@@ -1127,13 +3236,17 @@ async def beta_broadcast_all(callback: types.CallbackQuery):
     await callback.answer()
     
     await callback.message.edit_text(f"{emoji('test')} Запускаю тестовую рассылку ВСЕМ пользователям...", parse_mode="HTML")
-    success, fail = await send_test_broadcast()
-    text = (
-        f"{emoji('success')} Тестовая рассылка завершена!\n"
-        f"Успешно: {success}\n"
-        f"Ошибок: {fail}"
-    )
-    await callback.message.answer(text, parse_mode="HTML")
+    
+    async def broadcast_all():
+        success, fail = await send_test_broadcast()
+        text = (
+            f"{emoji('success')} Тестовая рассылка завершена!\n"
+            f"Успешно: {success}\n"
+            f"Ошибок: {fail}"
+        )
+        await callback.message.answer(text, parse_mode="HTML")
+    
+    run_admin_task('beta_broadcast_all', broadcast_all())
 
 @dp.callback_query(lambda c: c.data == "beta_broadcast_me")
 async def beta_broadcast_me(callback: types.CallbackQuery):
@@ -1161,24 +3274,8 @@ async def beta_users(callback: types.CallbackQuery):
     
     await callback.answer()
     
-    async with aiosqlite.connect('users.db') as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute('''
-            SELECT user_id, faculty_name, group_name, is_beta_tester, is_active 
-            FROM users ORDER BY registered_at DESC LIMIT 20
-        ''')
-        users = await cursor.fetchall()
-    
-    text_lines = [f"{emoji('list')} <b>Последние 20 пользователей:</b>\n"]
-    
-    for u in users:
-        beta_mark = "🔬" if u['is_beta_tester'] else "👤"
-        active_mark = "✅" if u['is_active'] else "❌"
-        user_link = f"<a href='tg://user?id={u['user_id']}'>{u['user_id']}</a>"
-        text_lines.append(f"{beta_mark} {user_link} {active_mark}")
-        text_lines.append(f"   {escape_html(u['faculty_name'])} — {escape_html(u['group_name'])}\n")
-    
-    await callback.message.edit_text("\n".join(text_lines), parse_mode="HTML")
+    text, keyboard = await render_users_page('beta')
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
 @dp.callback_query(lambda c: c.data == "beta_all_messages")
 async def beta_all_messages(callback: types.CallbackQuery):
@@ -1196,6 +3293,66 @@ async def beta_all_messages(callback: types.CallbackQuery):
     
     await send_all_messages(callback.from_user.id)
 
+def render_slow_traces(limit: int = 10) -> str:
+    """Самые медленные из последних обновлений с разбивкой по спанам"""
+    traces = trace_recorder.slowest(limit)
+    lines = [
+        f"🐢 <b>Медленные запросы</b>\n",
+        f"Из последних {len(trace_recorder.recent)} обновлений; "
+        f"дольше {TRACE_SLOW_MS:.0f} мс пишутся в <code>{escape_html(str(TRACE_LOG_PATH))}</code>\n"
+    ]
+    if not traces:
+        lines.append("Пока нет обработанных обновлений")
+    for trace in traces:
+        spans = sorted(trace.span_totals().items(), key=lambda item: item[1], reverse=True)
+        breakdown = ", ".join(f"{name} {duration * 1000:.0f}" for name, duration in spans[:4])
+        lines.append(
+            f"<b>{escape_html(trace.name)}</b> — {trace.duration * 1000:.0f} мс "
+            f"({trace.started_at.strftime('%H:%M:%S')}, <code>{trace.id}</code>)"
+            + (f"\n    {escape_html(breakdown)}" if breakdown else "")
+            + (f"\n    ❌ {escape_html(trace.error)}" if trace.error else "")
+        )
+    return "\n".join(lines)
+
+@dp.callback_query(lambda c: c.data == "beta_slow")
+async def beta_slow(callback: types.CallbackQuery):
+    """Самые медленные обработчики за последнее время"""
+    if callback.from_user.id != BETA_TESTER_ID:
+        await callback.answer(f"{emoji('error')} Недостаточно прав", parse_mode="HTML")
+        return
+
+    await callback.answer()
+
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="beta_slow")],
+        [types.InlineKeyboardButton(text="◀️ Назад", callback_data="beta_back")]
+    ])
+    try:
+        await callback.message.edit_text(render_slow_traces(), reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest:
+        # Текст не изменился с прошлого нажатия «Обновить»
+        pass
+
+@dp.callback_query(lambda c: c.data == "beta_cache_purge")
+async def beta_cache_purge(callback: types.CallbackQuery):
+    """Внеочередная очистка кеша расписаний с отчётом до и после"""
+    if callback.from_user.id != BETA_TESTER_ID:
+        await callback.answer(f"{emoji('error')} Недостаточно прав", parse_mode="HTML")
+        return
+    
+    await callback.answer("Очистка запущена")
+    
+    async def cache_purge():
+        report = await purge_schedule_cache()
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="◀️ Назад", callback_data="beta_back")]
+        ])
+        await callback.message.edit_text(
+            f"{emoji('success')} " + format_cache_purge(report), reply_markup=keyboard, parse_mode="HTML"
+        )
+    
+    run_admin_task('beta_cache_purge', cache_purge())
+
 @dp.callback_query(lambda c: c.data == "beta_broadcast")
 async def beta_broadcast(callback: types.CallbackQuery, state: FSMContext):
     """Начало создания рассылки"""
@@ -1237,7 +3394,8 @@ async def beta_set_time(callback: types.CallbackQuery, state: FSMContext):
     
     await callback.message.edit_text(
         f"{emoji('time')} <b>Установка времени рассылки</b>\n\n"
-        f"Текущее время: {schedule_hour:02d}:{schedule_minute:02d} МСК\n\n"
+        f"Текущее время: {schedule_hour:02d}:{schedule_minute:02d} МСК\n"
+        f"Это общее время: выбравшие своё в /notify его сохраняют.\n\n"
         f"Выбери предустановленное время или введи своё:",
         reply_markup=keyboard,
         parse_mode="HTML"
@@ -1301,24 +3459,7 @@ async def process_time_input(message: types.Message, state: FSMContext):
     
     await state.clear()
     
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="📊 Статистика", callback_data="beta_stats")],
-        [types.InlineKeyboardButton(text="📢 Сделать рассылку", callback_data="beta_broadcast")],
-        [types.InlineKeyboardButton(text="🧪 Тестовая рассылка всем", callback_data="beta_broadcast_all")],
-        [types.InlineKeyboardButton(text="🧪 Тестовая рассылка мне", callback_data="beta_broadcast_me")],
-        [types.InlineKeyboardButton(text="📋 Список пользователей", callback_data="beta_users")],
-        [types.InlineKeyboardButton(text="📨 Все сообщения бота", callback_data="beta_all_messages")],
-        [types.InlineKeyboardButton(text="⏰ Установить время рассылки", callback_data="beta_set_time")]
-    ])
-    
-    text = (
-        f"{emoji('beta')} <b>Панель бета-тестирования</b>\n\n"
-        f"Текущий режим: {mode_desc.get(BROADCAST_MODE, 'Неизвестно')}\n"
-        f"Пользователей в БД: {await get_user_count()}\n"
-        f"Бета-тестер: {BETA_TESTER_ID}\n"
-        f"⏰ Время рассылки: {schedule_hour:02d}:{schedule_minute:02d} МСК\n\n"
-        f"Выбери действие:"
-    )
+    text, keyboard = await render_beta_panel()
     
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
@@ -1339,24 +3480,7 @@ async def time_preset(callback: types.CallbackQuery):
     
     await callback.answer(f"✅ Время установлено на {hour:02d}:{minute:02d}")
     
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="📊 Статистика", callback_data="beta_stats")],
-        [types.InlineKeyboardButton(text="📢 Сделать рассылку", callback_data="beta_broadcast")],
-        [types.InlineKeyboardButton(text="🧪 Тестовая рассылка всем", callback_data="beta_broadcast_all")],
-        [types.InlineKeyboardButton(text="🧪 Тестовая рассылка мне", callback_data="beta_broadcast_me")],
-        [types.InlineKeyboardButton(text="📋 Список пользователей", callback_data="beta_users")],
-        [types.InlineKeyboardButton(text="📨 Все сообщения бота", callback_data="beta_all_messages")],
-        [types.InlineKeyboardButton(text="⏰ Установить время рассылки", callback_data="beta_set_time")]
-    ])
-    
-    text = (
-        f"{emoji('beta')} <b>Панель бета-тестирования</b>\n\n"
-        f"Текущий режим: {mode_desc.get(BROADCAST_MODE, 'Неизвестно')}\n"
-        f"Пользователей в БД: {await get_user_count()}\n"
-        f"Бета-тестер: {BETA_TESTER_ID}\n"
-        f"⏰ Время рассылки: {schedule_hour:02d}:{schedule_minute:02d} МСК\n\n"
-        f"Выбери действие:"
-    )
+    text, keyboard = await render_beta_panel()
     
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
@@ -1369,24 +3493,7 @@ async def beta_back(callback: types.CallbackQuery, state: FSMContext):
     
     await state.clear()
     
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="📊 Статистика", callback_data="beta_stats")],
-        [types.InlineKeyboardButton(text="📢 Сделать рассылку", callback_data="beta_broadcast")],
-        [types.InlineKeyboardButton(text="🧪 Тестовая рассылка всем", callback_data="beta_broadcast_all")],
-        [types.InlineKeyboardButton(text="🧪 Тестовая рассылка мне", callback_data="beta_broadcast_me")],
-        [types.InlineKeyboardButton(text="📋 Список пользователей", callback_data="beta_users")],
-        [types.InlineKeyboardButton(text="📨 Все сообщения бота", callback_data="beta_all_messages")],
-        [types.InlineKeyboardButton(text="⏰ Установить время рассылки", callback_data="beta_set_time")]
-    ])
-    
-    text = (
-        f"{emoji('beta')} <b>Панель бета-тестирования</b>\n\n"
-        f"Текущий режим: {mode_desc.get(BROADCAST_MODE, 'Неизвестно')}\n"
-        f"Пользователей в БД: {await get_user_count()}\n"
-        f"Бета-тестер: {BETA_TESTER_ID}\n"
-        f"⏰ Время рассылки: {schedule_hour:02d}:{schedule_minute:02d} МСК\n\n"
-        f"Выбери действие:"
-    )
+    text, keyboard = await render_beta_panel()
     
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
@@ -1490,6 +3597,59 @@ async def broadcast_cancel(callback: types.CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
 
+async def send_broadcast_message(user_id: int, broadcast_text: str,
+                                 media_file_id: Optional[str] = None, media_type: Optional[str] = None):
+    """Одно сообщение рассылки: текст или медиа с подписью"""
+    if media_file_id and media_type:
+        if media_type == "photo":
+            await bot.send_photo(
+                chat_id=user_id,
+                photo=media_file_id,
+                caption=broadcast_text,
+                parse_mode="HTML"
+            )
+        elif media_type == "video":
+            await bot.send_video(
+                chat_id=user_id,
+                video=media_file_id,
+                caption=broadcast_text,
+                parse_mode="HTML"
+            )
+    else:
+        await bot.send_message(
+            chat_id=user_id,
+            text=broadcast_text,
+            parse_mode="HTML"
+        )
+
+async def deliver_broadcast(users: List[Tuple[int, str, str]], broadcast_text: str,
+                            media_file_id: Optional[str] = None, media_type: Optional[str] = None) -> Tuple[int, int]:
+    """Отправка рассылки (текст или медиа с подписью) списку пользователей"""
+    started = perf_counter()
+    success = 0
+    fail = 0
+    blocked = 0
+    
+    for user_id, _, _ in users:
+        try:
+            await send_broadcast_message(user_id, broadcast_text, media_file_id, media_type)
+            success += 1
+        except Exception as e:
+            fail += 1
+            if "bot was blocked" in str(e).lower():
+                blocked += 1
+                await deactivate_user(user_id)
+            else:
+                logger.error("Ошибка отправки пользователю %d: %s", user_id, e)
+        
+        await asyncio.sleep(BROADCAST_SEND_DELAY)
+    
+    elapsed = perf_counter() - started
+    BROADCAST_SECONDS.observe(elapsed, kind='manual')
+    logger.info("📢 Рассылка завершена за %.1f с: ✅ %d, ❌ %d (🔇 заблокировали бота: %d)",
+                elapsed, success, fail, blocked)
+    return success, fail
+
 @dp.callback_query(lambda c: c.data.startswith("broadcast_send_"))
 async def broadcast_send(callback: types.CallbackQuery, state: FSMContext):
     """Отправка рассылки"""
@@ -1505,8 +3665,14 @@ async def broadcast_send(callback: types.CallbackQuery, state: FSMContext):
     broadcast_text = data.get('broadcast_text')
     media_file_id = data.get('media_file_id')
     media_type = data.get('media_type')
+    # Рассылка идёт в фоне, поэтому повторное нажатие уже не отсеивается как дубль:
+    # текст забирается из состояния, и второе нажатие его не найдёт
+    await state.clear()
+    if broadcast_text is None and media_file_id is None:
+        return
     
-    users = await get_all_users()
+    users = await get_active_users()
+    total, _ = await get_user_activity_counts()
     
     await callback.message.edit_text(
         f"{emoji('broadcast')} <b>Начинаю рассылку {len(users)} пользователям...</b>\n\n"
@@ -1514,49 +3680,158 @@ async def broadcast_send(callback: types.CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
     
-    success = 0
-    fail = 0
-    
-    for user_id, _, _ in users:
-        try:
-            if media_file_id and media_type:
-                if media_type == "photo":
-                    await bot.send_photo(
-                        chat_id=user_id,
-                        photo=media_file_id,
-                        caption=broadcast_text,
-                        parse_mode="HTML"
-                    )
-                elif media_type == "video":
-                    await bot.send_video(
-                        chat_id=user_id,
-                        video=media_file_id,
-                        caption=broadcast_text,
-                        parse_mode="HTML"
-                    )
-            else:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text=broadcast_text,
-                    parse_mode="HTML"
-                )
-            success += 1
-        except Exception as e:
-            fail += 1
-            if "bot was blocked" in str(e).lower():
-                await deactivate_user(user_id)
-            logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
+    async def send():
+        if RUN_MODE == 'split':
+            batches = await enqueue_broadcast(users, broadcast_text, media_file_id, media_type)
+            await callback.message.answer(
+                f"{emoji('success')} <b>Рассылка поставлена в очередь воркеров</b>\n\n"
+                f"📦 Пакетов: {batches}\n"
+                f"🔇 Пропущено неактивных: {total - len(users)}",
+                parse_mode="HTML"
+            )
+            return
         
-        await asyncio.sleep(0.05)
+        success, fail = await deliver_broadcast(users, broadcast_text, media_file_id, media_type)
+        
+        await callback.message.answer(
+            f"{emoji('success')} <b>Рассылка завершена!</b>\n\n"
+            f"✅ Успешно: {success}\n"
+            f"❌ Ошибок: {fail}\n"
+            f"🔇 Пропущено неактивных: {total - len(users)}",
+            parse_mode="HTML"
+        )
     
-    await callback.message.answer(
-        f"{emoji('success')} <b>Рассылка завершена!</b>\n\n"
-        f"✅ Успешно: {success}\n"
-        f"❌ Ошибок: {fail}",
-        parse_mode="HTML"
+    run_admin_task('broadcast_send', send())
+
+# ==================== INLINE-РЕЖИМ ====================
+# Последний inline-запрос каждого пользователя: более ранние, ещё ждущие паузы, отбрасываются
+inline_latest: Dict[int, str] = {}
+INLINE_DAY_OFFSETS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+INLINE_WEEKDAYS = {
+    'пн': 0, 'понедельник': 0, 'вт': 1, 'вторник': 1, 'ср': 2, 'среда': 2, 'среду': 2,
+    'чт': 3, 'четверг': 3, 'пт': 4, 'пятница': 4, 'пятницу': 4,
+    'сб': 5, 'суббота': 5, 'субботу': 5, 'вс': 6, 'воскресенье': 6,
+}
+
+def parse_inline_day(word: str, today: date) -> Optional[date]:
+    """«завтра», «чт», «пятницу» (ближайшая), «25.10»; None — это не день"""
+    word = word.lower()
+    if word in INLINE_DAY_OFFSETS:
+        return today + timedelta(days=INLINE_DAY_OFFSETS[word])
+    if word in INLINE_WEEKDAYS:
+        return today + timedelta(days=(INLINE_WEEKDAYS[word] - today.weekday()) % 7)
+    match = re.fullmatch(r'(\d{1,2})\.(\d{1,2})', word)
+    if match:
+        try:
+            return date(today.year, int(match.group(2)), int(match.group(1)))
+        except ValueError:
+            return None
+    return None
+
+def find_groups(query: str) -> List[str]:
+    """Группа с точно таким названием или группы, название которых начинается с query"""
+    refresh_group_names()
+    query = query.lower()
+    if query in group_names_lower:
+        return [group_names_lower[query]]
+    return sorted(name for lower, name in group_names_lower.items() if lower.startswith(query))
+
+def inline_article(name: str, target_date: date, page: str, lessons_count: int) -> types.InlineQueryResultArticle:
+    info = all_groups_cache[name]
+    return types.InlineQueryResultArticle(
+        id=f"{info['faculty_id']}:{info['group_id']}:{target_date.isoformat()}",
+        title=f"Гр. {name} — {format_day_title(target_date)}",
+        description=f"Пар: {lessons_count}" if lessons_count else "Пар нет",
+        input_message_content=types.InputTextMessageContent(message_text=page, parse_mode="HTML"),
+    )
+
+def cached_inline_page(name: str, target_date: date) -> Optional[Tuple[str, int]]:
+    """Текст дня из отрисованной недели в памяти без обращений к базе и сайту"""
+    info = all_groups_cache[name]
+    monday = target_date - timedelta(days=target_date.weekday())
+    view = week_views.get((info['faculty_id'], info['group_id'], monday))
+    if not view or datetime.now() - view[0] >= timedelta(hours=CACHE_TTL_HOURS):
+        return None
+    page = view[1][target_date.weekday()]
+    return page, page.count('-я пара:')
+
+async def answer_inline_hint(inline_query: types.InlineQuery, text: str, cache_time: int):
+    await inline_query.answer(
+        [], cache_time=cache_time, is_personal=False,
+        button=types.InlineQueryResultsButton(text=text[:64], start_parameter='inline')
     )
+
+@dp.inline_query()
+async def inline_schedule(inline_query: types.InlineQuery):
+    """«@бот 430 завтра» — расписание любой группы в любом чате
+
+    Недели, уже отрисованные в памяти, отдаются сразу. Для остальных запрос ждёт
+    INLINE_DEBOUNCE_SECONDS: пока пользователь печатает, промежуточные запросы
+    отбрасываются, и к базе и сайту идёт только последний. Одновременные загрузки
+    одной недели объединяет fetch_week_table.
+    """
+    words = inline_query.query.split()
+    today = datetime.now(LOCAL_TIMEZONE).date()
+    target_date = parse_inline_day(words[-1], today) if len(words) > 1 else None
+    if target_date:
+        words = words[:-1]
+    target_date = target_date or today
+    if not words:
+        await answer_inline_hint(inline_query, "Напиши группу и день: 430 завтра", INLINE_CACHE_TIME)
+        return
     
-    await state.clear()
+    names = find_groups(' '.join(words))
+    if not names:
+        INLINE_QUERIES.inc(result='not_found')
+        cache_time = INLINE_CACHE_TIME if groups_loaded else INLINE_RETRY_CACHE_TIME
+        await answer_inline_hint(inline_query, "Группа не найдена", cache_time)
+        return
+    
+    if len(names) > 1:
+        # Название ещё не дописано: показываем только то, что уже есть в памяти
+        results = []
+        for name in names[:INLINE_RESULTS_LIMIT]:
+            cached = cached_inline_page(name, target_date)
+            if cached:
+                results.append(inline_article(name, target_date, *cached))
+        INLINE_QUERIES.inc(result='ambiguous')
+        if results:
+            await inline_query.answer(results, cache_time=INLINE_RETRY_CACHE_TIME, is_personal=False)
+        else:
+            await answer_inline_hint(inline_query, "Уточни группу: " + ', '.join(names[:INLINE_RESULTS_LIMIT]),
+                                     INLINE_RETRY_CACHE_TIME)
+        return
+    
+    name = names[0]
+    cached = cached_inline_page(name, target_date)
+    if cached:
+        INLINE_QUERIES.inc(result='memory')
+        await inline_query.answer([inline_article(name, target_date, *cached)],
+                                  cache_time=INLINE_CACHE_TIME, is_personal=False)
+        return
+    
+    user_id = inline_query.from_user.id
+    inline_latest[user_id] = inline_query.id
+    try:
+        await asyncio.sleep(INLINE_DEBOUNCE_SECONDS)
+        if inline_latest.get(user_id) != inline_query.id:
+            INLINE_QUERIES.inc(result='superseded')
+            return
+        info = all_groups_cache[name]
+        settings = {**info, 'group_name': name}
+        pages = await get_week_view(settings, target_date - timedelta(days=target_date.weekday()))
+    finally:
+        if inline_latest.get(user_id) == inline_query.id:
+            del inline_latest[user_id]
+    
+    if pages is None:
+        INLINE_QUERIES.inc(result='failed')
+        await answer_inline_hint(inline_query, "Не удалось загрузить расписание", INLINE_RETRY_CACHE_TIME)
+        return
+    INLINE_QUERIES.inc(result='loaded')
+    page = pages[target_date.weekday()]
+    await inline_query.answer([inline_article(name, target_date, page, page.count('-я пара:'))],
+                              cache_time=INLINE_CACHE_TIME, is_personal=False)
 
 # ==================== ОБРАБОТЧИК ВВОДА ГРУППЫ ====================
 @dp.message(Form.waiting_for_group)
@@ -1577,8 +3852,12 @@ async def process_group_input(message: types.Message, state: FSMContext):
             await cmd_today(message)
         elif command == '/tomorrow':
             await cmd_tomorrow(message)
+        elif command in ('/week', '/week next'):
+            await cmd_week(message)
         elif command == '/settings':
             await cmd_settings(message)
+        elif command == '/notify':
+            await cmd_notify(message)
         elif command == '/group':
             await cmd_start(message, state)
             return
@@ -1630,10 +3909,7 @@ async def process_group_input(message: types.Message, state: FSMContext):
             )
             
             today = datetime.now().date()
-            task_key = f"{message.from_user.id}_{today}"
-            if task_key in reminder_tasks:
-                reminder_tasks[task_key].cancel()
-                del reminder_tasks[task_key]
+            reminder_dispatcher.cancel(f"{message.from_user.id}_{today}")
             
             now = datetime.now(LOCAL_TIMEZONE)
             if now.hour < 23:
@@ -1641,7 +3917,8 @@ async def process_group_input(message: types.Message, state: FSMContext):
                     message.from_user.id,
                     group_info['faculty_id'],
                     group_info['group_id'],
-                    today
+                    today,
+                    lead=old_settings['reminder_lead']
                 )
             
             await message.answer(text, parse_mode="HTML")
@@ -1652,8 +3929,9 @@ async def process_group_input(message: types.Message, state: FSMContext):
                 f"{emoji('success')} <b>Регистрация завершена!</b>\n\n"
                 f"{emoji('faculty')} {escape_html(group_info['faculty_name'])}, гр. {escape_html(group_input)}\n\n"
                 f"{emoji('calendar')} <b>Что дальше?</b>\n"
-                f"{emoji('dot')} Каждое утро в 6:00 я буду присылать расписание\n"
-                f"{emoji('dot')} За 20 минут до пары придет напоминание"
+                f"{emoji('dot')} Каждое утро в {format_minute(default_send_minute())} я буду присылать расписание\n"
+                f"{emoji('dot')} За {REMINDER_LEAD_MINUTES} минут до пары придет напоминание\n"
+                f"{emoji('dot')} Время рассылки и напоминаний можно поменять: /notify"
             )
             
             await message.answer(text, parse_mode="HTML")
@@ -1691,12 +3969,22 @@ async def process_group_input(message: types.Message, state: FSMContext):
 # ==================== ЗАПУСК ====================
 async def on_startup():
     global http_session
-    http_session = aiohttp.ClientSession()
+    # До приёма обновлений — только то, без чего обработчики не работают
+    http_session = create_http_session()
     await init_db()
+    await load_inactive_users()
+    enable_trace_log()
     
     # ЗАПУСКАЕМ ФОНОВЫЕ ЗАДАЧИ ЗДЕСЬ
-    asyncio.create_task(load_all_groups_background())
+    asyncio.create_task(warm_up())
     asyncio.create_task(daily_schedule_sender())
+    asyncio.create_task(lesson_index_sync())
+    asyncio.create_task(schedule_cache_retention())
+    if RUN_MODE == 'split':
+        asyncio.create_task(inactive_users_sync())
+    if SCHEDULE_REFRESH_BUDGET:
+        asyncio.create_task(schedule_change_watcher())
+    asyncio.create_task(metrics.monitor_event_loop_lag(EVENT_LOOP_LAG, EVENT_LOOP_LAG_SECONDS))
     
     logger.info("✅ HTTP сессия создана")
     logger.info("✅ Загрузка групп запущена в фоне")
@@ -1706,6 +3994,13 @@ async def on_shutdown():
     global http_session
     if http_session:
         await http_session.close()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    if schedule_api:
+        await schedule_api.stop()
+    await reminder_dispatcher.stop()
+    await dp.storage.close()
+    await job_queue.close()
     logger.info("👋 HTTP сессия закрыта")
 
 async def main():
@@ -1723,7 +4018,35 @@ async def main():
     dp.shutdown.register(on_shutdown)
     
     # Запускаем бота
-    await dp.start_polling(bot)
+    if WEBHOOK_URL:
+        await run_webhook()
+    else:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+
+async def run_webhook():
+    """Webhook вместо long polling: сервер работает в том же цикле событий, что и HTTP-сессия бота"""
+    global webhook_server
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await dp.emit_startup(bot=bot)
+    webhook_server = webhook.WebhookServer(dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET,
+                                           WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    await webhook_server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None,
+                          allowed_updates=dp.resolve_used_update_types())
+    logger.info(f"🪝 Webhook {WEBHOOK_URL} → http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, "
+                f"обработчиков: {WEBHOOK_WORKERS}")
+    try:
+        await stop.wait()
+    finally:
+        logger.info("🛑 Остановка webhook, дообрабатываем принятые обновления...")
+        await webhook_server.stop(WEBHOOK_DRAIN_TIMEOUT)
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
 
 if __name__ == "__main__":
     try:
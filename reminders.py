@@ -0,0 +1,169 @@
+"""
+Отправка напоминаний о парах: общая очередь по сроку, разнос отправок по окну перед сроком и повтор после 429
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Reminder(NamedTuple):
+    """Напоминание; deadline и expires — unix time"""
+    deadline: float
+    seq: int
+    key: str
+    user_id: int
+    lesson: Dict[str, Any]
+    # Начало пары: позже напоминание уже бесполезно
+    expires: float
+
+
+class ReminderDispatcher:
+    """Одна задача отправляет все напоминания в порядке срока
+
+    Напоминания групп с одинаковым началом пары приходятся на одну секунду, поэтому
+    отправка начинается за spread секунд до срока и идёт не чаще rate в секунду:
+    пик растягивается по окну вместо пачки 429 от Telegram. На retry_after
+    отправка всех напоминаний приостанавливается на указанное время, а само
+    напоминание повторяется (не больше max_retries раз и не позже начала пары).
+    Напоминания одного ключа (пользователь и день) заменяются и отменяются вместе.
+    """
+
+    def __init__(self, send: Callable[[Reminder], Awaitable[None]], spread: float = 120.0, rate: float = 25.0,
+                 max_retries: int = 3, results: Optional[metrics.Counter] = None,
+                 lateness: Optional[metrics.Histogram] = None):
+        self.send = send
+        self.spread = spread
+        self.rate = rate
+        self.max_retries = max_retries
+        self.results = results
+        self.lateness = lateness
+        self.heap: List[Reminder] = []
+        self.queued: Dict[str, List[Reminder]] = {}
+        self.sending: Set[asyncio.Task] = set()
+        self.seq = 0
+        self.paused_until = 0.0
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {'sent': 0, 'late': 0, 'late_seconds': 0.0, 'max_late': 0.0,
+                      'retries': 0, 'expired': 0, 'failed': 0}
+
+    def __len__(self) -> int:
+        return sum(len(reminders) for reminders in self.queued.values()) + len(self.sending)
+
+    def replace(self, key: str, user_id: int, lessons: List[Dict[str, Any]], deadlines: List[float],
+                expires: List[float]) -> int:
+        """Замена напоминаний ключа; возвращает число запланированных"""
+        self.cancel(key)
+        now = time.time()
+        reminders = []
+        for lesson, deadline, lesson_start in zip(lessons, deadlines, expires):
+            if deadline < now:
+                continue
+            self.seq += 1
+            reminder = Reminder(deadline, self.seq, key, user_id, lesson, lesson_start)
+            heapq.heappush(self.heap, reminder)
+            reminders.append(reminder)
+        if reminders:
+            self.queued[key] = reminders
+            self.start()
+            self.wakeup.set()
+        return len(reminders)
+
+    def cancel(self, key: str) -> int:
+        # Из кучи записи удаляются лениво, когда доходят до её вершины
+        return len(self.queued.pop(key, ()))
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        tasks = [task for task in [self.task, *self.sending] if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+
+    async def join(self):
+        """Ожидание, пока не будут отправлены все запланированные напоминания"""
+        while len(self):
+            await asyncio.sleep(0.1)
+
+    def is_queued(self, reminder: Reminder) -> bool:
+        return reminder in self.queued.get(reminder.key, ())
+
+    def take(self, reminder: Reminder):
+        reminders = self.queued[reminder.key]
+        reminders.remove(reminder)
+        if not reminders:
+            del self.queued[reminder.key]
+
+    async def run(self):
+        next_send = 0.0
+        while True:
+            while self.heap and not self.is_queued(self.heap[0]):
+                heapq.heappop(self.heap)
+            wait = None
+            if self.heap:
+                wait = max(self.heap[0].deadline - self.spread, self.paused_until, next_send) - time.time()
+            if wait is None or wait > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            reminder = heapq.heappop(self.heap)
+            self.take(reminder)
+            next_send = time.time() + 1 / self.rate
+            task = asyncio.create_task(self.deliver(reminder))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def deliver(self, reminder: Reminder) -> str:
+        """Отправка с повтором после retry_after; результат — sent, late, expired или failed"""
+        for attempt in range(self.max_retries + 1):
+            pause = self.paused_until - time.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if time.time() >= reminder.expires:
+                return self.record(reminder, 'expired')
+            try:
+                await self.send(reminder)
+            except TelegramRetryAfter as e:
+                self.paused_until = max(self.paused_until, time.time() + e.retry_after)
+                self.stats['retries'] += 1
+                logger.warning("⏳ Telegram просит подождать %d с, напоминания приостановлены", e.retry_after)
+                continue
+            except Exception as e:
+                logger.error("❌ Напоминание пользователю %d не отправлено: %s", reminder.user_id, e)
+                return self.record(reminder, 'failed')
+            late = time.time() - reminder.deadline
+            if self.lateness:
+                self.lateness.observe(max(0.0, late))
+            if late <= 0:
+                return self.record(reminder, 'sent')
+            self.stats['late_seconds'] += late
+            self.stats['max_late'] = max(self.stats['max_late'], late)
+            return self.record(reminder, 'late')
+        return self.record(reminder, 'failed')
+
+    def record(self, reminder: Reminder, result: str) -> str:
+        if result == 'late':
+            self.stats['sent'] += 1
+        self.stats[result] += 1
+        if self.results:
+            self.results.inc(result=result)
+        if result in ('expired', 'failed'):
+            logger.debug("⏰ Напоминание %s (%d-я пара): %s", reminder.key, reminder.lesson.get('number', 0), result)
+        return result
@@ -0,0 +1,190 @@
+"""
+Обратный индекс расписаний в памяти: преподаватель -> пары, аудитория -> занятые пары
+
+Индекс пополняется при каждой записи расписания группы в кеш, поэтому вопросы
+«где сейчас преподаватель» и «какие аудитории свободны» не требуют запросов к сайту.
+"""
+
+import re
+from bisect import bisect_left
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+NO_TEACHER = "Не указан"
+NO_AUDIENCE = "Не указана"
+
+# Буквы корпусов на сайте встречаются и латиницей, и кириллицей
+LATIN_TO_CYRILLIC = str.maketrans('ABCEHKMOPTXY', 'АВСЕНКМОРТХУ')
+TEACHER_TITLES = {'асс', 'ст', 'преп', 'доц', 'проф', 'зав', 'каф'}
+
+
+class Slot(NamedTuple):
+    """Пара группы в конкретный день"""
+    faculty_id: str
+    group_id: str
+    target_date: date
+    number: int
+    start: str
+    end: str
+    subject: str
+    type: str
+    teacher: str
+    audience: str
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.replace('\xa0', ' ').split())
+
+
+def building_key(name: str) -> str:
+    return name.upper().translate(LATIN_TO_CYRILLIC)
+
+
+def room_building(audience: str) -> str:
+    """Корпус аудитории: буква после номера («333 С» -> «С»)"""
+    parts = audience.split()
+    return building_key(parts[-1]) if len(parts) > 1 else ''
+
+
+def name_tokens(name: str) -> List[str]:
+    """Слова ФИО без должности и инициалов — по ним ищется преподаватель"""
+    tokens = []
+    for word in re.split(r'[\s.,]+', name.lower()):
+        if len(word) > 2 and word not in TEACHER_TITLES:
+            tokens.append(word.replace('ё', 'е'))
+    return tokens
+
+
+class ScheduleIndex:
+    """Индекс пар по преподавателям и аудиториям
+
+    Группа и дата — единица обновления: новая версия дня группы заменяет всё, что
+    группа вносила в индекс на этот день. Аудитории, которые хоть раз встречались
+    в расписаниях, запоминаются по корпусам: свободной считается известная аудитория
+    без пары в этот день и час.
+    """
+
+    def __init__(self):
+        self.slots: Dict[Tuple[str, str, date], List[Slot]] = {}
+        self.by_teacher: Dict[str, Dict[date, List[Slot]]] = {}
+        self.teacher_tokens: Dict[str, Set[str]] = {}
+        # Отсортированные слова ФИО для поиска по началу слова; None — пересобрать
+        self.sorted_tokens: Optional[List[str]] = None
+        # (дата, номер пары) -> аудитория -> занимающие её группы
+        self.occupied: Dict[Tuple[date, int], Dict[str, Set[str]]] = {}
+        self.rooms: Dict[str, Set[str]] = {}
+        self.sorted_rooms: Dict[str, List[str]] = {}
+        # Номер пары -> (начало, конец), как на сайте
+        self.pair_times: Dict[int, Tuple[str, str]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(slots) for slots in self.slots.values())
+
+    def update(self, faculty_id: str, group_id: str, target_date: date, lessons: List[Dict]):
+        """Замена пар группы на дату (пустой список — пар нет)"""
+        key = (faculty_id, group_id, target_date)
+        for slot in self.slots.pop(key, ()):
+            self.remove(slot)
+        slots = [
+            Slot(faculty_id, group_id, target_date, lesson['number'], lesson['start'], lesson['end'],
+                 lesson['subject'], lesson['type'], normalize(lesson['teacher']), normalize(lesson['audience']))
+            for lesson in lessons if 'number' in lesson
+        ]
+        for slot in slots:
+            self.add(slot)
+        if slots:
+            self.slots[key] = slots
+
+    def add(self, slot: Slot):
+        self.pair_times.setdefault(slot.number, (slot.start, slot.end))
+        if slot.teacher != NO_TEACHER:
+            days = self.by_teacher.get(slot.teacher)
+            if days is None:
+                days = self.by_teacher[slot.teacher] = {}
+                for token in name_tokens(slot.teacher):
+                    self.teacher_tokens.setdefault(token, set()).add(slot.teacher)
+                self.sorted_tokens = None
+            days.setdefault(slot.target_date, []).append(slot)
+        if slot.audience != NO_AUDIENCE:
+            building = room_building(slot.audience)
+            rooms = self.rooms.setdefault(building, set())
+            if slot.audience not in rooms:
+                rooms.add(slot.audience)
+                self.sorted_rooms.pop(building, None)
+            rooms = self.occupied.setdefault((slot.target_date, slot.number), {})
+            rooms.setdefault(slot.audience, set()).add(slot.group_id)
+
+    def remove(self, slot: Slot):
+        days = self.by_teacher.get(slot.teacher)
+        if days and slot in days.get(slot.target_date, ()):
+            days[slot.target_date].remove(slot)
+            if not days[slot.target_date]:
+                del days[slot.target_date]
+        rooms = self.occupied.get((slot.target_date, slot.number))
+        if rooms and slot.audience in rooms:
+            rooms[slot.audience].discard(slot.group_id)
+            if not rooms[slot.audience]:
+                del rooms[slot.audience]
+            if not rooms:
+                del self.occupied[(slot.target_date, slot.number)]
+
+    def purge_before(self, cutoff: date) -> int:
+        """Удаление прошедших дней; список аудиторий и преподавателей сохраняется"""
+        old = [key for key in self.slots if key[2] < cutoff]
+        for key in old:
+            for slot in self.slots.pop(key):
+                self.remove(slot)
+        return len(old)
+
+    def find_teachers(self, query: str) -> List[str]:
+        """Преподаватели, у которых каждое слово запроса — начало слова ФИО"""
+        words = name_tokens(query)
+        if not words:
+            return []
+        if self.sorted_tokens is None:
+            self.sorted_tokens = sorted(self.teacher_tokens)
+        found = None
+        for word in words:
+            matches = set()
+            i = bisect_left(self.sorted_tokens, word)
+            while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(word):
+                matches |= self.teacher_tokens[self.sorted_tokens[i]]
+                i += 1
+            found = matches if found is None else found & matches
+        return sorted(found)
+
+    def teacher_day(self, teacher: str, target_date: date) -> List[Tuple[Slot, List[str]]]:
+        """Пары преподавателя за день; поток из нескольких групп — одна пара со списком групп"""
+        lessons: Dict[Tuple[int, str, str], Tuple[Slot, List[str]]] = {}
+        for slot in self.by_teacher.get(teacher, {}).get(target_date, ()):
+            key = (slot.number, slot.audience, slot.subject)
+            if key not in lessons:
+                lessons[key] = (slot, [])
+            lessons[key][1].append(slot.group_id)
+        return [lessons[key] for key in sorted(lessons)]
+
+    def pair_at(self, now: str) -> Optional[int]:
+        """Идущая пара, а на перемене — следующая; None — пары на сегодня закончились"""
+        for number, (start, end) in sorted(self.pair_times.items()):
+            if now < end.zfill(5):
+                return number
+        return None
+
+    def buildings(self) -> List[str]:
+        return sorted(building for building in self.rooms if building)
+
+    def free_rooms(self, building: str, target_date: date, number: int) -> Optional[List[str]]:
+        """Известные аудитории корпуса без пары; None — корпус не встречался"""
+        building = building_key(building)
+        if building not in self.rooms:
+            return None
+        rooms = self.sorted_rooms.get(building)
+        if rooms is None:
+            rooms = self.sorted_rooms[building] = sorted(self.rooms[building], key=room_sort_key)
+        busy = self.occupied.get((target_date, number), {})
+        return [room for room in rooms if room not in busy]
+
+
+def room_sort_key(audience: str) -> Tuple[int, str]:
+    digits = re.match(r'\d+', audience)
+    return (int(digits.group()) if digits else 0, audience)
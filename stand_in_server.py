@@ -0,0 +1,80 @@
+"""
+Локальная замена rasp.rsreu.ru: отдаёт ответы, записанные ботом в режиме HTTP_CACHE_MODE=record
+
+Запуск:
+python3 stand_in_server.py --port 8080 --fallback
+RSREU_BASE_URL=http://127.0.0.1:8080 python3 main.py
+"""
+
+import argparse
+import asyncio
+import os
+import zlib
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from aiohttp import web
+
+os.environ.setdefault('BOT_TOKEN', '123456:STANDIN')
+
+import main
+
+
+class StandInSite:
+    """Отдаёт записанные страницы по пути с запросом, как их видел бот"""
+
+    def __init__(self, store: main.ResponseStore, latency: float = 0.0, fallback: bool = False):
+        self.store = store
+        self.latency = latency
+        self.fallback = fallback
+        self.group_pages = [
+            entry for entry in store.entries()
+            if parse_qs(urlsplit(entry['url']).query).get('group', [''])[0]
+        ]
+        self.served = 0
+
+    def find_entry(self, path_qs: str):
+        entry = self.store.lookup(path_qs)
+        if entry is not None or not self.fallback or not self.group_pages:
+            return entry
+        # Для незаписанной группы отдаём одну из записанных недель — так можно
+        # нагружать бот тысячами групп при настоящем размере страниц
+        group = parse_qs(urlsplit(path_qs).query).get('group', [''])[0]
+        if not group:
+            return None
+        return self.group_pages[zlib.crc32(path_qs.encode()) % len(self.group_pages)]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        entry = self.find_entry(request.path_qs)
+        if entry is None:
+            raise web.HTTPNotFound()
+        body = await asyncio.to_thread(self.store.read_blob, entry)
+        self.served += 1
+        return web.Response(body=body, content_type='text/html', charset=entry['charset'] or 'utf-8')
+
+
+def create_app(site: StandInSite) -> web.Application:
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', site.handle)
+    return app
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Локальная замена сайта расписания")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--dir', type=Path, default=main.HTTP_CACHE_DIR, help="каталог записанных ответов")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="искусственная задержка ответа")
+    parser.add_argument('--fallback', action='store_true',
+                        help="для незаписанных групп отдавать одну из записанных недель")
+    args = parser.parse_args()
+
+    site = StandInSite(main.ResponseStore(args.dir), args.latency_ms / 1000, args.fallback)
+    print(f"📼 Записанных ответов: {len(site.store.entries())}, недель групп: {len(site.group_pages)}")
+    web.run_app(create_app(site), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main_cli()
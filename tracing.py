@@ -0,0 +1,158 @@
+"""
+Трассировка обработки обновлений: trace id на каждое обновление и спаны вокруг медленных операций
+"""
+
+import functools
+import inspect
+import json
+import logging
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Deque, Dict, List, Optional
+
+current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+
+# Логгер медленных трасс: записи из него идут только в файл трасс
+SLOW_LOGGER = 'tracing.slow'
+
+
+class Trace:
+    """Одно обновление: имя обработчика, общее время и спаны с отступом от начала"""
+
+    def __init__(self, name: str, user_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.user_id = user_id
+        self.started_at = datetime.now()
+        self.started = perf_counter()
+        self.duration = 0.0
+        self.spans: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+    def finish(self):
+        self.duration = perf_counter() - self.started
+
+    def span_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span['name']] = totals.get(span['name'], 0.0) + span['duration']
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'user_id': self.user_id,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 2),
+            'error': self.error,
+            'spans': [
+                {'name': span['name'], 'offset_ms': round(span['offset'] * 1000, 2),
+                 'duration_ms': round(span['duration'] * 1000, 2)}
+                for span in self.spans
+            ],
+        }
+
+
+@contextmanager
+def span(name: str):
+    """Спан внутри текущей трассы; вне трассы ничего не делает"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append({'name': name, 'offset': started - trace.started, 'duration': perf_counter() - started})
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: оборачивает вызов функции (обычной или корутины) в спан"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TraceRecorder:
+    """Хранит последние трассы в памяти и передаёт медленные логгеру SLOW_LOGGER
+
+    Сам логгер файл не пишет: обработчик из file_handler подключает тот, кто
+    настраивает логирование, чтобы запись шла не в цикле событий.
+    """
+
+    def __init__(self, path: Path, slow_threshold: float, keep: int = 500,
+                 max_bytes: int = 5 * 1024 * 1024, backup_count: int = 3):
+        self.slow_threshold = slow_threshold
+        self.recent: Deque[Trace] = deque(maxlen=keep)
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.logger = logging.getLogger(SLOW_LOGGER)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def file_handler(self) -> logging.Handler:
+        """Ротируемый JSONL для записей SLOW_LOGGER; каталог создаётся только здесь"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                      encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.addFilter(logging.Filter(SLOW_LOGGER))
+        return handler
+
+    def record(self, trace: Trace):
+        self.recent.append(trace)
+        if trace.duration >= self.slow_threshold:
+            self.logger.info(json.dumps(trace.to_dict(), ensure_ascii=False))
+
+    def slowest(self, limit: int = 10) -> List[Trace]:
+        return sorted(self.recent, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+
+def describe_update(event) -> str:
+    """Короткое имя обработчика для трассы: команда, префикс callback_data или тип обновления"""
+    if event.message and event.message.text:
+        text = event.message.text
+        return text.split()[0].split('@')[0] if text.startswith('/') else 'message:text'
+    if event.callback_query and event.callback_query.data:
+        return 'callback:' + event.callback_query.data.split(':')[0]
+    return event.event_type
+
+
+def create_tracing_middleware(recorder: TraceRecorder):
+    """Внешний middleware обновлений: открывает трассу на всё время обработки"""
+    async def tracing_middleware(handler, event, data):
+        user = data.get('event_from_user')
+        trace = Trace(describe_update(event), user.id if user else None)
+        token = current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            trace.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            trace.finish()
+            current_trace.reset(token)
+            recorder.record(trace)
+    return tracing_middleware
@@ -0,0 +1,116 @@
+"""
+Приём обновлений через webhook: aiohttp-сервер в цикле событий бота и пул обработчиков с очередью
+"""
+
+import asyncio
+import logging
+import secrets
+from collections import deque
+from time import perf_counter
+from typing import Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def chat_key(update: types.Update) -> Hashable:
+    """Ключ очереди: чат обновления, а без чата — само обновление"""
+    chat = UserContextMiddleware.resolve_event_context(update).chat
+    return chat.id if chat else ('update', update.update_id)
+
+
+class WebhookServer:
+    """Отвечает Telegram сразу после постановки обновления в очередь; обрабатывают его workers задач
+
+    Число одновременно обрабатываемых обновлений ограничено workers, принятых — queue_size:
+    при переполнении Telegram получает 503 и повторит доставку позже. Обновления копятся
+    по чатам, а в общей очереди стоят чаты с необработанными обновлениями: обработчик
+    берёт чат, обрабатывает одно его обновление и возвращает чат в конец очереди. Так
+    обновления чата идут по порядку, а обработчики не простаивают в ожидании замка
+    занятого чата. При остановке сервер перестаёт принимать запросы и дожидается
+    обработки уже принятых обновлений.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = '/webhook', secret: str = '',
+                 workers: int = 8, queue_size: int = 1000):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue_size = queue_size
+        # Чаты, у которых есть обновления и которые никто не обрабатывает
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.chats: Dict[Hashable, Deque[Tuple[types.Update, float]]] = {}
+        self.pending = 0
+        self.tasks: List[asyncio.Task] = []
+        self.runner: Optional[web.AppRunner] = None
+        self.accepting = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return web.Response(status=401)
+        if not self.accepting:
+            return web.Response(status=503)
+        update = types.Update.model_validate(await request.json(), context={'bot': self.bot})
+        if self.pending >= self.queue_size:
+            logger.warning("⚠️ Очередь обновлений переполнена (%d), Telegram повторит доставку", self.pending)
+            return web.Response(status=503)
+        key = chat_key(update)
+        updates = self.chats.get(key)
+        if updates is None:
+            updates = self.chats[key] = deque()
+            self.queue.put_nowait(key)
+        updates.append((update, perf_counter()))
+        self.pending += 1
+        return web.json_response({})
+
+    async def worker(self):
+        while True:
+            key = await self.queue.get()
+            updates = self.chats[key]
+            update, received = updates[0]
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("❌ Ошибка обработки обновления %d", update.update_id)
+            finally:
+                # Обновление убирается после обработки: пришедшие тем временем ждут в очереди чата
+                updates.popleft()
+                self.pending -= 1
+                if updates:
+                    self.queue.put_nowait(key)
+                else:
+                    del self.chats[key]
+                self.queue.task_done()
+            logger.debug("📬 Обновление %d обработано за %.0f мс", update.update_id,
+                         (perf_counter() - received) * 1000)
+
+    async def start(self, host: str, port: int):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.accepting = True
+
+    async def stop(self, drain_timeout: float = 30.0):
+        """Плавная остановка: новые обновления не принимаются, принятые дообрабатываются"""
+        self.accepting = False
+        if self.runner:
+            await self.runner.cleanup()
+        pending = self.pending
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+            logger.info("✅ Очередь обновлений обработана (%d в очереди при остановке)", pending)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Не успели обработать %d обновлений за %.0f с", self.pending, drain_timeout)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,121 @@
+"""
+Воркер раздельного режима: выполняет задачи из очереди jobs (рассылки, напоминания, обновление расписаний)
+
+Запуск:
+RUN_MODE=split python3 main.py
+python3 worker.py --processes 4
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import main
+
+IDLE_SLEEP = 1.0
+PURGE_INTERVAL = 3600
+
+
+async def keep_lease(job, worker_id: str):
+    """Продлевает аренду, пока задача выполняется"""
+    while True:
+        await asyncio.sleep(main.job_queue.lease / 3)
+        if not await main.job_queue.heartbeat(job, worker_id):
+            main.logger.warning("⚠️ Аренда задачи %d потеряна", job['id'])
+            return
+
+
+async def run_job(job, worker_id: str):
+    handler = main.JOB_HANDLERS.get(job['kind'])
+    lease = asyncio.create_task(keep_lease(job, worker_id))
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise ValueError(f"Неизвестный тип задачи: {job['kind']}")
+        await handler(job['payload'])
+    except Exception as e:
+        main.logger.error("❌ Задача %d (%s), попытка %d: %s", job['id'], job['kind'], job['attempts'], e)
+        await main.job_queue.fail(job, worker_id, f"{type(e).__name__}: {e}")
+    else:
+        await main.job_queue.complete(job, worker_id)
+        main.logger.debug("✅ Задача %d (%s) за %.2f с", job['id'], job['kind'], time.perf_counter() - started)
+    finally:
+        lease.cancel()
+
+
+async def run_worker(worker_id: str, stop: asyncio.Event):
+    """Захватывает и выполняет задачи, пока не выставлен stop; текущая задача доводится до конца"""
+    main.http_session = main.create_http_session()
+    await main.init_db()
+    main.logger.info("👷 Воркер %s запущен", worker_id)
+    last_purge = 0.0
+    done = 0
+    try:
+        while not stop.is_set():
+            job = await main.job_queue.claim(worker_id)
+            if job is None:
+                next_run_at = await main.job_queue.next_run_at()
+                wait = IDLE_SLEEP if next_run_at is None else min(IDLE_SLEEP, max(0.0, next_run_at - time.time()))
+                try:
+                    await asyncio.wait_for(stop.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await run_job(job, worker_id)
+            done += 1
+            if time.time() - last_purge > PURGE_INTERVAL:
+                last_purge = time.time()
+                await main.job_queue.purge_finished(main.JOB_RETENTION_DAYS * 86400)
+                # Индекс пополняется при записи в кеш и здесь, в отличие от бота, не чистится сам
+                main.lesson_index.purge_before(datetime.now(main.LOCAL_TIMEZONE).date())
+    finally:
+        main.logger.info("👋 Воркер %s остановлен, выполнено задач: %d", worker_id, done)
+        await main.http_session.close()
+        await main.job_queue.close()
+        await main.bot.session.close()
+
+
+async def serve(worker_id: str):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await run_worker(worker_id, stop)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Воркер очереди задач бота расписания")
+    parser.add_argument('--processes', type=int, default=1, help="число процессов-воркеров")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Лимит запросов к сайту расписания общий с ботом и другими воркерами
+    main.SHARED_RATE_LIMIT = True
+
+    if args.processes == 1 or args.child:
+        asyncio.run(serve(f"{socket.gethostname()}:{os.getpid()}"))
+        return
+
+    children = [
+        subprocess.Popen([sys.executable, __file__, '--child', '--processes', str(args.processes)])
+        for _ in range(args.processes)
+    ]
+
+    def stop_children(signum, frame):
+        for child in children:
+            child.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop_children)
+    signal.signal(signal.SIGTERM, stop_children)
+    for child in children:
+        child.wait()
+
+
+if __name__ == "__main__":
+    main_cli()